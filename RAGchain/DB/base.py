@@ -4,6 +4,7 @@ from typing import List, Union, Optional
 from uuid import UUID
 
 from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import run_in_executor
 from langchain_core.runnables.utils import Input, Output
 
 from RAGchain.schema import Passage
@@ -34,6 +35,26 @@ class BaseDB(Runnable[List[Passage], List[Passage]], ABC):
         """Abstract method for loading existed database."""
         pass
 
+    def is_stale(self) -> bool:
+        """
+        Whether the database must be loaded before use, because it is not loaded yet
+        or it was changed by another DB instance.
+        Default is always True. Override this when the DB can check it cheaply.
+        """
+        return True
+
+    def load_if_stale(self):
+        """Loads the database only when it is stale, so the loaded DB instance can be reused for each fetch."""
+        if self.is_stale():
+            self.load()
+
+    def close(self):
+        """
+        Releases resources of the DB instance. It is called when the DB registry is closed.
+        Default does nothing.
+        """
+        pass
+
     @abstractmethod
     def create_or_load(self, *args, **kwargs):
         """Abstract method for creating a new database or loading existing database."""
@@ -75,6 +96,28 @@ class BaseDB(Runnable[List[Passage], List[Passage]], ABC):
         """
         pass
 
+    async def afetch(self, ids: List[UUID]) -> List[Passage]:
+        """
+        Async version of fetch.
+        Default implementation runs fetch in the default executor. Override this with an async client.
+        """
+        return await run_in_executor(None, self.fetch, ids)
+
+    async def asearch(self,
+                      id: Optional[List[Union[UUID, str]]] = None,
+                      content: Optional[List[str]] = None,
+                      filepath: Optional[List[str]] = None,
+                      content_datetime_range: Optional[List[tuple[datetime, datetime]]] = None,
+                      importance: Optional[List[int]] = None,
+                      **kwargs
+                      ) -> List[Passage]:
+        """
+        Async version of search.
+        Default implementation runs search in the default executor. Override this with an async client.
+        """
+        return await run_in_executor(None, self.search, id, content, filepath, content_datetime_range,
+                                     importance, **kwargs)
+
     @abstractmethod
     def get_db_origin(self) -> DBOrigin:
         """DBOrigin: Abstract method for retrieving DBOrigin of the database."""
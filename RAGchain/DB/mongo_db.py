@@ -1,3 +1,5 @@
+import asyncio
+import threading
 from datetime import datetime
 from typing import List, Optional, Union
 from uuid import UUID
@@ -5,16 +7,33 @@ from uuid import UUID
 import pymongo
 from pymongo import UpdateOne
 
+try:
+    # native asyncio client of pymongo>=4.9, which replaces motor
+    from pymongo import AsyncMongoClient
+except ImportError:
+    AsyncMongoClient = None
+
 from RAGchain import linker
 from RAGchain.DB.base import BaseDB
+from RAGchain.DB.registry import db_registry
 from RAGchain.schema import Passage
 from RAGchain.schema.db_origin import DBOrigin
+from RAGchain.utils.linker import db_origin_table
 
 
 class MongoDB(BaseDB):
     """
     MongoDB class for using MongoDB as a database for passage contents.
+    MongoClient is shared between MongoDB instances with the same mongo_url, so they share one connection pool.
+    afetch and asearch use AsyncMongoClient of pymongo, which is shared in the same way.
+    With pymongo older than 4.9, they run fetch and search in the default executor.
     """
+    _clients: dict[str, pymongo.MongoClient] = {}
+    _async_clients: dict[str, 'AsyncMongoClient'] = {}
+    _async_client_loops: dict[str, Optional[asyncio.AbstractEventLoop]] = {}
+    _closing_tasks: set = set()
+    _clients_lock = threading.Lock()
+
     def __init__(self, mongo_url: str, db_name: str, collection_name: str, *args, **kwargs):
         """
         :param mongo_url: str, the url of mongoDB server.
@@ -47,6 +66,10 @@ class MongoDB(BaseDB):
             raise ValueError(f'{self.collection_name} does not exist')
         self.collection = self.db.get_collection(self.collection_name)
 
+    def is_stale(self) -> bool:
+        """MongoDB always serves the latest passages, so it needs to be loaded only once."""
+        return self.collection is None
+
     def create_or_load(self):
         """Creates the collection if it does not exist, otherwise loads it."""
         self.set_db()
@@ -61,7 +84,8 @@ class MongoDB(BaseDB):
         dict_passages = list(map(lambda x: x.to_dict(), passages))
         # Setting up files for saving to 'linker'
         id_list = list(map(lambda x: str(x.id), passages))
-        db_origin_list = [self.get_db_origin().to_dict() for _ in passages]
+        db_origin = self.get_db_origin().to_dict()
+        origin_id, origin_key = db_origin_table.register(db_origin)
 
         # save to 'mongodb'
         if upsert:
@@ -79,8 +103,8 @@ class MongoDB(BaseDB):
         else:
             self.collection.insert_many(dict_passages)
 
-        # save to 'linker'
-        linker.put_json(id_list, db_origin_list)
+        # save to 'linker'. Passage ids store only the origin key, and the DB origin is stored once.
+        linker.put_json([origin_id] + id_list, [db_origin] + [origin_key] * len(id_list))
 
     def fetch(self, ids: List[UUID]) -> List[Passage]:
         """Fetches the passages from MongoDB collection by their passage ids."""
@@ -99,6 +123,46 @@ class MongoDB(BaseDB):
                importance: Optional[List[int]] = None,
                **kwargs
                ) -> List[Passage]:
+        cursor = self.collection.find(self.__make_filter(id, content, filepath, content_datetime_range,
+                                                         importance, **kwargs))
+        result = list()
+        for passage in cursor:
+            _id = passage.pop('_id')
+            result.append(Passage(id=_id, **passage))
+        return result
+
+    async def afetch(self, ids: List[UUID]) -> List[Passage]:
+        """Fetches the passages from MongoDB collection with AsyncMongoClient."""
+        if AsyncMongoClient is None:
+            return await super().afetch(ids)
+        dict_passages = await self.__async_collection().find({"_id": {"$in": ids}}).to_list(None)
+        return [Passage(id=dict_passage.pop('_id'), **dict_passage) for dict_passage in dict_passages]
+
+    async def asearch(self,
+                      id: Optional[List[Union[UUID, str]]] = None,
+                      content: Optional[List[str]] = None,
+                      filepath: Optional[List[str]] = None,
+                      content_datetime_range: Optional[List[tuple[datetime, datetime]]] = None,
+                      importance: Optional[List[int]] = None,
+                      **kwargs
+                      ) -> List[Passage]:
+        if AsyncMongoClient is None:
+            return await super().asearch(id, content, filepath, content_datetime_range, importance, **kwargs)
+        cursor = self.__async_collection().find(self.__make_filter(id, content, filepath, content_datetime_range,
+                                                                   importance, **kwargs))
+        return [Passage(id=passage.pop('_id'), **passage) for passage in await cursor.to_list(None)]
+
+    def __async_collection(self):
+        client = self.get_async_client(self.mongo_url)
+        return client.get_database(self.db_name).get_collection(self.collection_name)
+
+    @staticmethod
+    def __make_filter(id: Optional[List[Union[UUID, str]]] = None,
+                      content: Optional[List[str]] = None,
+                      filepath: Optional[List[str]] = None,
+                      content_datetime_range: Optional[List[tuple[datetime, datetime]]] = None,
+                      importance: Optional[List[int]] = None,
+                      **kwargs) -> dict:
         filter_dict = {}
         if id is not None:
             filter_dict["_id"] = {'$in': id}
@@ -114,16 +178,104 @@ class MongoDB(BaseDB):
         if kwargs is not None and len(kwargs) > 0:
             for key, value in kwargs.items():
                 filter_dict[f'metadata_etc.{key}'] = {'$in': value}
+        return filter_dict
 
-        cursor = self.collection.find(filter_dict)
-        result = list()
-        for passage in cursor:
-            _id = passage.pop('_id')
-            result.append(Passage(id=_id, **passage))
-        return result
+    @classmethod
+    def get_client(cls, mongo_url: str) -> pymongo.MongoClient:
+        """Returns the shared MongoClient of the mongo_url. It is created at the first call."""
+        with cls._clients_lock:
+            client = cls._clients.get(mongo_url)
+            if client is None:
+                client = pymongo.MongoClient(mongo_url, uuidRepresentation='standard')
+                cls._clients[mongo_url] = client
+            return client
+
+    @classmethod
+    def get_async_client(cls, mongo_url: str) -> 'AsyncMongoClient':
+        """
+        Returns the shared AsyncMongoClient of the mongo_url. It is created at the first call.
+        AsyncMongoClient is bound to the event loop where it is created, so call this in the event loop.
+        """
+        if AsyncMongoClient is None:
+            raise ImportError("AsyncMongoClient needs pymongo>=4.9. Please upgrade pymongo.")
+        with cls._clients_lock:
+            client = cls._async_clients.get(mongo_url)
+            if client is None:
+                client = AsyncMongoClient(mongo_url, uuidRepresentation='standard')
+                cls._async_clients[mongo_url] = client
+                cls._async_client_loops[mongo_url] = cls.__running_loop()
+            return client
+
+    @classmethod
+    def close_clients(cls):
+        """
+        Closes every shared MongoClient and AsyncMongoClient. It is called when the DB registry is closed.
+        AsyncMongoClient is closed at its event loop. When the loop is running,
+        closing is scheduled at the loop, so use aclose_clients to wait for it.
+        """
+        clients, async_clients = cls.__pop_clients()
+        for client in clients:
+            client.close()
+        for client, loop in async_clients:
+            cls.__close_async_client(client, loop)
+
+    @classmethod
+    async def aclose_clients(cls):
+        """
+        Async version of close_clients. AsyncMongoClients of the running event loop are closed with await.
+        """
+        clients, async_clients = cls.__pop_clients()
+        for client in clients:
+            client.close()
+        running_loop = asyncio.get_running_loop()
+        for client, loop in async_clients:
+            if loop is running_loop:
+                await client.close()
+            else:
+                cls.__close_async_client(client, loop)
+
+    @classmethod
+    def __pop_clients(cls) -> tuple[list, list]:
+        with cls._clients_lock:
+            clients = list(cls._clients.values())
+            async_clients = [(client, cls._async_client_loops.get(mongo_url))
+                             for mongo_url, client in cls._async_clients.items()]
+            cls._clients.clear()
+            cls._async_clients.clear()
+            cls._async_client_loops.clear()
+        return clients, async_clients
+
+    @staticmethod
+    def __close_async_client(client: 'AsyncMongoClient', loop: Optional[asyncio.AbstractEventLoop]):
+        if loop is None or loop.is_closed():
+            # the client was never used in a loop, or its sockets and tasks are gone with the closed loop
+            return
+        if loop.is_running():
+            if loop is MongoDB.__running_loop():
+                # keep the task referenced until it finishes
+                task = loop.create_task(client.close())
+                MongoDB._closing_tasks.add(task)
+                task.add_done_callback(MongoDB._closing_tasks.discard)
+            else:
+                asyncio.run_coroutine_threadsafe(client.close(), loop)
+        else:
+            loop.run_until_complete(client.close())
+
+    @staticmethod
+    def __running_loop() -> Optional[asyncio.AbstractEventLoop]:
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+
+    def close(self):
+        """Releases the collection. The shared MongoClient is closed at MongoDB.close_clients."""
+        self.collection = None
+        self.db = None
+        self.client = None
 
     def set_db(self):
-        self.client = pymongo.MongoClient(self.mongo_url, uuidRepresentation='standard')
+        self.client = self.get_client(self.mongo_url)
         if self.db_name not in self.client.list_database_names():
             raise ValueError(f'{self.db_name} does not exists')
         self.db = self.client.get_database(self.db_name)
@@ -134,3 +286,6 @@ class MongoDB(BaseDB):
         """
         db_path = {'mongo_url': self.mongo_url, 'db_name': self.db_name, 'collection_name': self.collection_name}
         return DBOrigin(db_type=self.db_type, db_path=db_path)
+
+
+db_registry.add_close_hook(MongoDB.close_clients)
@@ -1,31 +1,75 @@
+import bisect
 import os
 import pickle
+import threading
+import warnings
 from datetime import datetime
-from typing import List, Optional, Union
+from typing import List, Optional, Union, Any, Iterator, Callable
 from uuid import UUID
 
 from RAGchain import linker
 from RAGchain.DB.base import BaseDB
 from RAGchain.schema import Passage
 from RAGchain.schema.db_origin import DBOrigin
+from RAGchain.utils.linker import db_origin_table
 from RAGchain.utils.util import FileChecker
 
 
 class PickleDB(BaseDB):
     """
     This DB stores passages in a pickle file format at your local disk.
+    Passages are kept in a dict keyed by passage id, so fetch takes O(1) per id.
+    Search uses hash indexes of filepath, importance and metadata_etc keys, and a sorted index of content_datetime.
+    The indexes are built at the first search and updated at each save.
+    They are built under a lock of the instance, and published only when they are complete.
+    A small query planner estimates the matched passages of each filter with the indexes, and starts from
+    the most selective filter. Filters that match more passages than the current candidates are checked
+    per candidate instead of looking up the index.
+
+    Saved passages are appended to a log file ({save_path}.log) instead of rewriting the whole pickle file.
+    When the log gets larger than snapshot_ratio of the passages, all passages are written to the pickle file
+    (snapshot) and the log is cleared. The pickle file is a pickled list of passages, same as previous versions.
+
+    The modification time and size of the pickle file and the log are recorded at load and save.
+    So load_if_stale loads the files again only when another DB instance or process changed them.
     """
 
-    def __init__(self, save_path: str):
+    def __init__(self, save_path: str, snapshot_ratio: float = 0.5,
+                 index_metadata_keys: Optional[List[str]] = None):
         """
         Initializes a PickleDB object.
 
         :param save_path: The path to the pickle file where the passages are stored. It must be .pickle or .pkl file.
+        :param snapshot_ratio: When the number of passages in the log exceeds this ratio of all passages,
+        the pickle file is rewritten at save. Default is 0.5.
+        :param index_metadata_keys: metadata_etc keys to build hash index. Other keys are searched by scanning.
+        Default is None, which indexes every metadata_etc key.
         :rtype: None
         """
         FileChecker(save_path).check_type(file_types=['.pickle', '.pkl'])
         self.save_path = save_path
-        self.db: List[Passage] = list()
+        self.snapshot_ratio = snapshot_ratio
+        self.index_metadata_keys = index_metadata_keys
+        self._passages: dict[str, Passage] = dict()
+        self._indexes: Optional[dict[Union[str, tuple], dict[Any, set[str]]]] = None
+        self._unindexable_keys: set = set()
+        # content_datetime of passages in sorted order, and passage ids in the same order
+        self._datetime_keys: Optional[List[datetime]] = None
+        self._datetime_ids: List[str] = []
+        self._log_count = 0
+        # (mtime, size) of the pickle file and the log when this instance loaded or saved them
+        self._generation: Optional[tuple] = None
+        # guards building the indexes, load and passage updates of save
+        self._lock = threading.Lock()
+
+    @property
+    def db(self) -> List[Passage]:
+        """All passages in the database."""
+        return list(self._passages.values())
+
+    @property
+    def log_path(self) -> str:
+        return f'{self.save_path}.log'
 
     @property
     def db_type(self) -> str:
@@ -41,11 +85,29 @@ class PickleDB(BaseDB):
         self.save_path = self.save_path
 
     def load(self):
-        """Loads the data from the existing pickle file into the database."""
+        """Loads the data from the existing pickle file and its log into the database."""
         if not FileChecker(self.save_path).check_type(file_types=['.pickle', '.pkl']).is_exist():
             raise FileNotFoundError(f'{self.save_path} does not exist')
+        # read generation first, so changes made while loading are detected at the next check
+        generation = self._file_generation()
         with open(self.save_path, 'rb') as f:
-            self.db = pickle.load(f)
+            passages = pickle.load(f)
+        passages = {str(passage.id): passage for passage in passages}
+        log_count = 0
+        for log_passages in self._read_log():
+            for passage in log_passages:
+                passages[str(passage.id)] = passage
+            log_count += len(log_passages)
+        with self._lock:
+            self._indexes = None
+            self._datetime_keys = None
+            self._passages = passages
+            self._log_count = log_count
+            self._generation = generation
+
+    def is_stale(self) -> bool:
+        """Whether the pickle file or the log is changed after this instance loaded or saved them."""
+        return self._generation is None or self._generation != self._file_generation()
 
     def create_or_load(self):
         """Creates a new pickle file if it doesn't exist, otherwise loads the data from the existing file."""
@@ -56,32 +118,47 @@ class PickleDB(BaseDB):
 
     def save(self, passages: List[Passage], upsert: bool = False):
         """Saves the given list of Passage objects to the pickle database. It also saves the data to the Linker."""
-        uuid_id_list = list(map(lambda x: x.id, passages))
-        str_id_list = [str(uuid_id) for uuid_id in uuid_id_list]
-        duplicate_ids = [doc.id for doc in self.fetch(uuid_id_list)]
-
-        id_to_passage = {str(passage.id): passage for passage in passages}
+        str_id_list = [str(passage.id) for passage in passages]
+        duplicate_ids = [self._passages[str_id].id for str_id in str_id_list if str_id in self._passages]
 
         # save to pickleDB
-        if len(duplicate_ids) > 0:
-            if upsert:
-                for str_id in str_id_list:
-                    if str_id in id_to_passage:
-                        self.db.remove(id_to_passage[str_id])
-            else:
-                raise ValueError(f'{duplicate_ids} already exists')
-        self.db.extend(passages)
-        self._write_pickle()
+        if len(duplicate_ids) > 0 and not upsert:
+            raise ValueError(f'{duplicate_ids} already exists')
+        with self._lock:
+            for str_id, passage in zip(str_id_list, passages):
+                self._put(str_id, passage)
+        if not os.path.exists(self.save_path) or \
+                self._log_count + len(passages) > self.snapshot_ratio * len(self._passages):
+            self.snapshot()
+        else:
+            self._append_log(passages)
 
-        # save to linker
-        db_origin_list = [self.get_db_origin().to_dict() for _ in passages]
-        linker.put_json(str_id_list, db_origin_list)
+        # save to linker. Passage ids store only the origin key, and the DB origin is stored once.
+        db_origin = self.get_db_origin().to_dict()
+        origin_id, origin_key = db_origin_table.register(db_origin)
+        linker.put_json([origin_id] + str_id_list, [db_origin] + [origin_key] * len(str_id_list))
 
     def fetch(self, ids: List[UUID]) -> List[Passage]:
-        """Retrieves the Passage objects from the database based on the given list of passage IDs."""
-        result = list(filter(lambda x: x.id in ids, self.db))
-        result = list(set(result))
-        return result
+        """
+        Retrieves the Passage objects from the database based on the given list of passage IDs.
+        Passages are returned in the order of ids, and ids which are not in the database are skipped.
+        """
+        str_ids = dict.fromkeys(str(_id) for _id in ids)
+        return [self._passages[str_id] for str_id in str_ids if str_id in self._passages]
+
+    async def afetch(self, ids: List[UUID]) -> List[Passage]:
+        # passages are in memory, so there is nothing to wait
+        return self.fetch(ids)
+
+    async def asearch(self,
+                      id: Optional[List[Union[UUID, str]]] = None,
+                      content: Optional[List[str]] = None,
+                      filepath: Optional[List[str]] = None,
+                      content_datetime_range: Optional[List[tuple[datetime, datetime]]] = None,
+                      importance: Optional[List[int]] = None,
+                      **kwargs) -> List[Passage]:
+        return self.search(id=id, content=content, filepath=filepath,
+                           content_datetime_range=content_datetime_range, importance=importance, **kwargs)
 
     def search(self,
                id: Optional[List[Union[UUID, str]]] = None,
@@ -90,48 +167,223 @@ class PickleDB(BaseDB):
                content_datetime_range: Optional[List[tuple[datetime, datetime]]] = None,
                importance: Optional[List[int]] = None,
                **kwargs) -> List[Passage]:
-        def is_default_elem(filter_key: str) -> bool:
-            return filter_key in ['id', 'content', 'filepath', 'importance']
+        self._build_indexes()
+        # (estimated count, index lookup, predicate) of indexed filters, and predicates of other filters
+        plans: List[tuple[int, Callable[[], set[str]], Callable[[Passage], bool]]] = []
+        predicates: List[Callable[[Passage], bool]] = []
 
-        filter_dict = dict()
         if id is not None:
-            filter_dict['id'] = id
+            str_ids = {str(_id) for _id in id} & self._passages.keys()
+            plans.append((len(str_ids), lambda: str_ids, lambda passage: str(passage.id) in str_ids))
         if content is not None:
-            filter_dict['content'] = content
-        if filepath is not None:
-            filter_dict['filepath'] = filepath
-        if importance is not None:
-            filter_dict['importance'] = importance
-        if kwargs is not None and len(kwargs) > 0:
-            for key, value in kwargs.items():
-                filter_dict[key] = value
-
-        result = list(
-            filter(
-                lambda x: all(
-                    getattr(x, key) in value if is_default_elem(key) else x.metadata_etc.get(key) in value
-                    for key, value in filter_dict.items()
-                ),
-                self.db
-            )
-        )
+            predicates.append(lambda passage: passage.content in content)
+        for key, value in [('filepath', filepath), ('importance', importance)] + \
+                          [(('metadata_etc', key), value) for key, value in kwargs.items()]:
+            if value is None:
+                continue
+            if isinstance(key, tuple):
+                predicate = lambda passage, k=key[1], v=value: passage.metadata_etc.get(k) in v
+            else:
+                predicate = lambda passage, k=key, v=value: getattr(passage, k) in v
+            estimate = self._estimate_index(key, value)
+            if estimate is None:
+                predicates.append(predicate)
+            else:
+                plans.append((estimate, lambda k=key, v=value: self._lookup_index(k, v), predicate))
         if content_datetime_range is not None:
-            result = list(
-                filter(
-                    lambda passage: any(
-                        datetime_range[0] <= passage.content_datetime <= datetime_range[1]
-                        for datetime_range in content_datetime_range
-                    ),
-                    result
-                )
-            )
-        result = list(set(result))
-        return result
+            datetime_ranges = self._datetime_ranges(content_datetime_range)
+            plans.append((sum(end - start for start, end in datetime_ranges),
+                          lambda: {str_id for start, end in datetime_ranges
+                                   for str_id in self._datetime_ids[start:end]},
+                          lambda passage: any(start <= passage.content_datetime <= end
+                                              for start, end in content_datetime_range)))
+
+        candidates: Optional[set[str]] = None
+        for estimate, lookup, predicate in sorted(plans, key=lambda plan: plan[0]):
+            if candidates is None:
+                candidates = set(lookup())
+            elif estimate > len(candidates):
+                # checking each candidate is cheaper than looking up the index
+                predicates.append(predicate)
+            else:
+                candidates &= lookup()
+            if len(candidates) == 0:
+                return []
+
+        passages = self._passages.values() if candidates is None else \
+            [self._passages[str_id] for str_id in candidates]
+        return [passage for passage in passages if all(predicate(passage) for predicate in predicates)]
+
+    def snapshot(self):
+        """Writes all passages to the pickle file, and clears the log."""
+        self._write_pickle()
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self._log_count = 0
+        self._generation = self._file_generation()
 
     def _write_pickle(self):
-        """Writes the current database contents to the pickle file."""
-        with open(self.save_path, 'wb') as w:
-            pickle.dump(self.db, w)
+        """Writes the current database contents to the pickle file atomically."""
+        tmp_path = f'{self.save_path}.tmp'
+        with open(tmp_path, 'wb') as w:
+            pickle.dump(list(self._passages.values()), w, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.save_path)
+
+    def _append_log(self, passages: List[Passage]):
+        # when the log was changed by others, keep this instance stale to load their passages later
+        stale = self.is_stale()
+        with open(self.log_path, 'ab') as w:
+            pickle.dump(list(passages), w, protocol=pickle.HIGHEST_PROTOCOL)
+        self._log_count += len(passages)
+        if not stale:
+            self._generation = self._file_generation()
+
+    def _file_generation(self) -> tuple:
+        generation = []
+        for path in [self.save_path, self.log_path]:
+            try:
+                stat = os.stat(path)
+                generation.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                generation.append(None)
+        return tuple(generation)
+
+    def _read_log(self) -> Iterator[List[Passage]]:
+        """
+        Reads saved passages from the log. If the last record is broken by an interrupted save, it is truncated.
+        """
+        if not os.path.exists(self.log_path):
+            return
+        log_size = os.path.getsize(self.log_path)
+        with open(self.log_path, 'rb') as f:
+            while True:
+                position = f.tell()
+                try:
+                    passages = pickle.load(f)
+                except EOFError:
+                    if position == log_size:
+                        return
+                except (pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+                    pass
+                else:
+                    yield passages
+                    continue
+                warnings.warn(f'Broken record at {self.log_path} is truncated.')
+                with open(self.log_path, 'r+b') as w:
+                    w.truncate(position)
+                return
+
+    def _put(self, str_id: str, passage: Passage):
+        old_passage = self._passages.get(str_id)
+        if self._indexes is not None:
+            if old_passage is not None:
+                self._update_indexes(str_id, old_passage, remove=True)
+            self._update_indexes(str_id, passage)
+        if self._datetime_keys is not None:
+            if old_passage is not None:
+                start = bisect.bisect_left(self._datetime_keys, old_passage.content_datetime)
+                end = bisect.bisect_right(self._datetime_keys, old_passage.content_datetime)
+                position = self._datetime_ids.index(str_id, start, end)
+                del self._datetime_keys[position]
+                del self._datetime_ids[position]
+            position = bisect.bisect_right(self._datetime_keys, passage.content_datetime)
+            self._datetime_keys.insert(position, passage.content_datetime)
+            self._datetime_ids.insert(position, str_id)
+        self._passages[str_id] = passage
+
+    def _index_items(self, passage: Passage) -> List[tuple[Union[str, tuple], Any]]:
+        metadata_keys = passage.metadata_etc.keys() if self.index_metadata_keys is None else \
+            [key for key in self.index_metadata_keys if key in passage.metadata_etc]
+        return [('filepath', passage.filepath), ('importance', passage.importance)] + \
+            [(('metadata_etc', key), passage.metadata_etc[key]) for key in metadata_keys]
+
+    def _build_indexes(self):
+        """
+        Build the indexes if they are not built yet.
+        They are built into local variables, and published after they are complete,
+        so concurrent searches never see a partially built index.
+        """
+        if self._indexes is not None and self._datetime_keys is not None:
+            return
+        with self._lock:
+            if self._indexes is None:
+                indexes, unindexable_keys = {}, set()
+                for str_id, passage in self._passages.items():
+                    self._update_indexes(str_id, passage, indexes=indexes, unindexable_keys=unindexable_keys)
+                self._unindexable_keys = unindexable_keys
+                self._indexes = indexes
+            if self._datetime_keys is None:
+                items = sorted(((passage.content_datetime, str_id) for str_id, passage in self._passages.items()),
+                               key=lambda item: item[0])
+                self._datetime_ids = [item[1] for item in items]
+                self._datetime_keys = [item[0] for item in items]
+
+    def _update_indexes(self, str_id: str, passage: Passage, remove: bool = False,
+                        indexes: Optional[dict] = None, unindexable_keys: Optional[set] = None):
+        """
+        Add or remove the passage at the hash indexes.
+        :param indexes: indexes to update. Default is the published indexes of the instance.
+        :param unindexable_keys: keys which can't be indexed. Default is the one of the instance.
+        """
+        indexes = self._indexes if indexes is None else indexes
+        unindexable_keys = self._unindexable_keys if unindexable_keys is None else unindexable_keys
+        for key, value in self._index_items(passage):
+            if key in unindexable_keys:
+                continue
+            try:
+                if remove:
+                    indexes.get(key, {}).get(value, set()).discard(str_id)
+                else:
+                    indexes.setdefault(key, {}).setdefault(value, set()).add(str_id)
+            except TypeError:
+                # unhashable value, so this key is searched without index
+                unindexable_keys.add(key)
+                indexes.pop(key, None)
+
+    def _is_indexed(self, key: Union[str, tuple], values: list) -> bool:
+        if key in self._unindexable_keys:
+            return False
+        if isinstance(key, tuple):
+            if self.index_metadata_keys is not None and key[1] not in self.index_metadata_keys:
+                return False
+            # passages without the metadata key match None, and they are not in the index
+            if None in values:
+                return False
+        try:
+            for value in values:
+                hash(value)
+        except TypeError:
+            return False
+        return True
+
+    def _estimate_index(self, key: Union[str, tuple], values: list) -> Optional[int]:
+        """
+        Get the number of passages whose value of the key is in values.
+        :return: None if the key can't be searched with index.
+        """
+        if not self._is_indexed(key, values):
+            return None
+        index = self._indexes.get(key, {})
+        return sum(len(index.get(value, ())) for value in set(values))
+
+    def _lookup_index(self, key: Union[str, tuple], values: list) -> set[str]:
+        index = self._indexes.get(key, {})
+        result = set()
+        for value in set(values):
+            result |= index.get(value, set())
+        return result
+
+    def _datetime_ranges(self, content_datetime_range: List[tuple[datetime, datetime]]) -> List[tuple[int, int]]:
+        """
+        Get [start, end) positions of the datetime index for each datetime range.
+        """
+        result = []
+        for start_datetime, end_datetime in content_datetime_range:
+            start = bisect.bisect_left(self._datetime_keys, start_datetime)
+            end = bisect.bisect_right(self._datetime_keys, end_datetime)
+            if start < end:
+                result.append((start, end))
+        return result
 
     def get_db_origin(self) -> DBOrigin:
         """Returns a DBOrigin object that represents the origin of the database."""
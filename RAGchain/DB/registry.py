@@ -0,0 +1,110 @@
+import threading
+from typing import Callable, Dict, List
+
+from langchain_core.runnables.config import run_in_executor
+
+from RAGchain.DB.base import BaseDB
+from RAGchain.schema.db_origin import DBOrigin
+
+
+class DBRegistry:
+    """
+    Process-wide registry of DB instances, keyed by DBOrigin.
+    Every retrieval gets the same DB instance for the same DB origin, so each DB is created and loaded once
+    in the process, and clients like MongoClient are not duplicated.
+    It is thread-safe, so fetching from many DBs in the worker threads does not create duplicate DB instances.
+
+    :example:
+    >>> from RAGchain.DB.registry import db_registry
+    >>> db = db_registry.get(DBOrigin(db_type='pickle_db', db_path={'save_path': './db.pkl'}), create_db)
+    >>> db_registry.close()
+    """
+
+    def __init__(self):
+        self._instances: Dict[DBOrigin, BaseDB] = {}
+        self._load_locks: Dict[DBOrigin, threading.Lock] = {}
+        self._close_hooks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def get(self, db_origin: DBOrigin, create_db: Callable[[str, dict], BaseDB]) -> BaseDB:
+        """
+        Returns the DB instance of the db_origin. It is created with create_db at the first call.
+        :param db_origin: DBOrigin of the DB.
+        :param create_db: function that makes a DB instance from db_type and db_path.
+        """
+        db, _ = self._get_with_load_lock(db_origin, create_db)
+        return db
+
+    def get_loaded(self, db_origin: DBOrigin, create_db: Callable[[str, dict], BaseDB]) -> BaseDB:
+        """
+        Returns the DB instance of the db_origin, after loading it if it is stale.
+        Only one thread loads the same DB at once.
+        """
+        db, load_lock = self._get_with_load_lock(db_origin, create_db)
+        with load_lock:
+            db.load_if_stale()
+        return db
+
+    def _get_with_load_lock(self, db_origin: DBOrigin, create_db: Callable[[str, dict], BaseDB]) -> tuple[
+        BaseDB, threading.Lock]:
+        """
+        Returns the DB instance and its load lock together, so concurrent close or register doesn't
+        remove the load lock between them.
+        """
+        with self._lock:
+            db = self._instances.get(db_origin)
+            if db is None:
+                db = create_db(db_origin.db_type, dict(db_origin.db_path))
+                self._instances[db_origin] = db
+            return db, self._load_locks.setdefault(db_origin, threading.Lock())
+
+    async def aget_loaded(self, db_origin: DBOrigin, create_db: Callable[[str, dict], BaseDB]) -> BaseDB:
+        """
+        Async version of get_loaded. Loading runs in the default executor only when the DB is stale.
+        """
+        db = self.get(db_origin, create_db)
+        if db.is_stale():
+            await run_in_executor(None, self.get_loaded, db_origin, create_db)
+        return db
+
+    def register(self, db: BaseDB):
+        """
+        Registers the DB instance that you made, so retrievals use it instead of making a new one.
+        It replaces the registered DB instance of the same DB origin, and the replaced instance is closed.
+        """
+        db_origin = db.get_db_origin()
+        with self._lock:
+            replaced = self._instances.get(db_origin)
+            self._instances[db_origin] = db
+            self._load_locks.setdefault(db_origin, threading.Lock())
+        if replaced is not None and replaced is not db:
+            replaced.close()
+
+    def add_close_hook(self, hook: Callable[[], None]):
+        """Adds a function that is called at close, for releasing resources shared by DB instances."""
+        with self._lock:
+            if hook not in self._close_hooks:
+                self._close_hooks.append(hook)
+
+    def close(self):
+        """Closes every registered DB instance and calls the close hooks. The registry is empty after close."""
+        with self._lock:
+            instances = list(self._instances.values())
+            hooks = list(self._close_hooks)
+            self._instances.clear()
+            self._load_locks.clear()
+        for db in instances:
+            db.close()
+        for hook in hooks:
+            hook()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._instances)
+
+    def __contains__(self, db_origin: DBOrigin):
+        with self._lock:
+            return db_origin in self._instances
+
+
+db_registry = DBRegistry()
@@ -3,7 +3,7 @@ __version__ = '0.2.6'
 # Sets the linker, which is required to use RAGchain.
 import os
 
-from RAGchain.utils.linker import RedisLinker, DynamoLinker, JsonLinker
+from RAGchain.utils.linker import RedisLinker, DynamoLinker, JsonLinker, CachedLinker
 
 linker_type = os.getenv("LINKER_TYPE")
 if linker_type == "redisdb":
@@ -14,3 +14,10 @@ elif linker_type == "json":
     linker = JsonLinker()
 else:
     raise ValueError("Please set LINKER_TYPE to environment variable")
+
+# Optional in-process cache of the linker. Set LINKER_CACHE_SIZE to enable it.
+linker_cache_size = os.getenv("LINKER_CACHE_SIZE")
+if linker_cache_size and int(linker_cache_size) > 0:
+    linker_cache_ttl = os.getenv("LINKER_CACHE_TTL")
+    linker = CachedLinker(linker, max_size=int(linker_cache_size),
+                          ttl=float(linker_cache_ttl) if linker_cache_ttl else 300.0)
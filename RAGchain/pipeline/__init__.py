@@ -2,3 +2,4 @@ from .basic import BasicIngestPipeline, BasicRunPipeline
 from .rerank import RerankRunPipeline
 from .visconde import ViscondeRunPipeline
 from .google_search import GoogleSearchRunPipeline
+from .semantic_cache import SemanticCache
@@ -1,12 +1,15 @@
+import time
 from abc import ABC, abstractmethod
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Iterator, AsyncIterator, Any
 
 from langchain.chat_models.base import BaseChatModel
 from langchain.llms import BaseLLM
 from langchain.schema.language_model import BaseLanguageModel
-from langchain.schema.runnable import Runnable
+from langchain.schema.runnable import Runnable, RunnableLambda, RunnableConfig
 
-from RAGchain.schema import Passage, RAGchainPromptTemplate, RAGchainChatPromptTemplate
+from RAGchain.schema import Passage, RAGchainPromptTemplate, RAGchainChatPromptTemplate, RetrievalResult, \
+    StreamEvent
+from RAGchain.utils.cache import BaseCache, make_cache_key, normalize_query
 
 
 class BaseIngestPipeline(ABC):
@@ -27,6 +30,8 @@ class BaseIngestPipeline(ABC):
 
 
 class BaseRunPipeline(ABC):
+    answer_cache: Optional[BaseCache] = None
+    """cache of answers of pipeline.run. Default is None, which disables caching."""
     default_prompt = RAGchainPromptTemplate.from_template(
         """
         Given the information, answer the question. If you don't know the answer, don't make up 
@@ -77,6 +82,102 @@ class BaseRunPipeline(ABC):
         """
         pass
 
+    def _stream_run(self, question: str, top_k: int, retrieval: Runnable,
+                    stages: List[tuple[str, Runnable]], answer_runnable: Runnable) -> Iterator[StreamEvent]:
+        """
+        Run the pipeline stage by stage, and yield the result of each stage as soon as it is ready.
+        :param question: question to answer.
+        :param top_k: The number of passages to retrieve.
+        :param retrieval: runnable that gets question and returns RetrievalResult.
+        :param stages: (stage name, runnable) pairs that get RetrievalResult and return RetrievalResult.
+        :param answer_runnable: runnable that gets RetrievalResult and streams answer tokens.
+        """
+        start = time.perf_counter()
+        result: RetrievalResult = retrieval.invoke(question, config={
+            "configurable": {"retrieval_options": {"top_k": top_k}}})
+        yield StreamEvent(stage='retrieval', data=result, elapsed=time.perf_counter() - start)
+        for stage, runnable in stages:
+            result = runnable.invoke(result)
+            yield StreamEvent(stage=stage, data=result, elapsed=time.perf_counter() - start)
+        tokens = []
+        for token in answer_runnable.stream(result):
+            tokens.append(token)
+            yield StreamEvent(stage='answer', data=token, elapsed=time.perf_counter() - start)
+        yield StreamEvent(stage='end', data=''.join(tokens), elapsed=time.perf_counter() - start)
+
+    async def _astream_run(self, question: str, top_k: int, retrieval: Runnable,
+                           stages: List[tuple[str, Runnable]], answer_runnable: Runnable) -> AsyncIterator[StreamEvent]:
+        """
+        Async version of _stream_run.
+        """
+        start = time.perf_counter()
+        result: RetrievalResult = await retrieval.ainvoke(question, config={
+            "configurable": {"retrieval_options": {"top_k": top_k}}})
+        yield StreamEvent(stage='retrieval', data=result, elapsed=time.perf_counter() - start)
+        for stage, runnable in stages:
+            result = await runnable.ainvoke(result)
+            yield StreamEvent(stage=stage, data=result, elapsed=time.perf_counter() - start)
+        tokens = []
+        async for token in answer_runnable.astream(result):
+            tokens.append(token)
+            yield StreamEvent(stage='answer', data=token, elapsed=time.perf_counter() - start)
+        yield StreamEvent(stage='end', data=''.join(tokens), elapsed=time.perf_counter() - start)
+
+    def _with_answer_cache(self, runnable: Runnable) -> Runnable:
+        """
+        Wrap the runnable with answer_cache. The answer of the same normalized question, retrieval options
+        and index generation of the retrieval is returned from the cache without running the runnable.
+        Questions that are not str are not cached.
+        :param runnable: runnable that gets question and returns answer.
+        """
+        if self.answer_cache is None:
+            return runnable
+
+        def run(input: Any, config: RunnableConfig):
+            cache_key = self._answer_cache_key(input, config)
+            if cache_key is not None:
+                answer = self.answer_cache.get(cache_key)
+                if answer is not None:
+                    return answer
+            answer = runnable.invoke(input, config)
+            if cache_key is not None:
+                self.answer_cache.set(cache_key, answer)
+            return answer
+
+        async def arun(input: Any, config: RunnableConfig):
+            cache_key = self._answer_cache_key(input, config)
+            if cache_key is not None:
+                answer = self.answer_cache.get(cache_key)
+                if answer is not None:
+                    return answer
+            answer = await runnable.ainvoke(input, config)
+            if cache_key is not None:
+                self.answer_cache.set(cache_key, answer)
+            return answer
+
+        return RunnableLambda(run, afunc=arun)
+
+    def _answer_cache_key(self, question: Any, config: Optional[RunnableConfig]) -> Optional[str]:
+        """
+        Cache key of the answer. It is made of the pipeline class, the normalized question, retrieval options,
+        the cache identity and index generation of the retrieval, the llm, the prompt and _answer_cache_options.
+        Returns None if the question can't be cached.
+        """
+        if not isinstance(question, str):
+            return None
+        retrieval_options = (config or {}).get('configurable', {}).get('retrieval_options', {})
+        retrieval = getattr(self, 'retrieval', None)
+        llm = getattr(self, 'llm', None)
+        return make_cache_key(type(self).__name__, normalize_query(question), retrieval_options,
+                              retrieval.cache_identity() if retrieval is not None else None,
+                              retrieval.index_generation if retrieval is not None else None,
+                              type(llm).__name__, getattr(llm, '_identifying_params', None),
+                              getattr(self, 'prompt', None), self._answer_cache_options())
+
+    def _answer_cache_options(self) -> dict:
+        """Options of the pipeline that change the answer. Override this to add them to the answer cache key."""
+        return {}
+
     def _get_default_prompt(self, llm: BaseLanguageModel,
                             prompt: Optional[Union[RAGchainPromptTemplate, RAGchainChatPromptTemplate]] = None,
                             default_prompt: Optional[RAGchainPromptTemplate] = None,
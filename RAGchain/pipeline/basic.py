@@ -1,4 +1,4 @@
-from typing import List, Optional, Union
+from typing import List, Optional, Union, Iterator, AsyncIterator
 
 from langchain.document_loaders.base import BaseLoader
 from langchain.schema import StrOutputParser
@@ -10,7 +10,9 @@ from RAGchain.pipeline.base import BaseIngestPipeline, BaseRunPipeline
 from RAGchain.preprocess.text_splitter import RecursiveTextSplitter
 from RAGchain.preprocess.text_splitter.base import BaseTextSplitter
 from RAGchain.retrieval.base import BaseRetrieval
-from RAGchain.schema import Passage, RAGchainPromptTemplate, RAGchainChatPromptTemplate, RetrievalResult
+from RAGchain.schema import Passage, RAGchainPromptTemplate, RAGchainChatPromptTemplate, RetrievalResult, \
+    StreamEvent
+from RAGchain.utils.cache import BaseCache
 
 
 class BasicIngestPipeline(BaseIngestPipeline):
@@ -80,18 +82,33 @@ class BasicRunPipeline(BaseRunPipeline):
     >>> answer, passages, rel_scores = pipeline.get_passages_and_run(questions=["Where is the capital of Korea?"])
     >>> # Run with Langchain LCEL
     >>> answer = pipeline.run.invoke("Where is the capital of Korea?")
+    >>> # Stream retrieved passages first, and then answer tokens
+    >>> for event in pipeline.stream_passages_and_run("Where is the capital of Korea?"):
+    >>>     print(event.stage, event.elapsed, event.data)
+    >>> # Cache answers of the same question until passages are ingested to the retrieval
+    >>> from RAGchain.utils.cache import InMemoryCache
+    >>> pipeline = BasicRunPipeline(retrieval=retrieval, llm=OpenAI(), answer_cache=InMemoryCache())
     """
 
     def __init__(self, retrieval: BaseRetrieval, llm: BaseLanguageModel,
-                 prompt: Optional[Union[RAGchainPromptTemplate, RAGchainChatPromptTemplate]] = None):
+                 prompt: Optional[Union[RAGchainPromptTemplate, RAGchainChatPromptTemplate]] = None,
+                 answer_cache: Optional[BaseCache] = None):
+        """
+        :param retrieval: Retrieval module to retrieve passages.
+        :param llm: LLM module to answer the question.
+        :param prompt: Prompt to use. Default is the default prompt of the llm type.
+        :param answer_cache: Cache of answers of pipeline.run. Default is None, which disables caching.
+        Set result_cache of the retrieval to cache retrieval results too.
+        """
         self.retrieval = retrieval
         self.llm = llm
         self.prompt = self._get_default_prompt(llm, prompt)
+        self.answer_cache = answer_cache
         super().__init__()
 
     def _make_runnable(self):
-        self.run = self.retrieval | RunnableLambda(
-            RetrievalResult.to_prompt_input) | self.prompt | self.llm | StrOutputParser()
+        self.run = self._with_answer_cache(self.retrieval | RunnableLambda(
+            RetrievalResult.to_prompt_input) | self.prompt | self.llm | StrOutputParser())
 
     def get_passages_and_run(self, questions: List[str], top_k: int = 5) -> tuple[
         List[str], List[List[Passage]], List[List[float]]]:
@@ -105,3 +122,24 @@ class BasicRunPipeline(BaseRunPipeline):
         final_answers, final_passages, final_scores = (
             map(list, zip(*[(answer['answer'], answer['passages'], answer['scores']) for answer in answers])))
         return final_answers, final_passages, final_scores
+
+    def stream_passages_and_run(self, question: str, top_k: int = 5) -> Iterator[StreamEvent]:
+        """
+        Run the pipeline with streaming.
+        It yields 'retrieval' event with RetrievalResult as soon as passages are fetched,
+        'answer' events with each answer token from the llm stream, and 'end' event with the full answer.
+        Each event has elapsed seconds from the start.
+
+        :param question: question to answer.
+        :param top_k: The number of passages to retrieve. Default is 5.
+        """
+        return self._stream_run(question, top_k, self.retrieval, [], self.__answer_runnable())
+
+    def astream_passages_and_run(self, question: str, top_k: int = 5) -> AsyncIterator[StreamEvent]:
+        """
+        Async version of stream_passages_and_run.
+        """
+        return self._astream_run(question, top_k, self.retrieval, [], self.__answer_runnable())
+
+    def __answer_runnable(self):
+        return RunnableLambda(RetrievalResult.to_prompt_input) | self.prompt | self.llm | StrOutputParser()
@@ -1,4 +1,4 @@
-from typing import List, Optional, Union
+from typing import List, Optional, Union, Iterator, AsyncIterator
 
 from langchain.schema import StrOutputParser
 from langchain.schema.language_model import BaseLanguageModel
@@ -7,7 +7,9 @@ from langchain.schema.runnable import RunnableLambda
 from RAGchain.pipeline.base import BaseRunPipeline
 from RAGchain.reranker.base import BaseReranker
 from RAGchain.retrieval.base import BaseRetrieval
-from RAGchain.schema import Passage, RAGchainChatPromptTemplate, RAGchainPromptTemplate, RetrievalResult
+from RAGchain.schema import Passage, RAGchainChatPromptTemplate, RAGchainPromptTemplate, RetrievalResult, \
+    StreamEvent
+from RAGchain.utils.cache import BaseCache
 
 
 class RerankRunPipeline(BaseRunPipeline):
@@ -34,7 +36,7 @@ class RerankRunPipeline(BaseRunPipeline):
 
     def __init__(self, retrieval: BaseRetrieval, reranker: BaseReranker, llm: BaseLanguageModel,
                  prompt: Optional[Union[RAGchainPromptTemplate, RAGchainChatPromptTemplate]] = None,
-                 use_passage_count: int = 5):
+                 use_passage_count: int = 5, answer_cache: Optional[BaseCache] = None):
         """
         Initializes an instance of the RerankRunPipeline class.
 
@@ -42,18 +44,23 @@ class RerankRunPipeline(BaseRunPipeline):
         :param reranker: An instance of the Reranker module used for reranking passages.
         :param llm: An instance of the Langchain LLM module used for generating answers.
         :param use_passage_count: The number of passages to use for llm question after reranking. Default is 5.
+        :param answer_cache: Cache of answers of pipeline.run. Default is None, which disables caching.
         """
         self.retrieval = retrieval
         self.reranker = reranker
         self.llm = llm
         self.prompt = self._get_default_prompt(llm, prompt)
         self.use_passage_count = use_passage_count
+        self.answer_cache = answer_cache
         super().__init__()
 
     def _make_runnable(self):
-        self.run = self.retrieval | self.reranker | RunnableLambda(
+        self.run = self._with_answer_cache(self.retrieval | self.reranker | RunnableLambda(
             lambda x: x.slice(
-                end=self.use_passage_count).to_prompt_input()) | self.prompt | self.llm | StrOutputParser()
+                end=self.use_passage_count).to_prompt_input()) | self.prompt | self.llm | StrOutputParser())
+
+    def _answer_cache_options(self) -> dict:
+        return {'reranker': type(self.reranker).__name__, 'use_passage_count': self.use_passage_count}
 
     def get_passages_and_run(self, questions: List[str], top_k: int = 5) -> tuple[
         List[str], List[List[Passage]], List[List[float]]]:
@@ -66,3 +73,29 @@ class RerankRunPipeline(BaseRunPipeline):
         answers, passages, rel_scores = zip(
             *[(answer['answers'], answer['passages'], answer['scores']) for answer in result])
         return answers, passages, rel_scores
+
+    def stream_passages_and_run(self, question: str, top_k: int = 5) -> Iterator[StreamEvent]:
+        """
+        Run the pipeline with streaming.
+        It yields 'retrieval' event with retrieved RetrievalResult, 'rerank' event with reranked and sliced
+        RetrievalResult, 'answer' events with each answer token from the llm stream,
+        and 'end' event with the full answer. Each event has elapsed seconds from the start.
+
+        :param question: question to answer.
+        :param top_k: The number of passages to retrieve before reranking. Default is 5.
+        """
+        return self._stream_run(question, top_k, self.retrieval, self.__stages(), self.__answer_runnable())
+
+    def astream_passages_and_run(self, question: str, top_k: int = 5) -> AsyncIterator[StreamEvent]:
+        """
+        Async version of stream_passages_and_run.
+        """
+        return self._astream_run(question, top_k, self.retrieval, self.__stages(), self.__answer_runnable())
+
+    def __stages(self):
+        # rerankers replace passages of the input RetrievalResult, so rerank a copy to keep the retrieval event
+        return [('rerank', RunnableLambda(lambda x: x.copy()) | self.reranker |
+                 RunnableLambda(lambda x: x.slice(end=self.use_passage_count)))]
+
+    def __answer_runnable(self):
+        return RunnableLambda(RetrievalResult.to_prompt_input) | self.prompt | self.llm | StrOutputParser()
@@ -0,0 +1,188 @@
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Any
+
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import run_in_executor
+from langchain_core.runnables.utils import Input, Output
+
+from RAGchain.pipeline.base import BaseRunPipeline
+from RAGchain.utils.cache import make_cache_key
+
+
+class SemanticCache(Runnable[str, dict]):
+    """
+    Semantic answer cache in front of a run pipeline.
+    Questions are embedded, and the answer and passages of the most similar cached question are returned
+    when the cosine similarity is at least threshold. So paraphrased questions don't run retrieval and llm again.
+    Cached questions are kept in an in-process vector index, which is bounded by max_size with LRU eviction.
+    Every cached entry is dropped when the index generation of the pipeline retrieval changes,
+    so answers of the previous index are not returned after ingest or delete.
+
+    The output is a dict with 'answer', 'passages' and 'scores' keys, same as get_passages_and_run,
+    and 'similarity' key, which is the similarity with the cached question or None at cache miss.
+
+    :example:
+    >>> from RAGchain.pipeline import BasicRunPipeline, SemanticCache
+    >>> from RAGchain.utils.embed import EmbeddingFactory
+    >>> pipeline = BasicRunPipeline(retrieval=retrieval, llm=llm)
+    >>> cache = SemanticCache(pipeline, EmbeddingFactory('openai').get(), threshold=0.95)
+    >>> result = cache.invoke("Where is the capital of Korea?",
+    >>>                       config={"configurable": {"retrieval_options": {"top_k": 5}}})
+    >>> print(result['answer'], result['similarity'])
+    """
+
+    def __init__(self, pipeline: BaseRunPipeline, embeddings: Embeddings, threshold: float = 0.95,
+                 max_size: int = 1024):
+        """
+        :param pipeline: run pipeline to answer questions at cache miss.
+        It must implement get_passages_and_run.
+        :param embeddings: embedding model to embed questions. Use the embedding model of the pipeline retrieval
+        to avoid loading another model.
+        :param threshold: min cosine similarity to return the cached answer. Default is 0.95.
+        :param max_size: max number of cached questions. The least recently used question is evicted first.
+        Default is 1024.
+        """
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("threshold must be in (0, 1]")
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.pipeline = pipeline
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._vectors: Optional[np.ndarray] = None
+        # retrieval options key of each slot. Empty slots are None.
+        self._slot_options: List[Optional[str]] = [None] * max_size
+        # slot -> cached result. The order is LRU order.
+        self._entries: OrderedDict[int, dict] = OrderedDict()
+        self._free_slots: List[int] = list(reversed(range(max_size)))
+        self._generation = self.__index_generation()
+        self._lock = threading.Lock()
+
+    def invoke(self, input: Input, config: Optional[RunnableConfig] = None) -> Output:
+        question = str(input)
+        top_k, options_key = self.__options(config)
+        generation = self.__index_generation()
+        vector = self.__normalize(self.embeddings.embed_query(question))
+        cached = self.lookup(vector, options_key)
+        if cached is not None:
+            return cached
+        answers, passages, scores = self.pipeline.get_passages_and_run([question], top_k=top_k)
+        return self.update(vector, options_key, answers[0], passages[0], scores[0], generation)
+
+    async def ainvoke(self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Output:
+        """
+        Async version of invoke. The question is embedded with aembed_query,
+        and the pipeline runs in the default executor at cache miss.
+        """
+        question = str(input)
+        top_k, options_key = self.__options(config)
+        generation = self.__index_generation()
+        vector = self.__normalize(await self.embeddings.aembed_query(question))
+        cached = self.lookup(vector, options_key)
+        if cached is not None:
+            return cached
+        answers, passages, scores = await run_in_executor(None, self.pipeline.get_passages_and_run,
+                                                          [question], top_k)
+        return self.update(vector, options_key, answers[0], passages[0], scores[0], generation)
+
+    def lookup(self, vector: np.ndarray, options_key: str) -> Optional[dict]:
+        """
+        Find the cached result of the most similar question with the same retrieval options.
+        :param vector: normalized embedding of the question.
+        :param options_key: cache key of retrieval options.
+        :return: cached result with its similarity, or None if no question is similar enough.
+        """
+        with self._lock:
+            self.__check_generation()
+            if len(self._entries) == 0:
+                self.misses += 1
+                return None
+            slots = np.fromiter(self._entries.keys(), dtype=np.int64, count=len(self._entries))
+            slots = slots[[self._slot_options[slot] == options_key for slot in slots]]
+            if len(slots) > 0:
+                similarities = self._vectors[slots] @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    slot = int(slots[best])
+                    self._entries.move_to_end(slot)
+                    self.hits += 1
+                    return dict(self._entries[slot], passages=list(self._entries[slot]['passages']),
+                                scores=list(self._entries[slot]['scores']), similarity=float(similarities[best]))
+            self.misses += 1
+            return None
+
+    def update(self, vector: np.ndarray, options_key: str, answer: str, passages: list, scores: list,
+               generation: Optional[int] = None) -> dict:
+        """
+        Cache the result of the question. The least recently used question is evicted when the cache is full.
+        :param generation: index generation of the retrieval before the result was made.
+        The result is not cached when the index generation changed after that. Default is the current one.
+        :return: the result with None similarity.
+        """
+        result = {'answer': answer, 'passages': list(passages), 'scores': list(scores), 'similarity': None}
+        with self._lock:
+            self.__check_generation()
+            if generation is not None and generation != self._generation:
+                return result
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                self._vectors = np.zeros((self.max_size, len(vector)), dtype=np.float32)
+                self.__clear()
+            if len(self._free_slots) > 0:
+                slot = self._free_slots.pop()
+            else:
+                slot, _ = self._entries.popitem(last=False)
+            self._vectors[slot] = vector
+            self._slot_options[slot] = options_key
+            self._entries[slot] = {'answer': answer, 'passages': list(passages), 'scores': list(scores)}
+        return result
+
+    def clear(self):
+        """Drop every cached question and reset statistics."""
+        with self._lock:
+            self.__clear()
+            self.hits = 0
+            self.misses = 0
+
+    def cache_info(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def __clear(self):
+        self._entries.clear()
+        self._slot_options = [None] * self.max_size
+        self._free_slots = list(reversed(range(self.max_size)))
+
+    def __check_generation(self):
+        generation = self.__index_generation()
+        if generation != self._generation:
+            self.__clear()
+            self._generation = generation
+
+    def __index_generation(self) -> Optional[int]:
+        retrieval = getattr(self.pipeline, 'retrieval', None)
+        return retrieval.index_generation if retrieval is not None else None
+
+    @staticmethod
+    def __options(config: Optional[RunnableConfig]) -> tuple[int, str]:
+        retrieval_options = (config or {}).get('configurable', {}).get('retrieval_options', {})
+        return retrieval_options.get('top_k', 5), make_cache_key(retrieval_options)
+
+    @staticmethod
+    def __normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    @property
+    def InputType(self) -> type[Input]:
+        return str
+
+    @property
+    def OutputType(self) -> type[Output]:
+        return dict
@@ -1,25 +1,75 @@
-import concurrent.futures
+import asyncio
+import itertools
 from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import List, Union, Optional
-from uuid import UUID
+from functools import partial
+from typing import List, Union, Optional, Any, Set, Iterator
+from uuid import UUID, uuid4
 
 from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import get_config_list, run_in_executor
 from langchain_core.runnables.utils import Input, Output
 
 from RAGchain import linker
 from RAGchain.DB import MongoDB, PickleDB
 from RAGchain.DB.base import BaseDB
+from RAGchain.DB.registry import db_registry
 from RAGchain.schema import Passage, DBOrigin, RetrievalResult
+from RAGchain.utils.cache import BaseCache, make_cache_key, normalize_query
+from RAGchain.utils.executor import get_executor
+from RAGchain.utils.linker import db_origin_table
 
 
 class BaseRetrieval(Runnable[str, RetrievalResult], ABC):
     """
     Base Retrieval class for all retrieval classes.
+    Set result_cache to cache RetrievalResult of invoke by normalized query and retrieval options.
+    Cached results are invalidated when passages are ingested or deleted, because the key has index_generation.
+    Set allow_list_cache to filter with allow lists at retrieve_with_filter, which are cached per filters.
     """
+    result_cache: Optional[BaseCache] = None
+    """cache of invoke results. Default is None, which disables caching."""
+    allow_list_cache: Optional[BaseCache] = None
+    """cache of allow lists of retrieve_with_filter. Default is None, which disables allow lists."""
+    allow_list_max_size: int = 10000
+    """max passages count of the retrieval to make allow lists. Larger retrievals filter the retrieved candidates."""
+    _index_generation: int = 0
 
-    def __init__(self):
-        self.db_instance_list: List[BaseDB] = []
+    @property
+    def index_generation(self) -> int:
+        """
+        Counter that increases whenever passages are ingested to or deleted from this retrieval.
+        Default is counted in process, so changes made by other processes are not counted.
+        Retrievals that store it with their index, like BM25Retrieval, override this and cache_identity.
+        """
+        return self._index_generation
+
+    def bump_index_generation(self):
+        """
+        Increase index_generation. Call this at ingest and delete of your retrieval,
+        so cached results of previous index are not used.
+        """
+        self._index_generation += 1
+
+    def cache_identity(self) -> Any:
+        """
+        Identity of the index of this retrieval at cache keys, so retrievals of different indexes that share
+        a cache don't return each other's results.
+        Default is the retrieval class with a random token of this instance, so results cached by other instances,
+        processes or previous runs are never used, because index_generation is counted in process.
+        Override this with an identity stored with the index, together with a persisted index_generation,
+        to share cached results across processes.
+        """
+        token = self.__dict__.setdefault('_cache_token', uuid4().hex)
+        return [type(self).__name__, token]
+
+    def result_cache_key(self, query: str, retrieval_options: dict) -> str:
+        """
+        Cache key of the invoke result. It is made of cache_identity, the normalized query,
+        retrieval options and index_generation.
+        """
+        return make_cache_key(self.cache_identity(), normalize_query(query), retrieval_options,
+                              self.index_generation)
 
     @abstractmethod
     def retrieve(self, query: str, top_k: int = 5) -> List[Passage]:
@@ -49,6 +99,88 @@ class BaseRetrieval(Runnable[str, RetrievalResult], ABC):
         """
         pass
 
+    def retrieve_id_with_scores_and_metadata(self, query: str, **kwargs) -> tuple[
+        List[Union[str, UUID]], List[float], dict]:
+        """
+        retrieve passage ids, similarity scores and metadata of the retrieval.
+        The metadata is stored at RetrievalResult.metadata when you invoke the retrieval.
+        Default metadata is empty dict. Override this if the retrieval has information to report.
+        """
+        ids, scores = self.retrieve_id_with_scores(query, **kwargs)
+        return ids, scores, {}
+
+    async def aretrieve_id_with_scores(self, query: str, top_k: int = 5) -> tuple[
+        List[Union[str, UUID]], List[float]]:
+        """
+        Async version of retrieve_id_with_scores.
+        Default implementation runs retrieve_id_with_scores in the default executor.
+        Override this when the retrieval can retrieve with async clients.
+        """
+        return await run_in_executor(None, self.retrieve_id_with_scores, query, top_k)
+
+    async def aretrieve_id_with_scores_and_metadata(self, query: str, **kwargs) -> tuple[
+        List[Union[str, UUID]], List[float], dict]:
+        """
+        Async version of retrieve_id_with_scores_and_metadata.
+        When retrieve_id_with_scores_and_metadata is overridden, it runs in the default executor.
+        Otherwise, it uses aretrieve_id_with_scores.
+        """
+        if type(self).retrieve_id_with_scores_and_metadata is not BaseRetrieval.retrieve_id_with_scores_and_metadata:
+            return await run_in_executor(None, partial(self.retrieve_id_with_scores_and_metadata, query, **kwargs))
+        ids, scores = await self.aretrieve_id_with_scores(query, **kwargs)
+        return ids, scores, {}
+
+    def retrieve_id_with_scores_batch(self, queries: List[str], top_k: int = 5) -> tuple[
+        List[List[Union[str, UUID]]], List[List[float]]]:
+        """
+        retrieve passage ids and similarity scores for multiple queries at once.
+        Default implementation calls retrieve_id_with_scores for each query.
+        Override this when the retrieval can embed or score many queries in one call.
+        :param queries: list of query strings.
+        :param top_k: passages count to retrieve for each query.
+        :return: passage ids and scores of each query.
+        """
+        ids_list, scores_list = [], []
+        for query in queries:
+            ids, scores = self.retrieve_id_with_scores(query, top_k=top_k)
+            ids_list.append(ids)
+            scores_list.append(scores)
+        return ids_list, scores_list
+
+    def retrieve_id_with_scores_and_metadata_batch(self, queries: List[str], **kwargs) -> tuple[
+        List[List[Union[str, UUID]]], List[List[float]], List[dict]]:
+        """
+        Batch version of retrieve_id_with_scores_and_metadata. It is used at batch.
+        Default implementation calls retrieve_id_with_scores_batch, and metadata of each query is empty dict.
+        Override this if the retrieval has information to report in batch mode.
+        :param queries: list of query strings.
+        :return: passage ids, scores and metadata of each query.
+        """
+        ids_list, scores_list = self.retrieve_id_with_scores_batch(queries, **kwargs)
+        return ids_list, scores_list, [{} for _ in queries]
+
+    def iter_ids_with_scores(self, query: str, page_size: int = 10) -> Iterator[tuple[Union[str, UUID], float]]:
+        """
+        Cursor of passage ids and scores, from the most similar one.
+        Consume it with itertools.islice to page past the first top_k without ranking again from scratch.
+        Default implementation retrieves page_size passages first, and doubles the depth for each next page,
+        yielding only the passages which are not yielded yet.
+        Override this when the retrieval can keep its scored candidates, so the next page costs incremental work.
+        :param query: query string
+        :param page_size: passages count to retrieve at once.
+        """
+        depth = max(page_size, 1)
+        yielded = set()
+        while True:
+            ids, scores = self.retrieve_id_with_scores(query, top_k=depth)
+            for _id, score in zip(ids, scores):
+                if str(_id) not in yielded:
+                    yielded.add(str(_id))
+                    yield _id, score
+            if len(ids) < depth:
+                return
+            depth *= 2
+
     @abstractmethod
     def delete(self, ids: List[Union[str, UUID]]):
         """
@@ -56,6 +188,73 @@ class BaseRetrieval(Runnable[str, RetrievalResult], ABC):
         """
         pass
 
+    def indexed_ids(self) -> Optional[List[Union[str, UUID]]]:
+        """
+        Get ids of every passage in the retrieval, which is used to make allow lists of retrieve_with_filter.
+        Default is None, which means the retrieval can't list its passages.
+        """
+        return None
+
+    def retrieve_id_with_scores_allowed(self, query: str, allowed_ids: Set[str], top_k: int = 5) -> Optional[
+        tuple[List[Union[str, UUID]], List[float]]]:
+        """
+        retrieve passage ids and scores only from passages in allowed_ids.
+        Passages which are not allowed are dropped while scoring, so top_k allowed passages are returned at one pass.
+        Default is None, which means the retrieval doesn't support allow lists.
+        :param query: query string
+        :param allowed_ids: str passage ids to retrieve from.
+        :param top_k: passages count to retrieve
+        """
+        return None
+
+    def retrieve_id_with_native_filter(self, query: str, top_k: int = 5,
+                                       content: Optional[List[str]] = None,
+                                       filepath: Optional[List[str]] = None,
+                                       content_datetime_range: Optional[List[tuple[datetime, datetime]]] = None,
+                                       importance: Optional[List[int]] = None,
+                                       **kwargs) -> Optional[tuple[List[Union[str, UUID]], List[float]]]:
+        """
+        retrieve passage ids and scores with the filters of the retrieval backend itself, like `where` of vector DBs.
+        Default is None, which means the retrieval can't apply these filters by itself.
+        """
+        return None
+
+    def allow_list(self, content: Optional[List[str]] = None,
+                   filepath: Optional[List[str]] = None,
+                   content_datetime_range: Optional[List[tuple[datetime, datetime]]] = None,
+                   importance: Optional[List[int]] = None,
+                   **kwargs) -> Optional[Set[str]]:
+        """
+        Get str ids of passages in the retrieval which match the filters.
+        Filters are evaluated at the DBs with one search_data call for every indexed passage,
+        so it is only made when the retrieval has at most allow_list_max_size passages.
+        When allow_list_cache is set, the result is cached until passages are ingested or deleted.
+        :return: allowed passage ids, or None if the retrieval can't list its passages or has too many passages.
+        """
+        cache_key = None
+        if self.allow_list_cache is not None:
+            cache_key = make_cache_key(self.cache_identity(), 'allow_list', content, filepath, content_datetime_range,
+                                       importance, kwargs, self.index_generation)
+            cached = self.allow_list_cache.get(cache_key)
+            if cached is not None:
+                # False is cached for retrievals with too many passages, so they are not listed again
+                return cached if cached is not False else None
+        ids = self.indexed_ids()
+        if ids is None:
+            return None
+        if len(ids) > self.allow_list_max_size:
+            if cache_key is not None:
+                self.allow_list_cache.set(cache_key, False)
+            return None
+        allowed = set()
+        if len(ids) > 0:
+            allowed = {str(passage.id) for passage in self.search_data(
+                ids, content=content, filepath=filepath, content_datetime_range=content_datetime_range,
+                importance=importance, **kwargs)}
+        if cache_key is not None:
+            self.allow_list_cache.set(cache_key, allowed)
+        return allowed
+
     def retrieve_with_filter(self, query: str, top_k: int = 5,
                              content: Optional[List[str]] = None,
                              filepath: Optional[List[str]] = None,
@@ -68,6 +267,13 @@ class BaseRetrieval(Runnable[str, RetrievalResult], ABC):
                              ):
         """
         retrieve passages which matches filter_dict conditions.
+        Filters are pushed down to the retrieval, so top_k matching passages are retrieved at one pass.
+        First, the retrieval backend applies the filters by itself with retrieve_id_with_native_filter.
+        Else, when allow_list_cache is set, an allow list of the filters is made from the DBs,
+        and only allowed passages are scored. Allow lists read every passage of the retrieval from the DBs,
+        so they are used only with a cache, and only up to allow_list_max_size passages.
+        Otherwise, it pages through iter_ids_with_scores and filters new passages at the DBs,
+        increasing the page size until top_k passages are found or max_trial is reached.
         :param query: query string
         :param top_k: passages count to retrieve
         :param content: content list to filter
@@ -79,36 +285,78 @@ class BaseRetrieval(Runnable[str, RetrievalResult], ABC):
         :param retrieve_range_mult: multiplier for retrieve range
         :param max_trial: max trial count for retrieve
         """
-        result_passages = []
+        filters = dict(content=content, filepath=filepath, content_datetime_range=content_datetime_range,
+                       importance=importance, **kwargs)
+        result = self.retrieve_id_with_native_filter(query, top_k=top_k, **filters)
+        if result is None and self.allow_list_cache is not None and \
+                type(self).retrieve_id_with_scores_allowed is not BaseRetrieval.retrieve_id_with_scores_allowed:
+            allowed_ids = self.allow_list(**filters)
+            if allowed_ids is not None:
+                result = self.retrieve_id_with_scores_allowed(query, allowed_ids, top_k=top_k)
+        if result is not None:
+            ids = result[0]
+            passage_dict = {str(passage.id): passage for passage in self.fetch_data(ids)} if len(ids) > 0 else {}
+            return [passage_dict[str(_id)] for _id in ids if str(_id) in passage_dict]
+
+        cursor = self.iter_ids_with_scores(query, page_size=retrieve_range_mult * top_k)
+        ranks, result_passages = {}, []
         for _ in range(max_trial):
-            ids = self.retrieve_id(query, top_k=retrieve_range_mult * top_k)
-            passages = self.search_data(ids, content=content, filepath=filepath,
-                                        content_datetime_range=content_datetime_range, importance=importance, **kwargs)
-            result_passages = passages[:top_k]
+            # only passages which are not checked at previous trials are searched
+            depth = retrieve_range_mult * top_k
+            ids = [_id for _id, _ in itertools.islice(cursor, depth - len(ranks))]
+            ranks.update((str(_id), rank) for rank, _id in enumerate(ids, start=len(ranks)))
+            if len(ids) > 0:
+                result_passages.extend(self.search_data(ids, content=content, filepath=filepath,
+                                                        content_datetime_range=content_datetime_range,
+                                                        importance=importance, **kwargs))
             if len(result_passages) >= top_k:
                 break
 
             # break when there is no more passages to retrieve
-            if retrieve_range_mult * top_k > len(ids):
+            if depth > len(ranks):
                 break
 
             retrieve_range_mult *= multi_num
 
-        return result_passages
+        result_passages.sort(key=lambda passage: ranks[str(passage.id)])
+        return result_passages[:top_k]
 
     def fetch_data(self, ids: List[Union[UUID, str]]) -> List[Passage]:
         """
         fetch passages from each db. This can fetch data from multiple db.
         :param ids: list of passage ids
         """
-        db_origin_list = linker.get_json(ids)
-        # Sometimes redis doesn't find the id, so we need to filter that db_origin is None.
-        filter_db_origin = list(filter(lambda db_origin: db_origin is not None, db_origin_list))
-        # Check duplicated db origin in one retrieval.
-        final_db_origin = self.duplicate_check(filter_db_origin)
+        db_origin_list = db_origin_table.resolve(linker, linker.get_json(ids))
+        # Group ids by db origin. Sometimes redis doesn't find the id, so db_origin can be None.
+        final_db_origin = self.duplicate_check(db_origin_list)
         # fetch data from each db
         return self.fetch_each_db(final_db_origin, ids)
 
+    async def afetch_data(self, ids: List[Union[UUID, str]]) -> List[Passage]:
+        """
+        Async version of fetch_data. Linker and DBs are read with their async APIs,
+        and each db is fetched concurrently.
+        :param ids: list of passage ids
+        """
+        db_origin_list = await db_origin_table.aresolve(linker, await linker.aget_json(ids))
+        final_db_origin = self.duplicate_check(db_origin_list)
+        results = await asyncio.gather(*[self.afetch_data_from_db_origin(ids, dict(db_origin), target_ids)
+                                         for db_origin, target_ids in final_db_origin.items()])
+        return [passage for result in results for passage in result]
+
+    def fetch_data_batch(self, ids_list: List[List[Union[UUID, str]]]) -> List[List[Passage]]:
+        """
+        fetch passages of multiple id lists with one fetch_data call.
+        Same ids in different lists are fetched only once.
+        :param ids_list: list of passage id lists.
+        :return: passages of each id list, in the order of the ids. Ids that are not found are skipped.
+        """
+        unique_ids = list({str(_id): _id for ids in ids_list for _id in ids}.values())
+        if len(unique_ids) == 0:
+            return [[] for _ in ids_list]
+        passage_dict = {str(passage.id): passage for passage in self.fetch_data(unique_ids)}
+        return [[passage_dict[str(_id)] for _id in ids if str(_id) in passage_dict] for ids in ids_list]
+
     def search_data(self, ids: List[Union[UUID, str]],
                     content: Optional[List[str]] = None,
                     filepath: Optional[List[str]] = None,
@@ -125,24 +373,37 @@ class BaseRetrieval(Runnable[str, RetrievalResult], ABC):
         :param importance: importance list to filter
         :param kwargs: metadata_etc to filter. Put metadata_etc key as kwargs key and metadata_etc value as kwargs value.
         """
-        db_origin_list = linker.get_json(ids)
-        filter_db_origin = list(filter(lambda db_origin: db_origin is not None, db_origin_list))
-        final_db_origin = self.duplicate_check(filter_db_origin)
+        db_origin_list = db_origin_table.resolve(linker, linker.get_json(ids))
+        final_db_origin = self.duplicate_check(db_origin_list)
         return self.search_each_db(final_db_origin, ids, content=content, filepath=filepath,
                                    content_datetime_range=content_datetime_range, importance=importance, **kwargs)
 
+    async def asearch_data(self, ids: List[Union[UUID, str]],
+                           content: Optional[List[str]] = None,
+                           filepath: Optional[List[str]] = None,
+                           content_datetime_range: Optional[List[tuple[datetime, datetime]]] = None,
+                           importance: Optional[List[int]] = None,
+                           **kwargs
+                           ) -> List[Passage]:
+        """
+        Async version of search_data. Each db is searched concurrently.
+        """
+        db_origin_list = await db_origin_table.aresolve(linker, await linker.aget_json(ids))
+        final_db_origin = self.duplicate_check(db_origin_list)
+        results = await asyncio.gather(*[
+            self.asearch_data_from_db_origin(ids, dict(db_origin), target_ids, content, filepath,
+                                             content_datetime_range, importance, **kwargs)
+            for db_origin, target_ids in final_db_origin.items()])
+        return [passage for result in results for passage in result]
+
     def fetch_each_db(self, final_db_origin: dict[tuple, list[int]], ids: List[Union[UUID, str]]) -> List[Passage]:
         """
         check_dict = {(("db_type": "mongo_db"),
             (('mongo_url': "~"), ('db_name': "~"), ('collection_name': "~"))): [0,  2], ...}
         """
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(self.fetch_data_from_db_origin, ids, dict(db_origin), target_ids)
-                       for db_origin, target_ids in final_db_origin.items()]
-        result = []
-        for future in futures:
-            result.extend(future.result())
-        return result
+        results = get_executor().run([partial(self.fetch_data_from_db_origin, ids, dict(db_origin), target_ids)
+                                      for db_origin, target_ids in final_db_origin.items()], name='fetch_db')
+        return [passage for result in results for passage in result]
 
     def search_each_db(self, final_db_origin: dict[tuple, list[int]], ids: List[Union[UUID, str]],
                        content: Optional[List[str]] = None,
@@ -151,21 +412,16 @@ class BaseRetrieval(Runnable[str, RetrievalResult], ABC):
                        importance: Optional[List[int]] = None,
                        **kwargs
                        ) -> List[Passage]:
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(self.search_data_from_db_origin, ids, dict(db_origin),
-                                       target_ids, content, filepath, content_datetime_range, importance, **kwargs)
-                       for db_origin, target_ids in final_db_origin.items()]
-        result = []
-        for future in futures:
-            result.extend(future.result())
-        return result
+        results = get_executor().run([partial(self.search_data_from_db_origin, ids, dict(db_origin), target_ids,
+                                              content, filepath, content_datetime_range, importance, **kwargs)
+                                      for db_origin, target_ids in final_db_origin.items()], name='search_db')
+        return [passage for result in results for passage in result]
 
     def fetch_data_from_db_origin(self, ids: List[Union[UUID, str]], db_origin: dict, target_ids: List[int]) -> List[
         Passage]:
-        db_path = dict(db_origin['db_path'])
-        # make db instance
-        db = self.is_created(db_origin['db_type'], db_path)
-        db.load()
+        # get loaded db instance
+        db = db_registry.get_loaded(DBOrigin(db_type=db_origin['db_type'], db_path=dict(db_origin['db_path'])),
+                                     self.create_db)
         # make each id list
         each_ids = [ids[i] for i in target_ids]
         # fetch data
@@ -181,10 +437,9 @@ class BaseRetrieval(Runnable[str, RetrievalResult], ABC):
                                    importance: Optional[List[int]] = None,
                                    **kwargs
                                    ):
-        db_path = dict(db_origin['db_path'])
-        # make db instance
-        db = self.is_created(db_origin['db_type'], db_path)
-        db.load()
+        # get loaded db instance
+        db = db_registry.get_loaded(DBOrigin(db_type=db_origin['db_type'], db_path=dict(db_origin['db_path'])),
+                                     self.create_db)
         # make each id list
         each_ids = [ids[i] for i in target_ids]
         # search data
@@ -192,20 +447,32 @@ class BaseRetrieval(Runnable[str, RetrievalResult], ABC):
                                 content_datetime_range=content_datetime_range, importance=importance, **kwargs)
         return result_data
 
-    def is_created(self, db_type: str, db_path: dict):
-        if not self.db_instance_list:
-            db = self.create_db(db_type, db_path)
-            self.db_instance_list.append(db)
-            return db
-        else:
-            db_origin_list = [instance.get_db_origin() for instance in self.db_instance_list]
-            db_origin = DBOrigin(db_type=db_type, db_path=db_path)
-            if db_origin in db_origin_list:
-                return self.db_instance_list[db_origin_list.index(db_origin)]
-            else:
-                db = self.create_db(db_type, db_path)
-                self.db_instance_list.append(db)
-                return db
+    async def afetch_data_from_db_origin(self, ids: List[Union[UUID, str]], db_origin: dict,
+                                         target_ids: List[int]) -> List[Passage]:
+        db = await db_registry.aget_loaded(DBOrigin(db_type=db_origin['db_type'],
+                                                    db_path=dict(db_origin['db_path'])), self.create_db)
+        return await db.afetch([ids[i] for i in target_ids])
+
+    async def asearch_data_from_db_origin(self, ids: List[Union[UUID, str]],
+                                          db_origin: dict,
+                                          target_ids: List[int],
+                                          content: Optional[List[str]] = None,
+                                          filepath: Optional[List[str]] = None,
+                                          content_datetime_range: Optional[List[tuple[datetime, datetime]]] = None,
+                                          importance: Optional[List[int]] = None,
+                                          **kwargs
+                                          ) -> List[Passage]:
+        db = await db_registry.aget_loaded(DBOrigin(db_type=db_origin['db_type'],
+                                                    db_path=dict(db_origin['db_path'])), self.create_db)
+        return await db.asearch(id=[ids[i] for i in target_ids], content=content, filepath=filepath,
+                                content_datetime_range=content_datetime_range, importance=importance, **kwargs)
+
+    def is_created(self, db_type: str, db_path: dict) -> BaseDB:
+        """
+        Get the db instance of the db origin from the process-wide DB registry.
+        Every retrieval shares the same db instance for the same db origin.
+        """
+        return db_registry.get(DBOrigin(db_type=db_type, db_path=db_path), self.create_db)
 
     @staticmethod
     def create_db(db_type: str, db_path: dict) -> BaseDB:
@@ -221,29 +488,28 @@ class BaseRetrieval(Runnable[str, RetrievalResult], ABC):
             raise ValueError(f"Unknown db type: {db_type}")
 
     @staticmethod
-    def duplicate_check(db_origin_list: list[dict]) -> dict[tuple, list[int]]:
+    def duplicate_check(db_origin_list: list[Optional[dict]]) -> dict[tuple, list[int]]:
         """
-        Check duplicated db origin in one retrieval.
+        Group indices of db_origin_list by db origin. None db origin is skipped.
         For example,
         db_origin = {"db_type": "mongo_db",
             "db_path": {"mongo_url": "...", "db_name": "...", "collection_name": "..."}}
         result = {(("db_type": "mongo_db"),
             ('db_path',(('mongo_url': "..."), ('db_name': "..."), ('collection_name': "...")))): [0,  2], ...}
         """
-        check_origin_duplicate = []
         result = {}
+        # resolved db origins of the same origin key are the same object, so convert each object once.
+        tuple_cache = {}
         for index, db_origin in enumerate(db_origin_list):
-            # db_origin(dict) to tuple
-            tuple_db_origin = tuple(db_origin.items())
-            # replace db_path(dict) to tuple
-            tuple_final = tuple([(key, tuple(value.items())) if key == "db_path" else (key, value)
-                                 for key, value in tuple_db_origin])
-            # check duplicated db instance with equal method
-            if db_origin in check_origin_duplicate:
-                result[tuple_final].append(index)
-            else:
-                check_origin_duplicate.append(db_origin)
-                result[tuple_final] = [index]
+            if db_origin is None:
+                continue
+            tuple_final = tuple_cache.get(id(db_origin))
+            if tuple_final is None:
+                # replace db_path(dict) to tuple
+                tuple_final = tuple([(key, tuple(value.items())) if key == "db_path" else (key, value)
+                                     for key, value in db_origin.items()])
+                tuple_cache[id(db_origin)] = tuple_final
+            result.setdefault(tuple_final, []).append(index)
         return result
 
     def invoke(self, input: Input, config: Optional[RunnableConfig] = None) -> Output:
@@ -258,12 +524,92 @@ class BaseRetrieval(Runnable[str, RetrievalResult], ABC):
         """
         input = str(input)
         retrieval_option = config['configurable'].get('retrieval_options', {}) if config is not None else {}
-        ids, scores = self.retrieve_id_with_scores(input, **retrieval_option)
-        return RetrievalResult(
+        cache_key, cached = self.__lookup_result(input, retrieval_option)
+        if cached is not None:
+            return cached
+        ids, scores, metadata = self.retrieve_id_with_scores_and_metadata(input, **retrieval_option)
+        return self.__store_result(cache_key, RetrievalResult(
             query=input,
             passages=self.fetch_data(ids),
             scores=scores,
-        )
+            metadata=metadata,
+        ))
+
+    async def ainvoke(self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Output:
+        """
+        Async version of invoke. Passage ids are retrieved with aretrieve_id_with_scores_and_metadata,
+        and passages are fetched with afetch_data, so linker and DBs don't block the event loop.
+        You can set top_k option in config, same as invoke.
+        """
+        input = str(input)
+        retrieval_option = config['configurable'].get('retrieval_options', {}) if config is not None else {}
+        cache_key, cached = self.__lookup_result(input, retrieval_option)
+        if cached is not None:
+            return cached
+        ids, scores, metadata = await self.aretrieve_id_with_scores_and_metadata(input, **retrieval_option)
+        return self.__store_result(cache_key, RetrievalResult(
+            query=input,
+            passages=await self.afetch_data(ids),
+            scores=scores,
+            metadata=metadata,
+        ))
+
+    def __lookup_result(self, query: str, retrieval_option: dict) -> tuple[Optional[str], Optional[RetrievalResult]]:
+        if self.result_cache is None:
+            return None, None
+        cache_key = self.result_cache_key(query, retrieval_option)
+        cached = self.result_cache.get(cache_key)
+        if cached is None:
+            return cache_key, None
+        # rerankers and compressors can modify RetrievalResult, so return a copy of the cached result
+        return cache_key, cached.copy(update={'query': query, 'passages': list(cached.passages),
+                                              'scores': list(cached.scores), 'metadata': dict(cached.metadata)})
+
+    def __store_result(self, cache_key: Optional[str], result: RetrievalResult) -> RetrievalResult:
+        if cache_key is not None:
+            self.result_cache.set(cache_key, result.copy(update={
+                'passages': list(result.passages), 'scores': list(result.scores),
+                'metadata': dict(result.metadata)}))
+        return result
+
+    def batch(self, inputs: List[Input], config: Optional[Union[RunnableConfig, List[RunnableConfig]]] = None,
+              *, return_exceptions: bool = False, **kwargs: Optional[Any]) -> List[Output]:
+        """
+        retrieve passages from multiple user queries.
+        Queries are retrieved with retrieve_id_with_scores_and_metadata_batch,
+        and passages of every query are fetched at once.
+        When each query has different retrieval_options, or return_exceptions is True,
+        it falls back to invoke for each query.
+        When result_cache is set, only the queries which are not cached are retrieved.
+        :param inputs: list of user queries. str type.
+        :param config: RunnableConfig or list of RunnableConfig. Default is None.
+        You can set top_k option in config, same as invoke.
+        """
+        if len(inputs) == 0:
+            return []
+        configs = get_config_list(config, len(inputs))
+        retrieval_options = [each_config.get('configurable', {}).get('retrieval_options', {})
+                             for each_config in configs]
+        if return_exceptions or any(option != retrieval_options[0] for option in retrieval_options[1:]):
+            return super().batch(inputs, config, return_exceptions=return_exceptions, **kwargs)
+        queries = [str(query) for query in inputs]
+        lookups = [self.__lookup_result(query, retrieval_options[0]) for query in queries]
+        results = [cached for _, cached in lookups]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if len(missing) == 0:
+            return results
+        ids_list, scores_list, metadata_list = self.retrieve_id_with_scores_and_metadata_batch(
+            [queries[i] for i in missing], **retrieval_options[0])
+        passages_list = self.fetch_data_batch(ids_list)
+        for i, ids, scores, metadata, passages in zip(missing, ids_list, scores_list, metadata_list, passages_list):
+            score_dict = {str(_id): score for _id, score in zip(ids, scores)}
+            results[i] = self.__store_result(lookups[i][0], RetrievalResult(
+                query=queries[i],
+                passages=passages,
+                scores=[score_dict[str(passage.id)] for passage in passages],
+                metadata=metadata,
+            ))
+        return results
 
     @property
     def InputType(self) -> type[Input]:
@@ -1,62 +1,112 @@
+import itertools
+import os
 import pickle
+import threading
 import warnings
-from typing import List, Union
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Union, Optional, Iterable, Set, Iterator, Any
 from uuid import UUID
 
-import numpy as np
-from rank_bm25 import BM25Okapi
 from tqdm import tqdm
 from transformers import AutoTokenizer
 
 from RAGchain.retrieval.base import BaseRetrieval
 from RAGchain.schema import Passage
+from RAGchain.utils.bm25 import BM25Index
 from RAGchain.utils.util import FileChecker
 
 
 class BM25Retrieval(BaseRetrieval):
     """
-    BM25Retrieval class for BM25 retrieval. Save bm25 representation as pkl file and retrieve it.
-    Default data structure looks like this:
+    BM25Retrieval class for BM25 retrieval. Save bm25 representation as a directory or pkl file and retrieve it.
+    Passages are stored at BM25Index, which is an inverted index that is built at ingest and updated incrementally.
+    At retrieval, only the postings of the query tokens are scored.
+
+    When save_path is a directory, the index is saved as segments of .npy files and a manifest.
+    The segments are memory-mapped at load, so loading is fast and the pages are shared between processes.
+    Each ingest appends a new segment without rewriting old ones. We recommend this format for large corpora.
+
+    When save_path is a pkl file, whole index is pickled at every ingest. The pkl file looks like this:
     {
-        "tokens" : [], # 2d list of tokens
-        "passage_id" : [], # 2d list of passage_id. Type must be UUID or string.
+        "index" : BM25Index, # inverted index of tokenized passages
     }
+    Legacy pkl files, which store "tokens" and "passage_id" lists, are converted to BM25Index at load.
+
+    Deleted passages are marked at tombstones, so delete is O(1) per passage.
+    When the deleted ratio of a segment exceeds compaction_threshold, the segment is rewritten without deleted
+    passages. You can also call compact() directly.
     """
 
     def __init__(self, save_path: str,
                  tokenizer_name: str = "gpt2",
+                 search_method: str = "exhaustive",
+                 compaction_threshold: float = 0.2,
+                 background_compaction: bool = False,
+                 batch_size: int = 10000,
+                 num_proc: int = 1,
                  ):
         """
         Initialize a new instance of the BM25Retrieval class.
 
-        :param save_path: A string representing the path to the saved BM25 data. Must be .pkl or .pickle file.
+        :param save_path: A string representing the path to the saved BM25 data.
+        It can be a directory path or .pkl or .pickle file path.
         :param tokenizer_name: The name of the tokenizer to be used. Must be huggingface tokenizer name.
         Default is "gpt2".
+        :param search_method: The method to find top_k passages. Choose between 'exhaustive' and 'maxscore'.
+        'exhaustive' scores every passage that contains a query token.
+        'maxscore' uses MaxScore dynamic pruning, so only passages that can enter the top_k are fully scored.
+        Both return the same results. The number of scored passages is reported at
+        RetrievalResult.metadata['docs_scored']. Default is 'exhaustive'.
+        :param compaction_threshold: The deleted ratio of a segment to trigger compaction after delete.
+        Default is 0.2.
+        :param background_compaction: If True, compaction after delete runs at a background thread,
+        and retrieval can be used while compaction. Default is False.
+        :param batch_size: The number of passages to tokenize at once at ingest.
+        Each batch is added to the index as a new segment and persisted. Default is 10000.
+        :param num_proc: The number of processes to tokenize passages at ingest. It is only used for slow
+        (python) tokenizers, because fast tokenizers already tokenize a batch in parallel. Default is 1.
         :param args: Additional positional arguments.
         :param kwargs: Additional keyword arguments.
 
         :returns: None
         """
         super().__init__()
-        self.data = self.load_data(save_path)
-        assert (len(self.data["tokens"]) == len(self.data["passage_id"]))
+        if search_method not in ['exhaustive', 'maxscore']:
+            raise ValueError("search_method should be either 'exhaustive' or 'maxscore'")
+        self.search_method = search_method
+        self.compaction_threshold = compaction_threshold
+        self.background_compaction = background_compaction
+        self._lock = threading.Lock()
+        self._compaction_thread: Optional[threading.Thread] = None
+        self.index = self.load_data(save_path)
         self.save_path = save_path
+        self.batch_size = batch_size
+        self.num_proc = num_proc
+        self.tokenizer_name = tokenizer_name
         self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
 
     @staticmethod
-    def load_data(save_path: str):
+    def is_pickle_path(save_path: str) -> bool:
+        return os.path.splitext(save_path)[-1].lower() in [".pkl", ".pickle"]
+
+    @classmethod
+    def load_data(cls, save_path: str) -> BM25Index:
+        if not cls.is_pickle_path(save_path):
+            if os.path.isfile(save_path):
+                raise ValueError("input save_path must be a directory or pickle file.")
+            return BM25Index.load(save_path)
         if FileChecker(save_path).check_type(file_types=[".pkl", ".pickle"]).is_exist():
             with open(save_path, 'rb') as f:
                 data = pickle.load(f)
-            assert ('tokens' and 'passage_id' in list(data.keys()))
-            return data
+            if 'index' in data.keys():
+                return data['index']
+            assert 'tokens' in data.keys() and 'passage_id' in data.keys()
+            assert len(data['tokens']) == len(data['passage_id'])
+            index = BM25Index()
+            index.add(data['passage_id'], data['tokens'])
+            return index
         else:
-            if not FileChecker(save_path).check_type(file_types=[".pkl", ".pickle"]):
-                raise ValueError("input save_path is not pickle file.")
-            return {
-                "tokens": [],
-                "passage_id": [],
-            }
+            return BM25Index()
 
     def retrieve(self, query: str, top_k: int = 5) -> List[Passage]:
         ids = self.retrieve_id(query, top_k)
@@ -67,47 +117,166 @@ class BM25Retrieval(BaseRetrieval):
         ids, scores = self.retrieve_id_with_scores(query, top_k)
         return ids
 
-    def ingest(self, passages: List[Passage]):
-        for passage in tqdm(passages):
-            self._save_one(passage)
-        self.persist(self.save_path)
+    def ingest(self, passages: Iterable[Passage]):
+        """
+        Tokenize passages in batches and add each batch to the index.
+        The index is persisted once per batch, so you can stream large amount of passages.
+        """
+        batches = self._batches(passages, self.batch_size)
+        if self.num_proc > 1 and not self.tokenizer.is_fast:
+            with ProcessPoolExecutor(max_workers=self.num_proc, initializer=_init_worker_tokenizer,
+                                     initargs=(self.tokenizer_name,)) as executor:
+                for batch in tqdm(batches):
+                    contents = [passage.content for passage in batch]
+                    chunk_size = -(-len(contents) // self.num_proc)
+                    tokens = list(itertools.chain.from_iterable(
+                        executor.map(_tokenize_in_worker, self._batches(contents, chunk_size))))
+                    self._add_batch(batch, tokens)
+        else:
+            for batch in tqdm(batches):
+                self._add_batch(batch, self.__tokenize([passage.content for passage in batch]))
+
+    def _add_batch(self, passages: List[Passage], tokens: List[List[int]]):
+        with self._lock:
+            self.index.add([passage.id for passage in passages], tokens)
+            self.persist(self.save_path)
+
+    @staticmethod
+    def _batches(values: Iterable, batch_size: int) -> Iterable[list]:
+        iterator = iter(values)
+        while True:
+            batch = list(itertools.islice(iterator, batch_size))
+            if len(batch) == 0:
+                return
+            yield batch
 
     def retrieve_id_with_scores(self, query: str, top_k: int = 5) -> tuple[
         List[Union[str, UUID]], List[float]]:
-        if self.data is None:
-            raise ValueError("BM25Retriever.data is None. Please save data first.")
+        ids, scores, _ = self.retrieve_id_with_scores_and_metadata(query, top_k=top_k)
+        return ids, scores
 
-        bm25 = BM25Okapi(self.data["tokens"])
+    def retrieve_id_with_scores_and_metadata(self, query: str, top_k: int = 5) -> tuple[
+        List[Union[str, UUID]], List[float], dict]:
         tokenized_query = self.__tokenize([query])[0]
-        scores = bm25.get_scores(tokenized_query)
-        sorted_scores = sorted(scores, reverse=True)
-        top_n_index = np.argsort(scores)[::-1][:top_k]  # this code is from rank_bm25.py in rank_bm25 package
-        ids = [self.data['passage_id'][i] for i in top_n_index]
-        return ids, sorted_scores[:top_k]
+        ids, scores, docs_scored = self.index.search(tokenized_query, top_k, method=self.search_method)
+        return ids, scores, {"docs_scored": docs_scored}
+
+    def iter_ids_with_scores(self, query: str, page_size: int = 10) -> Iterator[tuple[Union[str, UUID], float]]:
+        """
+        Score passages once, and yield the next best passages page by page.
+        It always scores exhaustively, because MaxScore pruning depends on top_k.
+        """
+        return self.index.iter_search(self.__tokenize([query])[0], page_size=page_size)
+
+    def indexed_ids(self) -> Optional[List[Union[str, UUID]]]:
+        return self.index.live_ids()
+
+    def retrieve_id_with_scores_allowed(self, query: str, allowed_ids: Set[str], top_k: int = 5) -> Optional[
+        tuple[List[Union[str, UUID]], List[float]]]:
+        """
+        Score only allowed passages. Segments without allowed passages are skipped, and postings of other passages
+        are masked before scoring, so exactly top_k allowed passages are returned and only their ids are made.
+        """
+        tokenized_query = self.__tokenize([query])[0]
+        ids, scores, _ = self.index.search(tokenized_query, top_k, method=self.search_method,
+                                           allowed_ids=allowed_ids)
+        return ids, scores
+
+    def retrieve_id_with_scores_batch(self, queries: List[str], top_k: int = 5) -> tuple[
+        List[List[Union[str, UUID]]], List[List[float]]]:
+        ids_list, scores_list, _ = self.retrieve_id_with_scores_and_metadata_batch(queries, top_k=top_k)
+        return ids_list, scores_list
+
+    def retrieve_id_with_scores_and_metadata_batch(self, queries: List[str], top_k: int = 5) -> tuple[
+        List[List[Union[str, UUID]]], List[List[float]], List[dict]]:
+        """
+        Tokenize queries at once and score them together.
+        Postings of the query tokens are read once and shared by every query that contains the token.
+        The metadata of each query has 'docs_scored', same as retrieve_id_with_scores_and_metadata.
+        """
+        if len(queries) == 0:
+            return [], [], []
+        tokenized_queries = self.__tokenize(queries)
+        ids_list, scores_list, docs_scored_list = self.index.search_batch(tokenized_queries, top_k,
+                                                                          method=self.search_method)
+        return ids_list, scores_list, [{"docs_scored": docs_scored} for docs_scored in docs_scored_list]
 
     def delete(self, ids: List[Union[str, UUID]]):
-        for _id in ids:
-            try:
-                idx = self.data["passage_id"].index(_id)
-                self.data["passage_id"].pop(idx)
-                self.data["tokens"].pop(idx)
-            except ValueError:
-                warnings.warn(f"Passage id {_id} is not in BM25 Retrieval."
-                              f"Please check your input ids.")
-
-    def _save_one(self, passage: Passage):
-        tokenized = self.__tokenize([passage.content])[0]
-        self.data["tokens"].append(tokenized)
-        self.data["passage_id"].append(passage.id)
+        with self._lock:
+            not_exist_ids = self.index.delete(ids)
+            self.persist(self.save_path)
+        for _id in not_exist_ids:
+            warnings.warn(f"Passage id {_id} is not in BM25 Retrieval."
+                          f"Please check your input ids.")
+
+        if not self.index.needs_compaction(self.compaction_threshold):
+            return
+        if not self.background_compaction:
+            self.compact()
+        elif self._compaction_thread is None or not self._compaction_thread.is_alive():
+            self._compaction_thread = threading.Thread(target=self.compact, name="BM25Compaction", daemon=True)
+            self._compaction_thread.start()
+
+    def compact(self, min_deleted_ratio: Optional[float] = None):
+        """
+        Rewrite segments without deleted passages and persist them.
+        Compacted segments are built without lock, so retrieval, ingest and delete can run during compaction.
+        :param min_deleted_ratio: Only segments whose deleted ratio is at least this value are compacted.
+        Default is compaction_threshold.
+        """
+        if min_deleted_ratio is None:
+            min_deleted_ratio = self.compaction_threshold
+        plan = self.index.prepare_compaction(min_deleted_ratio)
+        if len(plan) == 0:
+            return
+        with self._lock:
+            self.index.apply_compaction(plan)
+            self.persist(self.save_path)
+
+    def wait_compaction(self):
+        """
+        Wait until the background compaction finishes.
+        """
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+
+    @property
+    def index_generation(self) -> int:
+        """Generation of the BM25 index, which is saved with the index, so it is shared by processes."""
+        return self.index.generation
+
+    def bump_index_generation(self):
+        with self._lock:
+            self.index.generation += 1
+            self.persist(self.save_path)
+
+    def cache_identity(self) -> Any:
+        """Random uid of the BM25 index, which is saved with the index."""
+        return [type(self).__name__, self.index.uid]
 
     def persist(self, save_path: str):
         """
-        Persist data to save_path as pickle file.
+        Persist data to save_path. If save_path is a directory, only new segments are written.
+        Else, whole data is written as pickle file.
         """
-        FileChecker(save_path).check_type(file_types=[".pkl", ".pickle"])
+        if not self.is_pickle_path(save_path):
+            self.index.save(save_path)
+            return
         with open(save_path, 'wb') as f:
-            pickle.dump(self.data, f)
+            pickle.dump({"index": self.index}, f)
 
     def __tokenize(self, values: List[str]):
         tokenized = self.tokenizer(values)
         return tokenized.input_ids
+
+
+_worker_tokenizer = None
+
+
+def _init_worker_tokenizer(tokenizer_name: str):
+    global _worker_tokenizer
+    _worker_tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+
+def _tokenize_in_worker(values: List[str]) -> List[List[int]]:
+    return _worker_tokenizer(values).input_ids
@@ -1,5 +1,7 @@
-import concurrent.futures
-from typing import List, Union, Optional
+import asyncio
+import itertools
+from functools import partial
+from typing import List, Union, Optional, Callable, Generator, Set, Any
 from uuid import UUID
 
 import numpy as np
@@ -7,12 +9,15 @@ import pandas as pd
 
 from RAGchain.retrieval.base import BaseRetrieval
 from RAGchain.schema import Passage
+from RAGchain.utils.executor import get_executor
 
 
 class HybridRetrieval(BaseRetrieval):
     """
     Hybrid Retrieval class for retrieve passages from multiple retrievals.
-    You can combine retrieval scores with rrf algorithm or convex combination algorithm.
+    You can combine retrieval scores with convex combination, rrf, CombSUM or CombMNZ algorithm.
+    Scores are fused with numpy arrays. Passage ids are interned to integer codes, and the original ids
+    (str or UUID) are returned as it is.
     """
 
     def __init__(self, retrievals: List[BaseRetrieval],
@@ -20,6 +25,9 @@ class HybridRetrieval(BaseRetrieval):
                  p: int = 500,
                  method: str = 'cc',
                  rrf_k: int = 60,
+                 normalization: str = 'mm',
+                 adaptive: bool = False,
+                 initial_p_factor: int = 4,
                  ):
         """
 
@@ -27,12 +35,26 @@ class HybridRetrieval(BaseRetrieval):
 
         :param retrievals: A list of BaseRetrieval objects. Must be more than 1.
         :param weights: A list of weights corresponding to each retrieval method.
-        The weights should sum up to 1.0.
+        The weights should sum up to 1.0. It is required for cc, and optional for combsum and combmnz.
         :param p: The number of passages to retrieve from each retrieval method. Smaller p will result in
         faster process time, but may result lack of retrieved passages. Default is 500.
-        :param method: The method used to combine the retrieval results. Choose between cc and rrf, which is
-        convex combination and reciprocal rank fusion respectively. Default is 'cc'.
+        :param method: The method used to combine the retrieval results. Choose between cc, rrf, combsum and combmnz.
+        cc is convex combination of normalized scores, for passages retrieved by every retrieval.
+        rrf is reciprocal rank fusion.
+        combsum is (weighted) sum of normalized scores, and a passage which is not retrieved by a retrieval gets 0.
+        combmnz is combsum multiplied by the number of retrievals that retrieved the passage.
+        Default is 'cc'.
         :param rrf_k: k parameter for reciprocal rank fusion. Default is 60.
+        :param normalization: The score normalization method for cc, combsum and combmnz.
+        Choose between 'mm' (min-max) and 'z' (z-score). Default is 'mm'.
+        :param adaptive: If True, each retrieval retrieves top_k * initial_p_factor passages first,
+        and retrieves deeper (doubling the depth, up to p) only when the fused top_k is not stable yet.
+        The fused top_k is stable when passages that are not retrieved can't get higher fused score than
+        the top_k-th passage. It reduces the retrieval work a lot when top_k is much smaller than p.
+        With rrf, the result is the same as retrieving p passages. With other methods, scores are normalized
+        with the retrieved candidates, so the result can be slightly different from retrieving p passages.
+        The used depth is reported at RetrievalResult.metadata['p']. Default is False.
+        :param initial_p_factor: The initial depth multiplier of top_k at adaptive mode. Default is 4.
         """
         super().__init__()
         self.retrievals = retrievals
@@ -41,12 +63,19 @@ class HybridRetrieval(BaseRetrieval):
         if method == 'cc':
             assert sum(weights) == 1.0, "weights should be sum to 1.0"
             assert len(weights) > 1, "weights should be more than 1"
-        elif method == 'rrf':
+        elif method in ['rrf', 'combsum', 'combmnz']:
             pass
         else:
-            raise ValueError("method should be either 'cc' or 'rrf'")
+            raise ValueError("method should be one of 'cc', 'rrf', 'combsum' and 'combmnz'")
+        if weights is not None and len(weights) != len(retrievals):
+            raise ValueError("weights should have the same length with retrievals")
+        if normalization not in ['mm', 'z']:
+            raise ValueError("normalization should be either 'mm' or 'z'")
         self.p = p
         self.method = method
+        self.normalization = normalization
+        self.adaptive = adaptive
+        self.initial_p_factor = initial_p_factor
 
     def retrieve(self, query: str, top_k: int = 5) -> List[Passage]:
         ids = self.retrieve_id(query, top_k)
@@ -57,33 +86,247 @@ class HybridRetrieval(BaseRetrieval):
         for retrieval in self.retrievals:
             retrieval.ingest(passages)
 
+    @property
+    def index_generation(self) -> int:
+        """Changes whenever any of the retrievals ingests or deletes passages."""
+        return self._index_generation + sum(retrieval.index_generation for retrieval in self.retrievals)
+
+    def cache_identity(self) -> Any:
+        """Identities of the retrievals, with the fusion options."""
+        return [type(self).__name__, [retrieval.cache_identity() for retrieval in self.retrievals], self.method,
+                self.weights, self.p, self.rrf_k, self.normalization, self.adaptive, self.initial_p_factor]
+
     def retrieve_id(self, query: str, top_k: int = 5) -> List[Union[str, UUID]]:
         ids, scores = self.retrieve_id_with_scores(query, top_k=top_k)
         return ids
 
     def retrieve_id_with_scores(self, query: str, top_k: int = 5) -> tuple[
         List[Union[str, UUID]], List[float]]:
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(self.retrieve_id_with_scores_parallel, retrieval, query, self.p)
-                       for retrieval in self.retrievals]
+        ids, scores, _ = self.retrieve_id_with_scores_and_metadata(query, top_k=top_k)
+        return ids, scores
+
+    def retrieve_id_with_scores_and_metadata(self, query: str, top_k: int = 5) -> tuple[
+        List[Union[str, UUID]], List[float], dict]:
+        """
+        Retrieve passage ids and fused scores.
+        The metadata has 'p', which is the candidate depth used for the query.
+        With adaptive mode, each retrieval is read with its iter_ids_with_scores cursor,
+        so deeper depth only retrieves the next candidates instead of ranking again from scratch.
+        """
+        cursors, candidates = [None for _ in self.retrievals], [([], []) for _ in self.retrievals]
+
+        def read_cursor(index: int, depth: int):
+            # cursors are made at the workers, so retrievals embed or score the query concurrently
+            if cursors[index] is None:
+                cursors[index] = self.retrievals[index].iter_ids_with_scores(query, page_size=depth)
+            ids, scores = candidates[index]
+            for _id, score in itertools.islice(cursors[index], depth - len(ids)):
+                ids.append(_id)
+                scores.append(score)
+            return list(ids), list(scores)
+
+        def search(queries: List[str], depth: int):
+            if not self.adaptive:
+                results = get_executor().run([partial(retrieval.retrieve_id_with_scores, queries[0], top_k=depth)
+                                              for retrieval in self.retrievals], name='hybrid_retrieve')
+            else:
+                results = get_executor().run([partial(read_cursor, index, depth)
+                                              for index in range(len(self.retrievals))], name='hybrid_retrieve')
+            return [([ids], [scores]) for ids, scores in results]
+
+        ids_list, scores_list, depths = self.__retrieve_and_fuse([query], top_k, search)
+        return ids_list[0], scores_list[0], {"p": depths[0]}
+
+    async def aretrieve_id_with_scores(self, query: str, top_k: int = 5) -> tuple[
+        List[Union[str, UUID]], List[float]]:
+        ids, scores, _ = await self.aretrieve_id_with_scores_and_metadata(query, top_k=top_k)
+        return ids, scores
+
+    async def aretrieve_id_with_scores_and_metadata(self, query: str, top_k: int = 5) -> tuple[
+        List[Union[str, UUID]], List[float], dict]:
+        """
+        Async version of retrieve_id_with_scores_and_metadata.
+        Each retrieval retrieves concurrently with its aretrieve_id_with_scores.
+        """
+
+        async def asearch(queries: List[str], depth: int):
+            results = await asyncio.gather(*[retrieval.aretrieve_id_with_scores(queries[0], top_k=depth)
+                                             for retrieval in self.retrievals])
+            return [([ids], [scores]) for ids, scores in results]
+
+        steps = self.__fuse_steps([query], top_k)
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(await asearch(*request))
+        except StopIteration as stop:
+            ids_list, scores_list, depths = stop.value
+        return ids_list[0], scores_list[0], {"p": depths[0]}
+
+    def indexed_ids(self) -> Optional[List[Union[str, UUID]]]:
+        """
+        Union of indexed ids of the retrievals. None if any retrieval can't list its passages.
+        """
+        result = {}
+        for retrieval in self.retrievals:
+            ids = retrieval.indexed_ids()
+            if ids is None:
+                return None
+            result.update((str(_id), _id) for _id in ids)
+        return list(result.values())
+
+    def retrieve_id_with_scores_allowed(self, query: str, allowed_ids: Set[str], top_k: int = 5) -> Optional[
+        tuple[List[Union[str, UUID]], List[float]]]:
+        """
+        Retrieve allowed passages from each retrieval and fuse them.
+        A retrieval which doesn't support allow lists retrieves as usual, and its passages which are not allowed
+        are dropped before fusion.
+        """
+
+        def retrieve_allowed(retrieval: BaseRetrieval, depth: int):
+            result = retrieval.retrieve_id_with_scores_allowed(query, allowed_ids, top_k=depth)
+            if result is not None:
+                return result
+            ids, scores = retrieval.retrieve_id_with_scores(query, top_k=depth)
+            allowed = [i for i, _id in enumerate(ids) if str(_id) in allowed_ids]
+            return [ids[i] for i in allowed], [scores[i] for i in allowed]
+
+        def search(queries: List[str], depth: int):
+            results = get_executor().run([partial(retrieve_allowed, retrieval, depth)
+                                          for retrieval in self.retrievals], name='hybrid_retrieve')
+            return [([ids], [scores]) for ids, scores in results]
+
+        ids_list, scores_list, _ = self.__retrieve_and_fuse([query], top_k, search)
+        return ids_list[0], scores_list[0]
+
+    def retrieve_id_with_scores_batch(self, queries: List[str], top_k: int = 5) -> tuple[
+        List[List[Union[str, UUID]]], List[List[float]]]:
+        ids_list, scores_list, _ = self.retrieve_id_with_scores_and_metadata_batch(queries, top_k=top_k)
+        return ids_list, scores_list
+
+    def retrieve_id_with_scores_and_metadata_batch(self, queries: List[str], top_k: int = 5) -> tuple[
+        List[List[Union[str, UUID]]], List[List[float]], List[dict]]:
+        """
+        Retrieve every query from each retrieval with its retrieve_id_with_scores_batch, and fuse each query.
+        With adaptive mode, only the queries that are not stable yet are retrieved again with deeper depth.
+        The metadata of each query has 'p', same as retrieve_id_with_scores_and_metadata.
+        """
+
+        def search(batch_queries: List[str], depth: int):
+            return get_executor().run([partial(retrieval.retrieve_id_with_scores_batch, batch_queries, depth)
+                                       for retrieval in self.retrievals], name='hybrid_retrieve_batch')
 
+        ids_list, scores_list, depths = self.__retrieve_and_fuse(queries, top_k, search)
+        return ids_list, scores_list, [{"p": depth} for depth in depths]
+
+    def __retrieve_and_fuse(self, queries: List[str], top_k: int,
+                            search: Callable[[List[str], int], List[tuple[list, list]]]) -> tuple[
+        List[List[Union[str, UUID]]], List[List[float]], List[int]]:
+        """
+        Retrieve candidates with search function and fuse them.
+        search gets queries and depth, and returns (ids of each query, scores of each query) of each retrieval.
+        """
+        steps = self.__fuse_steps(queries, top_k)
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(search(*request))
+        except StopIteration as stop:
+            return stop.value
+
+    def __fuse_steps(self, queries: List[str], top_k: int) -> Generator[
+        tuple[List[str], int], List[tuple[list, list]],
+        tuple[List[List[Union[str, UUID]]], List[List[float]], List[int]]]:
+        """
+        Generator of the fusion steps, so sync and async retrievals share the same logic.
+        It yields (queries, depth) to retrieve, and gets the search results of them with send.
+        When adaptive is True, depth starts from top_k * initial_p_factor and doubles until the fused top_k
+        of the query is stable or depth reaches p.
+        :return: fused ids, fused scores and used depth of each query.
+        """
+        if self.adaptive:
+            depth = min(self.p, max(top_k * self.initial_p_factor, 1))
+        else:
+            depth = self.p
+        ids_list, scores_list, depths = [[] for _ in queries], [[] for _ in queries], [depth for _ in queries]
+        pending = list(range(len(queries)))
+        while len(pending) > 0:
+            batch_results = yield [queries[i] for i in pending], depth
+            next_pending = []
+            for position, query_index in enumerate(pending):
+                results = [(ids_batch[position], scores_batch[position])
+                           for ids_batch, scores_batch in batch_results]
+                ids_list[query_index], scores_list[query_index], stable = self.__fuse(results, top_k, depth)
+                depths[query_index] = depth
+                if self.adaptive and not stable and depth < self.p:
+                    next_pending.append(query_index)
+            pending = next_pending
+            depth = min(self.p, depth * 2)
+        return ids_list, scores_list, depths
+
+    def fuse(self, results: List[tuple[List[Union[str, UUID]], List[float]]],
+             top_k: int) -> tuple[List[Union[str, UUID]], List[float]]:
+        """
+        Fuse the results of each retrieval with self.method.
+        :param results: (passage ids, scores) of each retrieval, in the order of self.retrievals.
+        :param top_k: passages count to return.
+        :return: top_k passage ids and fused scores, sorted by fused score in descending order.
+        """
+        ids, scores, _ = self.__fuse(results, top_k)
+        return ids, scores
+
+    def __fuse(self, results: List[tuple[List[Union[str, UUID]], List[float]]],
+               top_k: int, depth: Optional[int] = None) -> tuple[List[Union[str, UUID]], List[float], bool]:
+        """
+        Fuse the results, and check whether the fused top_k is stable at the given depth.
+        The fused top_k is stable when no passage below the depth can get a fused score higher than
+        the top_k-th fused score, like the threshold algorithm.
+        A passage below the depth of a retrieval can get at most the contribution of the last passage
+        in that retrieval. This bound is exact for rrf. For other methods, scores are normalized
+        with the retrieved candidates, so the bound is an estimate.
+        """
+        passage_ids, scores = self.__to_matrix(results)
+        retrieved = ~np.isnan(scores)
+        weights = np.ones(len(results)) if self.weights is None else np.asarray(self.weights, dtype=np.float64)
         if self.method == 'cc':
-            scores_df = pd.concat([future.result() for future in futures], axis=1, join="inner")
-            normalized_scores = (scores_df - scores_df.min()) / (scores_df.max() - scores_df.min())
-            normalized_scores['weighted_sum'] = normalized_scores.mul(self.weights).sum(axis=1)
-            normalized_scores = normalized_scores.sort_values(by='weighted_sum', ascending=False)
-            return (list(map(self.__str_to_uuid, normalized_scores.index[:top_k].tolist())),
-                    normalized_scores['weighted_sum'][:top_k].tolist())
+            candidates = np.flatnonzero(retrieved.all(axis=1))
+            fused = self.__normalize(scores[candidates]) @ weights
         elif self.method == 'rrf':
-            scores_df = pd.concat([future.result() for future in futures], axis=1)
-            rank_df = scores_df.rank(ascending=False, method='min')
-            rank_df = rank_df.fillna(0)
-            rank_df['rrf'] = rank_df.apply(self.__rrf_calculate, axis=1)
-            rank_df = rank_df.sort_values(by='rrf', ascending=False)
-            return (list(map(self.__str_to_uuid, rank_df.index[:top_k].tolist())),
-                    rank_df['rrf'][:top_k].tolist())
+            candidates = np.arange(len(passage_ids))
+            fused = np.nansum(self.__rrf_contributions(scores, retrieved), axis=1)
+        elif self.method in ['combsum', 'combmnz']:
+            candidates = np.arange(len(passage_ids))
+            fused = self.__normalize(scores) @ weights
+            if self.method == 'combmnz':
+                fused *= retrieved.sum(axis=1)
+        else:
+            raise ValueError("method should be one of 'cc', 'rrf', 'combsum' and 'combmnz'")
+        order = self.__top_k_order(fused, top_k)
+        ids, fused_scores = [passage_ids[candidates[i]] for i in order], fused[order].tolist()
+        if depth is None:
+            return ids, fused_scores, True
+
+        exhausted = np.array([len(result_ids) < depth for result_ids, _ in results], dtype=bool)
+        if exhausted.all() or top_k <= 0:
+            return ids, fused_scores, True
+        if len(order) < top_k:
+            return ids, fused_scores, False
+        # contributions of each retrieved passage, and upper bound of the contribution of unseen passages
+        if self.method == 'rrf':
+            contributions = self.__rrf_contributions(scores, retrieved)
+            unseen_bounds = np.where(exhausted, 0.0, 1 / (depth + 1 + self.rrf_k))
         else:
-            raise ValueError("method should be either 'cc' or 'rrf'")
+            contributions = np.where(retrieved, self.__normalize(scores), np.nan) * weights
+            last_contributions = np.array([np.nanmin(column) if column_retrieved.any() else 0.0
+                                           for column, column_retrieved in zip(contributions.T, retrieved.T)])
+            missing = -np.inf if self.method == 'cc' else 0.0
+            unseen_bounds = np.where(exhausted, missing, np.maximum(last_contributions, missing))
+        incomplete = ~retrieved.all(axis=1)
+        upper_bounds = np.where(retrieved[incomplete], contributions[incomplete], unseen_bounds).sum(axis=1)
+        upper_bounds = np.append(upper_bounds, unseen_bounds.sum())
+        if self.method == 'combmnz':
+            upper_bounds *= len(results)
+        return ids, fused_scores, bool(fused_scores[-1] >= upper_bounds.max())
 
     def delete(self, ids: List[Union[str, UUID]]):
         for retrieval in self.retrievals:
@@ -97,17 +340,67 @@ class HybridRetrieval(BaseRetrieval):
     def min_max_normalization(arr: np.ndarray):
         return (arr - np.min(arr)) / (np.max(arr) - np.min(arr))
 
+    def __rrf_contributions(self, scores: np.ndarray, retrieved: np.ndarray) -> np.ndarray:
+        """
+        Get 1 / (rank + rrf_k) of each retrieved passage. Rank is the min rank among ties. Nan if not retrieved.
+        """
+        contributions = np.full(scores.shape, np.nan, dtype=np.float64)
+        for j in range(scores.shape[1]):
+            column_scores = scores[retrieved[:, j], j]
+            ranks = np.searchsorted(np.sort(-column_scores), -column_scores, side='left') + 1
+            contributions[retrieved[:, j], j] = 1 / (ranks + self.rrf_k)
+        return contributions
+
     @staticmethod
-    def __str_to_uuid(input_str: str) -> Union[str, UUID]:
-        try:
-            return UUID(input_str)
-        except:
-            return input_str
-
-    def __rrf_calculate(self, row):
-        result = 0
-        for r in row:
-            if r == 0:
-                continue
-            result += 1 / (r + self.rrf_k)
-        return result
+    def __to_matrix(results: List[tuple[List[Union[str, UUID]], List[float]]]) -> tuple[
+        List[Union[str, UUID]], np.ndarray]:
+        """
+        Intern passage ids to integer codes, and make (passage, retrieval) score matrix.
+        Ids are interned by their string, so UUID and str ids of the same passage are merged.
+        The id first retrieved is returned. Score is nan when the retrieval did not retrieve the passage.
+        """
+        codes = {}
+        passage_ids = []
+
+        def code(_id: Union[str, UUID]) -> int:
+            key = str(_id)
+            if key not in codes:
+                codes[key] = len(passage_ids)
+                passage_ids.append(_id)
+            return codes[key]
+
+        rows = [np.fromiter((code(_id) for _id in ids), dtype=np.int64, count=len(ids)) for ids, _ in results]
+        scores = np.full((len(passage_ids), len(results)), np.nan, dtype=np.float64)
+        for column, (row, (_, retrieval_scores)) in enumerate(zip(rows, results)):
+            scores[row, column] = retrieval_scores
+        return passage_ids, scores
+
+    def __normalize(self, scores: np.ndarray) -> np.ndarray:
+        """
+        Normalize each column of scores, ignoring nan. Nan and scores of a constant or empty column become 0.
+        """
+        retrieved = ~np.isnan(scores)
+        counts = retrieved.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            if self.normalization == 'mm':
+                center = np.where(retrieved, scores, np.inf).min(axis=0, initial=np.inf)
+                scale = np.where(retrieved, scores, -np.inf).max(axis=0, initial=-np.inf) - center
+            else:
+                center = np.where(retrieved, scores, 0.0).sum(axis=0) / np.maximum(counts, 1)
+                deviations = np.where(retrieved, scores - center, 0.0)
+                scale = np.sqrt((deviations ** 2).sum(axis=0) / np.maximum(counts, 1))
+            # empty columns and constant columns have no scale, so they stay 0
+            valid = (counts > 0) & np.isfinite(scale) & (scale > 0)
+            normalized = np.zeros(scores.shape, dtype=np.float64)
+            normalized[:, valid] = (scores[:, valid] - center[valid]) / scale[valid]
+        return np.nan_to_num(normalized, nan=0.0, posinf=0.0, neginf=0.0)
+
+    @staticmethod
+    def __top_k_order(scores: np.ndarray, top_k: int) -> np.ndarray:
+        if top_k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        if top_k < len(scores):
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates], kind='stable')]
@@ -1,5 +1,9 @@
+import asyncio
+import concurrent.futures
 import logging
-from typing import List, Union
+import threading
+import time
+from typing import List, Union, Optional, Set, Iterator, Any
 from uuid import UUID
 
 from langchain.chat_models.base import BaseChatModel
@@ -7,32 +11,84 @@ from langchain.llms import BaseLLM
 from langchain.prompts import PromptTemplate, ChatPromptTemplate
 from langchain.schema import StrOutputParser
 from langchain.schema.language_model import BaseLanguageModel
+from langchain_core.runnables.config import run_in_executor
 
 from RAGchain.retrieval.base import BaseRetrieval
 from RAGchain.schema import Passage
+from RAGchain.utils.cache import BaseCache, make_cache_key, normalize_query
+from RAGchain.utils.executor import get_executor
 
 logger = logging.getLogger(__name__)
 
+# pool for generations which are started from worker threads of the shared executor,
+# like HyDERetrieval at HybridRetrieval, so waiting for them can't starve the shared pool
+_generation_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_generation_executor_lock = threading.Lock()
+
+
+def _get_generation_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _generation_executor
+    with _generation_executor_lock:
+        if _generation_executor is None:
+            _generation_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4,
+                                                                         thread_name_prefix='RAGchain-hyde')
+        return _generation_executor
+
 
 class HyDERetrieval(BaseRetrieval):
     """
     HyDE Retrieval, which inspired by "Precise Zero-shot Dense Retrieval without Relevance Labels" (https://arxiv.org/pdf/2212.10496.pdf)
     At retrieval, LLM model creates hypothetical passage.
     And then, retrieve passages using hypothetical passage as query.
+
+    Set num_samples to generate several hypothetical passages at one batch call,
+    and fuse their results with reciprocal rank fusion. They are retrieved with one batched retrieval.
+    Set speculative to retrieve the raw query while the LLM generates, and fuse both results
+    when the hypothetical passages arrive. With deadline, raw query results are returned
+    when the generation is not done in time, and metadata has 'hyde_fallback' True.
+    Set hypothesis_cache to reuse hypothetical passages of the same query, prompt and model.
+
+    :example:
+    >>> from RAGchain.retrieval import HyDERetrieval, BM25Retrieval
+    >>> from RAGchain.utils.cache import SQLiteCache
+    >>> retrieval = HyDERetrieval(BM25Retrieval('./bm25.pkl'), llm, num_samples=3, speculative=True,
+    >>>                           deadline=2.0, hypothesis_cache=SQLiteCache('./hyde_cache.sqlite', ttl=None))
+    >>> result = retrieval.invoke("What is visconde structure?")
     """
     BASIC_SYSTEM_PROMPT = "Please write a passage to answer the question"
 
     def __init__(self, retrieval: BaseRetrieval, llm: BaseLanguageModel,
-                 system_prompt: str = None):
+                 system_prompt: str = None, num_samples: int = 1, speculative: bool = False,
+                 deadline: Optional[float] = None, hypothesis_cache: Optional[BaseCache] = None,
+                 rrf_k: int = 60):
         """
         :param retrieval: retrieval instance to use
         :param llm: llm to use for hypothetical passage generation. HyDE Retrieval supports both chat and completion LLMs.
         :param system_prompt: system prompt to use when generating hypothetical passage
+        :param num_samples: number of hypothetical passages to generate for each query. Default is 1.
+        Use temperature above 0 at the llm, or samples will be the same.
+        :param speculative: whether to retrieve the raw query concurrently with the generation,
+        and fuse its result with the results of hypothetical passages. Default is False.
+        :param deadline: seconds to wait for the generation in speculative mode.
+        Raw query results are returned after the deadline. Default is None, which waits until the generation ends.
+        :param hypothesis_cache: cache of hypothetical passages. Default is None, which disables caching.
+        :param rrf_k: k parameter for reciprocal rank fusion of multiple results. Default is 60.
         """
         super().__init__()
+        if num_samples < 1:
+            raise ValueError("num_samples must be at least 1")
+        if deadline is not None and deadline <= 0:
+            raise ValueError("deadline must be positive")
+        if deadline is not None and not speculative:
+            raise ValueError("deadline is only available at speculative mode")
         self.retrieval = retrieval
         self.llm = llm
         self.system_prompt = self.BASIC_SYSTEM_PROMPT if system_prompt is None else system_prompt
+        self.num_samples = num_samples
+        self.speculative = speculative
+        self.deadline = deadline
+        self.hypothesis_cache = hypothesis_cache
+        self.rrf_k = rrf_k
         prompt = self.__make_prompt()
         self.runnable = prompt | self.llm | StrOutputParser()
 
@@ -45,6 +101,16 @@ class HyDERetrieval(BaseRetrieval):
     def ingest(self, passages: List[Passage]):
         self.retrieval.ingest(passages)
 
+    @property
+    def index_generation(self) -> int:
+        return self._index_generation + self.retrieval.index_generation
+
+    def cache_identity(self) -> Any:
+        """Identity of the retrieval, with the llm and the generation options."""
+        return [type(self).__name__, self.retrieval.cache_identity(), self.system_prompt, type(self.llm).__name__,
+                getattr(self.llm, '_identifying_params', None), self.num_samples, self.speculative, self.deadline,
+                self.rrf_k]
+
     def retrieve_id(self, query: str, top_k: int = 5, *args, **kwargs) -> List[
         Union[str, UUID]]:
         ids, scores = self.retrieve_id_with_scores(query, top_k, *args, **kwargs)
@@ -52,14 +118,251 @@ class HyDERetrieval(BaseRetrieval):
 
     def retrieve_id_with_scores(self, query: str, top_k: int = 5, *args, **kwargs) -> \
             tuple[List[Union[str, UUID]], List[float]]:
-        hyde_answer = self.runnable.invoke({"question": query})
-        # logging
-        logger.info(f"HyDE answer : {hyde_answer}")
-        return self.retrieval.retrieve_id_with_scores(query=hyde_answer.strip(), top_k=top_k, *args, **kwargs)
+        if not self.speculative and self.num_samples == 1:
+            hyde_answer = self.__hypotheses(query)[0][0]
+            return self.retrieval.retrieve_id_with_scores(query=hyde_answer, top_k=top_k, *args, **kwargs)
+        ids, scores, _ = self.retrieve_id_with_scores_and_metadata(query, top_k=top_k)
+        return ids, scores
+
+    def retrieve_id_with_scores_and_metadata(self, query: str, top_k: int = 5) -> tuple[
+        List[Union[str, UUID]], List[float], dict]:
+        """
+        Retrieve passage ids and scores, with metadata of the generation.
+        Metadata has 'hypotheses', which are the generated passages, 'hypothesis_cache_hit',
+        and 'hyde_fallback', which is True when raw query results are returned after the deadline.
+        """
+        if not self.speculative:
+            hypotheses, cache_hit = self.__hypotheses(query)
+            ids, scores = self.__retrieve_hypotheses(hypotheses, top_k)
+            return ids, scores, self.__metadata(hypotheses, cache_hit, False)
+
+        start = time.perf_counter()
+        executor = get_executor()
+        if executor.in_worker():
+            # submitting to the shared pool from its worker thread can starve it
+            generation = _get_generation_executor().submit(self.__hypotheses, query)
+        else:
+            generation = executor.submit(lambda: self.__hypotheses(query), name='hyde_generation')
+        raw_ids, raw_scores = self.retrieval.retrieve_id_with_scores(query, top_k=top_k)
+        timeout = None if self.deadline is None else max(self.deadline - (time.perf_counter() - start), 0.0)
+        try:
+            hypotheses, cache_hit = generation.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            # the generation keeps running, so it still fills hypothesis_cache for the next query
+            logger.info(f"HyDE generation exceeded the deadline of {self.deadline} seconds")
+            return raw_ids, raw_scores, self.__metadata([], False, True)
+        ids, scores = self.__retrieve_hypotheses(hypotheses, top_k)
+        ids, scores = self.__fuse([(raw_ids, raw_scores), (ids, scores)], top_k)
+        return ids, scores, self.__metadata(hypotheses, cache_hit, False)
+
+    async def aretrieve_id_with_scores(self, query: str, top_k: int = 5, *args, **kwargs) -> \
+            tuple[List[Union[str, UUID]], List[float]]:
+        """
+        Generate hypothetical passage with runnable ainvoke, and retrieve it with aretrieve_id_with_scores
+        of the retrieval.
+        """
+        if not self.speculative and self.num_samples == 1:
+            hyde_answer = (await self.__ahypotheses(query))[0][0]
+            return await self.retrieval.aretrieve_id_with_scores(hyde_answer, top_k, *args, **kwargs)
+        ids, scores, _ = await self.aretrieve_id_with_scores_and_metadata(query, top_k=top_k)
+        return ids, scores
+
+    async def aretrieve_id_with_scores_and_metadata(self, query: str, top_k: int = 5) -> tuple[
+        List[Union[str, UUID]], List[float], dict]:
+        """
+        Async version of retrieve_id_with_scores_and_metadata.
+        In speculative mode, the generation runs as a task while the raw query is retrieved.
+        """
+        if not self.speculative:
+            hypotheses, cache_hit = await self.__ahypotheses(query)
+            ids, scores = await self.__aretrieve_hypotheses(hypotheses, top_k)
+            return ids, scores, self.__metadata(hypotheses, cache_hit, False)
+
+        start = time.perf_counter()
+        generation = asyncio.ensure_future(self.__ahypotheses(query))
+        raw_ids, raw_scores = await self.retrieval.aretrieve_id_with_scores(query, top_k)
+        timeout = None if self.deadline is None else max(self.deadline - (time.perf_counter() - start), 0.0)
+        try:
+            hypotheses, cache_hit = await asyncio.wait_for(asyncio.shield(generation), timeout)
+        except asyncio.TimeoutError:
+            logger.info(f"HyDE generation exceeded the deadline of {self.deadline} seconds")
+            return raw_ids, raw_scores, self.__metadata([], False, True)
+        ids, scores = await self.__aretrieve_hypotheses(hypotheses, top_k)
+        ids, scores = self.__fuse([(raw_ids, raw_scores), (ids, scores)], top_k)
+        return ids, scores, self.__metadata(hypotheses, cache_hit, False)
+
+    def retrieve_id_with_scores_batch(self, queries: List[str], top_k: int = 5) -> tuple[
+        List[List[Union[str, UUID]]], List[List[float]]]:
+        ids_list, scores_list, _ = self.retrieve_id_with_scores_and_metadata_batch(queries, top_k=top_k)
+        return ids_list, scores_list
+
+    def retrieve_id_with_scores_and_metadata_batch(self, queries: List[str], top_k: int = 5) -> tuple[
+        List[List[Union[str, UUID]]], List[List[float]], List[dict]]:
+        """
+        Generate hypothetical passages of every query with runnable batch,
+        and retrieve them with retrieve_id_with_scores_batch of the retrieval.
+        Cached hypothetical passages are not generated again.
+        In speculative mode, raw queries are retrieved at the same batch, but the deadline doesn't apply,
+        so 'hyde_fallback' of the metadata is always False.
+        """
+        hypotheses_list, cache_hits = self.__hypotheses_batch(queries)
+        batch_queries = [hypothesis for hypotheses in hypotheses_list for hypothesis in hypotheses]
+        if self.speculative:
+            batch_queries += queries
+        ids_list, scores_list = self.retrieval.retrieve_id_with_scores_batch(batch_queries, top_k=top_k)
+        results = list(zip(ids_list, scores_list))
+        raw_results = results[len(results) - len(queries):] if self.speculative else []
+        fused_ids, fused_scores = [], []
+        start = 0
+        for i, hypotheses in enumerate(hypotheses_list):
+            query_results = results[start:start + len(hypotheses)]
+            start += len(hypotheses)
+            if self.speculative:
+                query_results = [raw_results[i]] + query_results
+            ids, scores = self.__fuse(query_results, top_k) if len(query_results) > 1 else query_results[0]
+            fused_ids.append(list(ids))
+            fused_scores.append(list(scores))
+        metadata_list = [self.__metadata(hypotheses, cache_hit, False)
+                         for hypotheses, cache_hit in zip(hypotheses_list, cache_hits)]
+        return fused_ids, fused_scores, metadata_list
 
     def delete(self, ids: List[Union[str, UUID]]):
         self.retrieval.delete(ids)
 
+    def iter_ids_with_scores(self, query: str, page_size: int = 10) -> Iterator[tuple[Union[str, UUID], float]]:
+        """
+        Generate hypothetical passage once, and page through iter_ids_with_scores of the retrieval.
+        With multiple samples or speculative mode, pages are fused again with doubled depth,
+        reusing the generated passages.
+        """
+        hypotheses, _ = self.__hypotheses(query)
+        if not self.speculative and len(hypotheses) == 1:
+            return self.retrieval.iter_ids_with_scores(hypotheses[0], page_size=page_size)
+        return self.__iter_fused(query, hypotheses, page_size)
+
+    def indexed_ids(self) -> Optional[List[Union[str, UUID]]]:
+        return self.retrieval.indexed_ids()
+
+    def retrieve_id_with_scores_allowed(self, query: str, allowed_ids: Set[str], top_k: int = 5) -> Optional[
+        tuple[List[Union[str, UUID]], List[float]]]:
+        """
+        Generate hypothetical passage, and retrieve it with retrieve_id_with_scores_allowed of the retrieval.
+        """
+        hypotheses, _ = self.__hypotheses(query)
+        queries = hypotheses + [query] if self.speculative else hypotheses
+        results = []
+        for hyde_query in queries:
+            result = self.retrieval.retrieve_id_with_scores_allowed(hyde_query, allowed_ids, top_k=top_k)
+            if result is None:
+                return None
+            results.append(result)
+        return results[0] if len(results) == 1 else self.__fuse(results, top_k)
+
+    def hypothesis_cache_key(self, query: str) -> str:
+        """
+        Cache key of hypothetical passages. It is made of the normalized query, the system prompt,
+        the llm and its parameters, and num_samples.
+        """
+        return make_cache_key(type(self).__name__, normalize_query(query), self.system_prompt,
+                              type(self.llm).__name__, getattr(self.llm, '_identifying_params', None),
+                              self.num_samples)
+
+    def __hypotheses(self, query: str) -> tuple[List[str], bool]:
+        """
+        Get hypothetical passages of the query from hypothesis_cache, or generate them.
+        :return: hypothetical passages, and whether they are cached.
+        """
+        cached = self.__cached_hypotheses(query)
+        if cached is not None:
+            return cached, True
+        if self.num_samples == 1:
+            answers = [self.runnable.invoke({"question": query})]
+        else:
+            answers = self.runnable.batch([{"question": query}] * self.num_samples)
+        return self.__store_hypotheses(query, answers), False
+
+    async def __ahypotheses(self, query: str) -> tuple[List[str], bool]:
+        cached = self.__cached_hypotheses(query)
+        if cached is not None:
+            return cached, True
+        if self.num_samples == 1:
+            answers = [await self.runnable.ainvoke({"question": query})]
+        else:
+            answers = await self.runnable.abatch([{"question": query}] * self.num_samples)
+        return self.__store_hypotheses(query, answers), False
+
+    def __hypotheses_batch(self, queries: List[str]) -> tuple[List[List[str]], List[bool]]:
+        """
+        Get hypothetical passages of every query, and whether they were cached.
+        Passages which are not cached are generated at one batch.
+        """
+        hypotheses_list = [self.__cached_hypotheses(query) for query in queries]
+        missing = [i for i, hypotheses in enumerate(hypotheses_list) if hypotheses is None]
+        cache_hits = [hypotheses is not None for hypotheses in hypotheses_list]
+        if len(missing) > 0:
+            answers = self.runnable.batch([{"question": queries[i]} for i in missing for _ in range(self.num_samples)])
+            for j, i in enumerate(missing):
+                hypotheses_list[i] = self.__store_hypotheses(
+                    queries[i], answers[j * self.num_samples:(j + 1) * self.num_samples])
+        return hypotheses_list, cache_hits
+
+    def __cached_hypotheses(self, query: str) -> Optional[List[str]]:
+        if self.hypothesis_cache is None:
+            return None
+        return self.hypothesis_cache.get(self.hypothesis_cache_key(query))
+
+    def __store_hypotheses(self, query: str, answers: List[str]) -> List[str]:
+        hypotheses = [answer.strip() for answer in answers]
+        logger.info(f"HyDE answers : {hypotheses}")
+        if self.hypothesis_cache is not None:
+            self.hypothesis_cache.set(self.hypothesis_cache_key(query), hypotheses)
+        return hypotheses
+
+    def __retrieve_hypotheses(self, hypotheses: List[str], top_k: int) -> tuple[
+        List[Union[str, UUID]], List[float]]:
+        if len(hypotheses) == 1:
+            return self.retrieval.retrieve_id_with_scores(hypotheses[0], top_k=top_k)
+        ids_list, scores_list = self.retrieval.retrieve_id_with_scores_batch(hypotheses, top_k=top_k)
+        return self.__fuse(list(zip(ids_list, scores_list)), top_k)
+
+    async def __aretrieve_hypotheses(self, hypotheses: List[str], top_k: int) -> tuple[
+        List[Union[str, UUID]], List[float]]:
+        if len(hypotheses) == 1:
+            return await self.retrieval.aretrieve_id_with_scores(hypotheses[0], top_k)
+        return await run_in_executor(None, self.__retrieve_hypotheses, hypotheses, top_k)
+
+    def __iter_fused(self, query: str, hypotheses: List[str], page_size: int) -> Iterator[
+        tuple[Union[str, UUID], float]]:
+        queries = hypotheses + [query] if self.speculative else hypotheses
+        depth = max(page_size, 1)
+        yielded = set()
+        while True:
+            ids_list, scores_list = self.retrieval.retrieve_id_with_scores_batch(queries, top_k=depth)
+            ids, scores = self.__fuse(list(zip(ids_list, scores_list)), depth)
+            for _id, score in zip(ids, scores):
+                if str(_id) not in yielded:
+                    yielded.add(str(_id))
+                    yield _id, score
+            if all(len(result_ids) < depth for result_ids in ids_list):
+                return
+            depth *= 2
+
+    def __fuse(self, results: List[tuple[List[Union[str, UUID]], List[float]]],
+               top_k: int) -> tuple[List[Union[str, UUID]], List[float]]:
+        """
+        Fuse results with reciprocal rank fusion. Ties are ordered by the first appearance.
+        """
+        fused: dict[Any, float] = {}
+        for ids, _ in results:
+            for rank, _id in enumerate(ids, start=1):
+                fused[_id] = fused.get(_id, 0.0) + 1 / (rank + self.rrf_k)
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [_id for _id, _ in ranked], [score for _, score in ranked]
+
+    @staticmethod
+    def __metadata(hypotheses: List[str], cache_hit: bool, fallback: bool) -> dict:
+        return {'hypotheses': hypotheses, 'hypothesis_cache_hit': cache_hit, 'hyde_fallback': fallback}
+
     def __make_prompt(self):
         if isinstance(self.llm, BaseLLM):
             return PromptTemplate.from_template(
@@ -1,11 +1,16 @@
-from typing import List, Union
+from datetime import datetime
+from typing import List, Union, Optional, Set, Iterator, Any
 from uuid import UUID
 
 from langchain.schema import Document
+from langchain_core.runnables.config import run_in_executor
+from langchain.schema.embeddings import Embeddings
 from langchain.schema.vectorstore import VectorStore
+from langchain.vectorstores import Chroma, Pinecone
 
 from RAGchain.retrieval.base import BaseRetrieval
 from RAGchain.schema import Passage
+from RAGchain.utils.vectorstore import NumpySlim, ChromaSlim, PineconeSlim
 from RAGchain.utils.vectorstore.base import SlimVectorStore
 
 
@@ -16,14 +21,31 @@ class VectorDBRetrieval(BaseRetrieval):
     Then, store the embedded vector in VectorDB.
     When retrieving, embed the query and search the most similar vectors in VectorDB.
     Lastly, return the passages that have the most similar vectors.
+    With NumpySlim, vectors are searched in process, and scores are similarities from the most similar one.
+
+    At retrieve_with_filter with allow_list_cache, allowed passages are searched with a mask of NumpySlim,
+    or a passage_id `$in` filter of Chroma. With native_filter, filepath, importance and content_datetime_range
+    filters are applied by ChromaSlim and PineconeSlim themselves, without reading the DBs.
+
+    With NumpySlim, cached results are keyed by the uid and version saved with the store,
+    so they are shared by every process which loads the same save_path.
     """
 
-    def __init__(self, vectordb: VectorStore):
+    def __init__(self, vectordb: VectorStore, batch_embed_queries: bool = True, native_filter: bool = False):
         """
         :param vectordb: VectorStore instance. You can all langchain VectorStore classes, also you can use SlimVectorStore for better storage efficiency.
+        :param batch_embed_queries: If True, queries of retrieve_id_with_scores_batch are embedded with
+        one embed_documents call. Set this False when your embedding model embeds queries differently from
+        documents (for example, instruction embedding models), so each query is embedded with embed_query.
+        Default is True.
+        :param native_filter: If True, filters of retrieve_with_filter are converted to metadata filters of
+        ChromaSlim and PineconeSlim. Set this only when every passage is ingested with filter metadata,
+        which ChromaSlim and PineconeSlim store from this version. Default is False.
         """
         super().__init__()
         self.vectordb = vectordb
+        self.batch_embed_queries = batch_embed_queries
+        self.native_filter = native_filter
 
     def ingest(self, passages: List[Passage]):
         if isinstance(self.vectordb, SlimVectorStore):
@@ -32,6 +54,26 @@ class VectorDBRetrieval(BaseRetrieval):
             self.vectordb.add_documents(
                 [Document(page_content=passage.content, metadata={'passage_id': str(passage.id)}) for passage in
                  passages])
+        if not isinstance(self.vectordb, NumpySlim):
+            # NumpySlim counts its own version
+            self.bump_index_generation()
+
+    @property
+    def index_generation(self) -> int:
+        if isinstance(self.vectordb, NumpySlim):
+            return self._index_generation + self.vectordb.version
+        return self._index_generation
+
+    def cache_identity(self) -> Any:
+        """
+        The uid of NumpySlim, which is saved with its vectors.
+        Other VectorStores are identified by their collection with a random token of this instance,
+        because their changes are counted in process.
+        """
+        if isinstance(self.vectordb, NumpySlim):
+            return [type(self).__name__, type(self.vectordb).__name__, self.vectordb.uid]
+        collection = getattr(self.vectordb, '_collection', None)
+        return [super().cache_identity(), type(self.vectordb).__name__, getattr(collection, 'name', None)]
 
     def retrieve(self, query: str, top_k: int = 5) -> List[Passage]:
         ids = self.retrieve_id(query, top_k)
@@ -44,14 +86,140 @@ class VectorDBRetrieval(BaseRetrieval):
 
     def retrieve_id_with_scores(self, query: str, top_k: int = 5) -> tuple[
         List[Union[str, UUID]], List[float]]:
-        results = self.vectordb.similarity_search_with_score(query=query, k=top_k)
+        if isinstance(self.vectordb, NumpySlim):
+            ids, scores = self.vectordb.search(self.vectordb.embeddings.embed_query(query), top_k)
+            return [self.__str_to_uuid(_id) for _id in ids], scores
+        return self.__similarity_search(query, top_k)
+
+    def iter_ids_with_scores(self, query: str, page_size: int = 10) -> Iterator[tuple[Union[str, UUID], float]]:
+        """
+        With exact NumpySlim, the query is embedded and scored once, and each next page only selects
+        the best remaining scores. Other VectorStores search again with doubled depth for each next page.
+        """
+        if isinstance(self.vectordb, NumpySlim) and self.vectordb.index_type == 'exact' and \
+                self.vectordb.quantization is None:
+            cursor = self.vectordb.iter_search(self.vectordb.embeddings.embed_query(query), page_size=page_size)
+            return ((self.__str_to_uuid(_id), score) for _id, score in cursor)
+        return super().iter_ids_with_scores(query, page_size=page_size)
+
+    def indexed_ids(self) -> Optional[List[Union[str, UUID]]]:
+        """
+        Ids of passages at NumpySlim or Chroma. Other VectorStores can't list their passages.
+        """
+        if isinstance(self.vectordb, NumpySlim):
+            return [self.__str_to_uuid(_id) for _id in self.vectordb.ids()]
+        if isinstance(self.vectordb, Chroma):
+            metadatas = self.vectordb.get(include=['metadatas'])['metadatas']
+            return [self.__str_to_uuid(metadata['passage_id']) for metadata in metadatas
+                    if metadata is not None and 'passage_id' in metadata]
+        return None
+
+    def retrieve_id_with_scores_allowed(self, query: str, allowed_ids: Set[str], top_k: int = 5) -> Optional[
+        tuple[List[Union[str, UUID]], List[float]]]:
+        """
+        Search only allowed passages. NumpySlim masks other vectors while scoring,
+        and Chroma and Pinecone search with a passage_id `$in` filter.
+        """
+        if isinstance(self.vectordb, NumpySlim):
+            ids, scores = self.vectordb.search(self.vectordb.embeddings.embed_query(query), top_k,
+                                               allowed_ids=allowed_ids)
+            return [self.__str_to_uuid(_id) for _id in ids], scores
+        if not isinstance(self.vectordb, (Chroma, Pinecone)):
+            return None
+        if len(allowed_ids) == 0:
+            return [], []
+        return self.__similarity_search(query, top_k, filter={'passage_id': {'$in': sorted(allowed_ids)}})
+
+    def retrieve_id_with_native_filter(self, query: str, top_k: int = 5,
+                                       content: Optional[List[str]] = None,
+                                       filepath: Optional[List[str]] = None,
+                                       content_datetime_range: Optional[List[tuple[datetime, datetime]]] = None,
+                                       importance: Optional[List[int]] = None,
+                                       **kwargs) -> Optional[tuple[List[Union[str, UUID]], List[float]]]:
+        """
+        Search with metadata filters of ChromaSlim and PineconeSlim when native_filter is True.
+        content and metadata_etc filters are not stored at vector stores, so they return None.
+        """
+        if not self.native_filter or not isinstance(self.vectordb, (ChromaSlim, PineconeSlim)):
+            return None
+        if content is not None or len(kwargs) > 0:
+            return None
+        where = self.vectordb.where_filter(filepath=filepath, content_datetime_range=content_datetime_range,
+                                           importance=importance)
+        return self.__similarity_search(query, top_k, filter=where)
+
+    def __similarity_search(self, query: str, top_k: int, **kwargs) -> tuple[List[Union[str, UUID]], List[float]]:
+        results = self.vectordb.similarity_search_with_score(query=query, k=top_k, **kwargs)
+        results = results[::-1]
+        docs = [result[0] for result in results]
+        scores = [result[1] for result in results]
+        return [self.__str_to_uuid(doc.metadata.get('passage_id')) for doc in docs], scores
+
+    async def aretrieve_id_with_scores(self, query: str, top_k: int = 5) -> tuple[
+        List[Union[str, UUID]], List[float]]:
+        """
+        Retrieve with asimilarity_search_with_score of the VectorStore,
+        which is native async when the VectorStore supports it.
+        """
+        if isinstance(self.vectordb, NumpySlim):
+            embedding = await self.vectordb.embeddings.aembed_query(query)
+            ids, scores = await run_in_executor(None, self.vectordb.search, embedding, top_k)
+            return [self.__str_to_uuid(_id) for _id in ids], scores
+        results = await self.vectordb.asimilarity_search_with_score(query=query, k=top_k)
         results = results[::-1]
         docs = [result[0] for result in results]
         scores = [result[1] for result in results]
         return [self.__str_to_uuid(doc.metadata.get('passage_id')) for doc in docs], scores
 
+    def retrieve_id_with_scores_batch(self, queries: List[str], top_k: int = 5) -> tuple[
+        List[List[Union[str, UUID]]], List[List[float]]]:
+        """
+        Embed queries at once and search them together.
+        Chroma searches every query embedding with one collection query.
+        Pinecone searches each query embedding, because its index has no batch query.
+        NumpySlim scores every query embedding with one matmul.
+        Other VectorStores call retrieve_id_with_scores for each query.
+        """
+        if len(queries) == 0:
+            return [], []
+        if isinstance(self.vectordb, NumpySlim):
+            ids_list, scores_list = self.vectordb.search_batch(
+                self.__embed_queries(self.vectordb.embeddings, queries), top_k)
+            return [[self.__str_to_uuid(_id) for _id in ids] for ids in ids_list], scores_list
+        if isinstance(self.vectordb, Chroma):
+            if self.vectordb.embeddings is None:
+                results = self.vectordb._collection.query(query_texts=queries, n_results=top_k,
+                                                          include=['metadatas', 'distances'])
+            else:
+                results = self.vectordb._collection.query(
+                    query_embeddings=self.__embed_queries(self.vectordb.embeddings, queries),
+                    n_results=top_k, include=['metadatas', 'distances'])
+            results = [list(zip(metadatas, distances))
+                       for metadatas, distances in zip(results['metadatas'], results['distances'])]
+        elif isinstance(self.vectordb, Pinecone) and isinstance(self.vectordb.embeddings, Embeddings):
+            embeddings = self.__embed_queries(self.vectordb.embeddings, queries)
+            results = [[(doc.metadata, score) for doc, score in
+                        self.vectordb.similarity_search_by_vector_with_score(embedding, k=top_k)]
+                       for embedding in embeddings]
+        else:
+            return super().retrieve_id_with_scores_batch(queries, top_k=top_k)
+
+        ids_list, scores_list = [], []
+        for result in results:
+            result = result[::-1]
+            ids_list.append([self.__str_to_uuid(metadata.get('passage_id')) for metadata, _ in result])
+            scores_list.append([score for _, score in result])
+        return ids_list, scores_list
+
+    def __embed_queries(self, embeddings: Embeddings, queries: List[str]) -> List[List[float]]:
+        if self.batch_embed_queries:
+            return embeddings.embed_documents(queries)
+        return [embeddings.embed_query(query) for query in queries]
+
     def delete(self, ids: List[Union[str, UUID]]):
         self.vectordb.delete([str(_id) for _id in ids])
+        if not isinstance(self.vectordb, NumpySlim):
+            self.bump_index_generation()
 
     @staticmethod
     def __str_to_uuid(input_str: str) -> Union[str, UUID]:
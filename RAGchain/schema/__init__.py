@@ -3,3 +3,4 @@ from .evaluate_result import EvaluateResult
 from .passage import Passage
 from .prompt import RAGchainPromptTemplate, RAGchainChatPromptTemplate
 from .retrieval_result import RetrievalResult
+from .stream_event import StreamEvent
@@ -1,8 +1,10 @@
+import json
+
 from langchain.load.serializable import Serializable
 
 
 class DBOrigin(Serializable):
-    """Class for storing a db_type and db_path: dict"""
+    """Class for storing a db_type and db_path: dict. It is hashable, so it can be used as a dict key."""
     db_type: str
     db_path: dict
 
@@ -11,3 +13,11 @@ class DBOrigin(Serializable):
             "db_type": self.db_type,
             "db_path": self.db_path
         }
+
+    def __eq__(self, other):
+        if not isinstance(other, DBOrigin):
+            return False
+        return self.db_type == other.db_type and self.db_path == other.db_path
+
+    def __hash__(self):
+        return hash((self.db_type, json.dumps(self.db_path, sort_keys=True, default=str)))
@@ -0,0 +1,13 @@
+from typing import Any
+
+from pydantic import BaseModel
+
+
+class StreamEvent(BaseModel):
+    """class for storing each event of a streaming pipeline run"""
+    stage: str
+    """stage of the pipeline. 'retrieval', 'rerank', 'answer' (an answer token) or 'end' (the full answer)"""
+    data: Any
+    """RetrievalResult at retrieval and rerank, str at answer and end"""
+    elapsed: float
+    """seconds from the start of the run to this event"""
@@ -0,0 +1 @@
+from .index import BM25Index, BM25Segment
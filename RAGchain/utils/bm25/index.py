@@ -0,0 +1,929 @@
+import os
+import shutil
+from collections import Counter
+from typing import List, Union, Sequence, Optional, Set, Iterator
+from uuid import UUID, uuid4
+
+import numpy as np
+
+from RAGchain.utils.bm25.storage import PassageIdArray, SEGMENT_ARRAYS, save_arrays, load_array, read_manifest, \
+    write_manifest, remove_versions
+
+
+class BM25Segment:
+    """
+    Immutable block of postings for a batch of passages, stored in CSR layout.
+    Postings of term `terms[i]` are `doc_ids[offsets[i]:offsets[i + 1]]` with term frequencies
+    `term_freqs[offsets[i]:offsets[i + 1]]`. doc_ids are local row numbers inside the segment.
+    A segment can be saved to its own directory as .npy files, and loaded with memory-mapping.
+    Postings are never modified after creation. Deleted rows are marked at a tombstone bitmap (`deleted`),
+    and they are removed when the segment is rewritten by compaction.
+    """
+
+    def __init__(self, passage_ids: Union[List[Union[str, UUID]], PassageIdArray],
+                 terms: np.ndarray,
+                 offsets: np.ndarray,
+                 doc_ids: np.ndarray,
+                 term_freqs: np.ndarray,
+                 doc_lens: np.ndarray,
+                 term_bounds: Optional[tuple[np.ndarray, np.ndarray]] = None,
+                 name: Optional[str] = None,
+                 deleted: Optional[np.ndarray] = None,
+                 deleted_file: Optional[str] = None):
+        assert len(passage_ids) == len(doc_lens)
+        assert len(offsets) == len(terms) + 1
+        self.passage_ids = passage_ids
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lens = doc_lens
+        self._term_bounds = term_bounds
+        self.name = name
+        """directory name of the segment at the index directory. None if the segment is not saved yet."""
+        self.deleted = np.zeros(len(doc_lens), dtype=bool) if deleted is None else deleted
+        self.num_deleted = int(self.deleted.sum())
+        self.deleted_dirty = False
+        """True if tombstones are changed after the segment is saved."""
+        self.deleted_file = deleted_file
+        """name of the saved tombstone file at the segment directory. None if tombstones are not saved yet."""
+
+    def __len__(self):
+        return len(self.doc_lens)
+
+    @property
+    def num_live(self) -> int:
+        return len(self) - self.num_deleted
+
+    @property
+    def deleted_ratio(self) -> float:
+        return self.num_deleted / len(self) if len(self) > 0 else 0.0
+
+    def delete_row(self, row: int):
+        """
+        Mark the row as deleted at the tombstone bitmap.
+        """
+        if not self.deleted[row]:
+            self.deleted[row] = True
+            self.num_deleted += 1
+            self.deleted_dirty = True
+
+    def live_rows(self) -> np.ndarray:
+        return np.flatnonzero(~self.deleted)
+
+    def str_ids(self) -> List[str]:
+        """
+        Get passage ids as str. This is faster than converting each id of PassageIdArray.
+        """
+        if isinstance(self.passage_ids, PassageIdArray):
+            return self.passage_ids.str_ids.tolist()
+        return [str(_id) for _id in self.passage_ids]
+
+    @classmethod
+    def from_tokens(cls, passage_ids: List[Union[str, UUID]], tokens: List[Sequence[int]]) -> 'BM25Segment':
+        """
+        Build a segment from tokenized passages.
+        :param passage_ids: passage ids of each tokenized passage.
+        :param tokens: 2d list of token ids. Same length with passage_ids.
+        """
+        assert len(passage_ids) == len(tokens), "passage_ids and tokens must have the same length"
+        doc_lens = np.fromiter((len(token) for token in tokens), dtype=np.int32, count=len(tokens))
+        if doc_lens.sum() == 0:
+            return cls(list(passage_ids), np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64),
+                       np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), doc_lens)
+        flat_tokens = np.concatenate([np.asarray(token, dtype=np.int64) for token in tokens])
+        flat_docs = np.repeat(np.arange(len(tokens), dtype=np.int64), doc_lens)
+        # (term, doc) pairs sorted by term first, then doc.
+        keys, term_freqs = np.unique(flat_tokens * len(tokens) + flat_docs, return_counts=True)
+        posting_terms = keys // len(tokens)
+        doc_ids = (keys % len(tokens)).astype(np.int32)
+        return cls.from_postings(list(passage_ids), posting_terms, doc_ids, term_freqs.astype(np.int32), doc_lens)
+
+    @classmethod
+    def from_postings(cls, passage_ids: List[Union[str, UUID]],
+                      posting_terms: np.ndarray,
+                      doc_ids: np.ndarray,
+                      term_freqs: np.ndarray,
+                      doc_lens: np.ndarray) -> 'BM25Segment':
+        """
+        Build a segment from flat postings, which must be sorted by term and doc id.
+        """
+        terms, starts = np.unique(posting_terms, return_index=True)
+        offsets = np.append(starts, len(posting_terms)).astype(np.int64)
+        return cls(passage_ids, terms.astype(np.int64), offsets, doc_ids, term_freqs, doc_lens)
+
+    def term_index(self, term: int) -> int:
+        """
+        Get the position of the term at self.terms. Returns -1 when the term is not in the segment.
+        """
+        idx = int(np.searchsorted(self.terms, term))
+        if idx >= len(self.terms) or self.terms[idx] != term:
+            return -1
+        return idx
+
+    def postings(self, term: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get doc ids and term frequencies of the term. Returns empty arrays when the term is not in the segment.
+        """
+        idx = self.term_index(term)
+        if idx < 0:
+            return self.doc_ids[:0], self.term_freqs[:0]
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.doc_ids[start:end], self.term_freqs[start:end]
+
+    def term_bounds(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get max term frequency and min doc length of each term's postings.
+        Those are used for upper bounds of term scores at top-k pruning.
+        """
+        if self._term_bounds is None:
+            if len(self.terms) == 0:
+                self._term_bounds = (self.term_freqs[:0], self.doc_lens[:0])
+            else:
+                starts = self.offsets[:-1]
+                self._term_bounds = (np.maximum.reduceat(self.term_freqs, starts),
+                                     np.minimum.reduceat(self.doc_lens[self.doc_ids], starts))
+        return self._term_bounds
+
+    def document_frequencies(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def select(self, rows: np.ndarray) -> 'BM25Segment':
+        """
+        Make a new segment which only contains given rows. Rows are renumbered in the given order.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        remap = np.full(len(self), -1, dtype=np.int64)
+        remap[rows] = np.arange(len(rows))
+        posting_terms = np.repeat(self.terms, self.document_frequencies())
+        new_doc_ids = remap[self.doc_ids]
+        keep = new_doc_ids >= 0
+        posting_terms, new_doc_ids, term_freqs = posting_terms[keep], new_doc_ids[keep], self.term_freqs[keep]
+        order = np.lexsort((new_doc_ids, posting_terms))
+        return self.from_postings([self.passage_ids[i] for i in rows],
+                                  posting_terms[order], new_doc_ids[order].astype(np.int32),
+                                  term_freqs[order], self.doc_lens[rows])
+
+    def save(self, dir_path: str, version: int = 0):
+        """
+        Save the segment to dir_path as .npy files.
+        :param version: version of the tombstone file. Use the generation of the index.
+        """
+        max_term_freqs, min_doc_lens = self.term_bounds()
+        passage_ids = self.passage_ids if isinstance(self.passage_ids, PassageIdArray) \
+            else PassageIdArray.from_ids(self.passage_ids)
+        save_arrays(dir_path, {
+            "terms": self.terms,
+            "offsets": self.offsets,
+            "doc_ids": self.doc_ids,
+            "term_freqs": self.term_freqs,
+            "doc_lens": self.doc_lens,
+            "max_term_freqs": max_term_freqs,
+            "min_doc_lens": min_doc_lens,
+            "passage_ids": passage_ids.str_ids,
+            "uuid_mask": passage_ids.uuid_mask,
+        })
+        self.save_deleted(dir_path, version)
+
+    def save_deleted(self, dir_path: str, version: int = 0):
+        """
+        Save the tombstone bitmap to dir_path as packed bits, at a new file of the version (`deleted.<version>.npy`).
+        The file of the previous version is kept, because the manifest still names it until it is replaced.
+        """
+        self.deleted_file = f"deleted.{version}"
+        save_arrays(dir_path, {self.deleted_file: np.packbits(self.deleted)})
+        self.deleted_dirty = False
+
+    @classmethod
+    def load(cls, dir_path: str, mmap: bool = True, deleted_file: Optional[str] = "deleted") -> 'BM25Segment':
+        """
+        Load the segment from dir_path. With mmap, arrays are memory-mapped read-only instead of read to memory.
+        :param deleted_file: name of the tombstone file, which is written at the manifest.
+        Default is 'deleted', the file name of previous versions.
+        """
+        arrays = {name: load_array(dir_path, name, mmap) for name in SEGMENT_ARRAYS}
+        passage_ids = PassageIdArray(load_array(dir_path, "passage_ids", mmap),
+                                     load_array(dir_path, "uuid_mask", mmap))
+        deleted = None
+        if deleted_file is not None and os.path.exists(os.path.join(dir_path, f"{deleted_file}.npy")):
+            deleted = np.unpackbits(load_array(dir_path, deleted_file, mmap=False),
+                                    count=len(arrays["doc_lens"])).astype(bool)
+        else:
+            deleted_file = None
+        return cls(passage_ids, arrays["terms"], arrays["offsets"], arrays["doc_ids"], arrays["term_freqs"],
+                   arrays["doc_lens"], term_bounds=(arrays["max_term_freqs"], arrays["min_doc_lens"]),
+                   name=os.path.basename(os.path.normpath(dir_path)), deleted=deleted, deleted_file=deleted_file)
+
+    @classmethod
+    def merge(cls, segments: List['BM25Segment']) -> 'BM25Segment':
+        """
+        Merge segments to one segment. Rows of the new segment follow the order of given segments.
+        Deleted rows are dropped.
+        """
+        segments = [segment.select(segment.live_rows()) if segment.num_deleted > 0 else segment
+                    for segment in segments]
+        passage_ids, posting_terms, doc_ids, term_freqs = [], [], [], []
+        base = 0
+        for segment in segments:
+            passage_ids.extend(segment.passage_ids)
+            posting_terms.append(np.repeat(segment.terms, segment.document_frequencies()))
+            doc_ids.append(segment.doc_ids.astype(np.int64) + base)
+            term_freqs.append(segment.term_freqs)
+            base += len(segment)
+        posting_terms = np.concatenate(posting_terms)
+        doc_ids = np.concatenate(doc_ids)
+        term_freqs = np.concatenate(term_freqs)
+        order = np.lexsort((doc_ids, posting_terms))
+        return cls.from_postings(passage_ids, posting_terms[order], doc_ids[order].astype(np.int32),
+                                 term_freqs[order], np.concatenate([segment.doc_lens for segment in segments]))
+
+
+class BM25Snapshot:
+    """
+    Segments of BM25Index with the statistics made from them. A snapshot is never modified after creation,
+    and the index publishes a new snapshot whenever segments change, so a search that reads the snapshot once
+    never combines segments with statistics of other segments. Only tombstones of segments are changed in place.
+    """
+
+    def __init__(self, segments: tuple, doc_freqs: np.ndarray, num_docs: int, total_len: int, epsilon: float):
+        self.segments = segments
+        self.doc_freqs = doc_freqs
+        self.num_docs = num_docs
+        """number of passages in segments, including deleted passages that are not compacted yet."""
+        self.total_len = total_len
+        self.idf = self._idf(doc_freqs, num_docs, epsilon)
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_len / self.num_docs if self.num_docs > 0 else 0.0
+
+    @staticmethod
+    def _idf(doc_freqs: np.ndarray, num_docs: int, epsilon: float) -> np.ndarray:
+        """
+        Compute idf of all terms, following rank_bm25.BM25Okapi.
+        Negative idf values are replaced with epsilon * average idf.
+        """
+        exist = doc_freqs > 0
+        idf = np.zeros(len(doc_freqs), dtype=np.float64)
+        if exist.any():
+            df = doc_freqs[exist]
+            exist_idf = np.log(num_docs - df + 0.5) - np.log(df + 0.5)
+            eps = epsilon * exist_idf.mean()
+            exist_idf[exist_idf < 0] = eps
+            idf[exist] = exist_idf
+        return idf
+
+
+class BM25Index:
+    """
+    Inverted index for BM25 (Okapi) scoring.
+    Passages are stored in segments of postings lists, and document frequency, IDF and document length
+    statistics are kept up to date when passages are added, so a query only touches the postings of its own terms.
+    Scores are the same as rank_bm25.BM25Okapi, except that passages which share no term with the query are not
+    returned.
+
+    The index can be saved to a directory, which looks like this:
+        manifest.json # BM25 parameters, statistics, the list of segment directories and the doc_freqs file
+        doc_freqs.<generation>.npy # document frequency of each term
+        segment_000000/ # terms, offsets, doc_ids, term_freqs, doc_lens, deleted.<generation> ... as .npy files
+        segment_000001/
+    Saving only writes segments that are not saved yet, and loading memory-maps the segments.
+    Files are never rewritten in place: changed arrays are written to new files, and the manifest is replaced
+    last, so other processes always load files that match their manifest.
+
+    Deletion only marks tombstones of the passages, which is O(1) per passage with an id to row hash map.
+    Like Lucene, deleted passages are excluded from results right away, but document frequencies and
+    average document length still count them until their segment is compacted.
+
+    Segments and statistics are published together as a BM25Snapshot, and each search reads one snapshot,
+    so searches can run while passages are added or compaction is applied. Changes of the index itself
+    (add, delete, compaction and save) must not run concurrently with each other.
+
+    The index has a random uid and a generation, which increases whenever scores can change (add, delete and
+    compaction). Both are saved with the index, so caches can tell the index and its version across processes.
+    """
+
+    LOAD_RETRIES = 3
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25, max_segments: int = 8):
+        """
+        :param k1: k1 parameter of BM25. Default is 1.5.
+        :param b: b parameter of BM25. Default is 0.75.
+        :param epsilon: floor of negative idf values, as a ratio of the average idf. Default is 0.25.
+        :param max_segments: When the number of segments exceeds this value, the two smallest segments are merged.
+        So each passage is merged O(log N) times when many batches are added. Default is 8.
+        """
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.max_segments = max_segments
+        self._snapshot = BM25Snapshot((), np.zeros(0, dtype=np.int64), 0, 0, epsilon)
+        self.uid = uuid4().hex
+        self.generation = 0
+        self._id_lookup: Optional[dict[str, tuple[BM25Segment, int]]] = None
+
+    def __len__(self):
+        return sum(segment.num_live for segment in self._snapshot.segments)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_id_lookup'] = None
+        return state
+
+    def __setstate__(self, state):
+        # indexes pickled by previous versions don't have uid and generation
+        state.setdefault('uid', uuid4().hex)
+        state.setdefault('generation', 0)
+        if '_snapshot' not in state:
+            # indexes pickled by previous versions keep segments and statistics as attributes
+            state['_snapshot'] = BM25Snapshot(tuple(state.pop('segments')), state.pop('doc_freqs'),
+                                              state.pop('num_docs'), state.pop('total_len'), state['epsilon'])
+            state.pop('idf', None)
+        self.__dict__.update(state)
+
+    @property
+    def snapshot(self) -> BM25Snapshot:
+        """Current segments and statistics."""
+        return self._snapshot
+
+    @property
+    def segments(self) -> tuple:
+        return self._snapshot.segments
+
+    @property
+    def doc_freqs(self) -> np.ndarray:
+        return self._snapshot.doc_freqs
+
+    @property
+    def idf(self) -> np.ndarray:
+        return self._snapshot.idf
+
+    @property
+    def num_docs(self) -> int:
+        return self._snapshot.num_docs
+
+    @property
+    def total_len(self) -> int:
+        return self._snapshot.total_len
+
+    @property
+    def avgdl(self) -> float:
+        return self._snapshot.avgdl
+
+    def add(self, passage_ids: List[Union[str, UUID]], tokens: List[Sequence[int]]):
+        """
+        Add tokenized passages to the index.
+        :param passage_ids: passage ids of each tokenized passage.
+        :param tokens: 2d list of token ids. Same length with passage_ids.
+        """
+        if len(passage_ids) == 0:
+            return
+        segment = BM25Segment.from_tokens(passage_ids, tokens)
+        self._add_segment(segment)
+        self.generation += 1
+        if self._id_lookup is not None:
+            self._register_ids(segment)
+        if len(self.segments) > self.max_segments:
+            self._merge_smallest_segments()
+
+    def _merge_smallest_segments(self):
+        segments = list(self.segments)
+        first, second = sorted(np.argsort([segment.num_live for segment in segments], kind='stable')[:2])
+        merged = BM25Segment.merge([segments[first], segments[second]])
+        segments[first] = merged
+        segments.pop(second)
+        self._rebuild_stats(segments)
+        if self._id_lookup is not None:
+            self._register_ids(merged)
+
+    def save(self, dir_path: str):
+        """
+        Save the index to dir_path. Segments which are already saved at dir_path are not rewritten,
+        and segment directories which are no longer used (ex. merged segments) are removed.
+        """
+        os.makedirs(dir_path, exist_ok=True)
+        snapshot = self._snapshot
+        manifest = read_manifest(dir_path)
+        next_segment = manifest["next_segment"] if manifest is not None else 0
+        for segment in snapshot.segments:
+            if segment.name is not None and os.path.isdir(os.path.join(dir_path, segment.name)):
+                if segment.deleted_dirty:
+                    segment.save_deleted(os.path.join(dir_path, segment.name), self.generation)
+                continue
+            segment.name = f"segment_{next_segment:06d}"
+            next_segment += 1
+            segment.save(os.path.join(dir_path, segment.name), self.generation)
+        doc_freqs_name = f"doc_freqs.{self.generation}"
+        save_arrays(dir_path, {doc_freqs_name: snapshot.doc_freqs})
+        segment_names = [segment.name for segment in snapshot.segments]
+        write_manifest(dir_path, {
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "max_segments": self.max_segments,
+            "num_docs": snapshot.num_docs,
+            "total_len": snapshot.total_len,
+            "next_segment": next_segment,
+            "segments": segment_names,
+            "uid": self.uid,
+            "generation": self.generation,
+            "doc_freqs": doc_freqs_name,
+            "deleted": {segment.name: segment.deleted_file for segment in snapshot.segments},
+        })
+        for name in os.listdir(dir_path):
+            if name.startswith("segment_") and name not in segment_names:
+                shutil.rmtree(os.path.join(dir_path, name))
+        remove_versions(dir_path, "doc_freqs", keep=doc_freqs_name)
+        for segment in snapshot.segments:
+            remove_versions(os.path.join(dir_path, segment.name), "deleted", keep=segment.deleted_file)
+
+    @classmethod
+    def load(cls, dir_path: str, mmap: bool = True) -> 'BM25Index':
+        """
+        Load the index from dir_path. Returns an empty index when there is no saved index at dir_path.
+        :param mmap: If True, segments are memory-mapped read-only. Default is True.
+        """
+        for _ in range(cls.LOAD_RETRIES - 1):
+            try:
+                return cls._load(dir_path, mmap)
+            except FileNotFoundError:
+                # files of the manifest are removed by a newer save of another process, so read the new manifest
+                continue
+        return cls._load(dir_path, mmap)
+
+    @classmethod
+    def _load(cls, dir_path: str, mmap: bool) -> 'BM25Index':
+        manifest = read_manifest(dir_path)
+        if manifest is None:
+            return cls()
+        index = cls(k1=manifest["k1"], b=manifest["b"], epsilon=manifest["epsilon"],
+                    max_segments=manifest["max_segments"])
+        deleted_files = manifest.get("deleted", {})
+        segments = tuple(BM25Segment.load(os.path.join(dir_path, name), mmap, deleted_files.get(name, "deleted"))
+                         for name in manifest["segments"])
+        doc_freqs = np.array(load_array(dir_path, manifest.get("doc_freqs", "doc_freqs"), mmap=False),
+                             dtype=np.int64)
+        index._snapshot = BM25Snapshot(segments, doc_freqs, manifest["num_docs"], manifest["total_len"],
+                                       index.epsilon)
+        index.uid = manifest.get("uid", index.uid)
+        index.generation = manifest.get("generation", 0)
+        return index
+
+    def delete(self, passage_ids: List[Union[str, UUID]]) -> List[Union[str, UUID]]:
+        """
+        Mark passages as deleted. Passage ids are compared as str.
+        :return: passage ids which are not in the index.
+        """
+        id_lookup = self._get_id_lookup()
+        not_exist_ids = []
+        for _id in passage_ids:
+            location = id_lookup.pop(str(_id), None)
+            if location is None:
+                not_exist_ids.append(_id)
+                continue
+            segment, row = location
+            segment.delete_row(row)
+        if len(not_exist_ids) < len(passage_ids):
+            self.generation += 1
+        return not_exist_ids
+
+    @property
+    def deleted_ratio(self) -> float:
+        return 1 - len(self) / self.num_docs if self.num_docs > 0 else 0.0
+
+    def needs_compaction(self, min_deleted_ratio: float) -> bool:
+        return any(segment.num_deleted > 0 and segment.deleted_ratio >= min_deleted_ratio
+                   for segment in self.segments)
+
+    def compact(self, min_deleted_ratio: float = 0.0):
+        """
+        Rewrite segments without deleted passages, and update statistics.
+        :param min_deleted_ratio: Only segments whose deleted ratio is at least this value are rewritten.
+        Default is 0.0, which rewrites every segment that has deleted passages.
+        """
+        self.apply_compaction(self.prepare_compaction(min_deleted_ratio))
+
+    def prepare_compaction(self, min_deleted_ratio: float = 0.0) -> List[
+        tuple[BM25Segment, np.ndarray, Optional[BM25Segment]]]:
+        """
+        Build compacted segments without changing the index. This is the heavy part of compaction,
+        so you can run it at a background thread while the index is searched.
+        :return: list of (old segment, tombstone snapshot, compacted segment) to pass to apply_compaction.
+        Compacted segment is None when all passages of the segment are deleted.
+        """
+        result = []
+        for segment in list(self.segments):
+            if segment.num_deleted == 0 or segment.deleted_ratio < min_deleted_ratio:
+                continue
+            snapshot = segment.deleted.copy()
+            live_rows = np.flatnonzero(~snapshot)
+            result.append((segment, snapshot, segment.select(live_rows) if len(live_rows) > 0 else None))
+        return result
+
+    def apply_compaction(self, plan: List[tuple[BM25Segment, np.ndarray, Optional[BM25Segment]]]):
+        """
+        Replace old segments with compacted segments made by prepare_compaction.
+        Passages deleted after prepare_compaction are deleted at compacted segments, too.
+        """
+        segments = list(self.segments)
+        for old_segment, snapshot, new_segment in plan:
+            if not any(segment is old_segment for segment in segments):
+                # the segment is already merged or compacted
+                continue
+            position = next(i for i, segment in enumerate(segments) if segment is old_segment)
+            if new_segment is None:
+                segments.pop(position)
+                continue
+            live_rows = np.flatnonzero(~snapshot)
+            for row in np.flatnonzero(old_segment.deleted & ~snapshot):
+                new_segment.delete_row(int(np.searchsorted(live_rows, row)))
+            segments[position] = new_segment
+            if self._id_lookup is not None:
+                self._register_ids(new_segment)
+        self._rebuild_stats(segments)
+        # document frequencies don't count deleted passages anymore, so scores change
+        self.generation += 1
+
+    def live_ids(self) -> List[Union[str, UUID]]:
+        """
+        Get passage ids of every passage which is not deleted.
+        """
+        return [segment.passage_ids[row] for segment in self._snapshot.segments for row in segment.live_rows()]
+
+    def get_scores(self, query_tokens: Sequence[int],
+                   allowed_ids: Optional[Set[str]] = None) -> tuple[List[Union[str, UUID]], np.ndarray]:
+        """
+        Score passages which contain at least one query token.
+        :param query_tokens: token ids of the query.
+        :param allowed_ids: If given, only passages of these str ids are scored.
+        Segments without allowed passages are skipped. Default is None, which scores every passage.
+        :return: passage ids and its BM25 scores. The order is not sorted.
+        """
+        snapshot = self._snapshot
+        scored = self._scored_rows(snapshot, query_tokens, allowed_ids=allowed_ids)
+        return self._passage_ids(snapshot, scored, np.arange(len(scored[2]))), scored[2]
+
+    def top_k(self, query_tokens: Sequence[int], top_k: int,
+              method: str = 'exhaustive') -> tuple[List[Union[str, UUID]], List[float]]:
+        """
+        Get top_k passage ids and scores, sorted by score in descending order.
+        """
+        ids, scores, _ = self.search(query_tokens, top_k, method=method)
+        return ids, scores
+
+    def search(self, query_tokens: Sequence[int], top_k: int,
+               method: str = 'exhaustive',
+               allowed_ids: Optional[Set[str]] = None) -> tuple[List[Union[str, UUID]], List[float], int]:
+        """
+        Get top_k passage ids and scores, sorted by score in descending order.
+        :param query_tokens: token ids of the query.
+        :param top_k: passages count to retrieve.
+        :param method: 'exhaustive' scores every passage that contains a query token.
+        'maxscore' uses MaxScore dynamic pruning, which only fully scores passages that can enter the top_k.
+        Both methods return the same scores. Default is 'exhaustive'.
+        :param allowed_ids: If given, only passages of these str ids can be returned.
+        They are filtered before top_k selection, with 'exhaustive' method. Default is None.
+        :return: passage ids, scores and the number of passages scored for this query.
+        """
+        if method not in ['exhaustive', 'maxscore']:
+            raise ValueError("method should be either 'exhaustive' or 'maxscore'")
+        snapshot = self._snapshot
+        if allowed_ids is not None or method == 'exhaustive':
+            scored = self._scored_rows(snapshot, query_tokens, allowed_ids=allowed_ids)
+            docs_scored = len(scored[2])
+        else:
+            scored, docs_scored = self._maxscore(snapshot, query_tokens, top_k)
+        # passage ids are made only for the top_k rows
+        order = self._top_k_order(scored[2], top_k)
+        return self._passage_ids(snapshot, scored, order), scored[2][order].tolist(), docs_scored
+
+    def iter_search(self, query_tokens: Sequence[int], page_size: int = 10,
+                    allowed_ids: Optional[Set[str]] = None) -> Iterator[tuple[Union[str, UUID], float]]:
+        """
+        Cursor of passage ids and scores, sorted by score in descending order.
+        Passages are scored once at the first page, and each next page only selects the best remaining scores,
+        so paging doesn't score the postings again.
+        :param query_tokens: token ids of the query.
+        :param page_size: passages count to select at once.
+        :param allowed_ids: If given, only passages of these str ids are yielded. Default is None.
+        """
+        snapshot = self._snapshot
+        scored = self._scored_rows(snapshot, query_tokens, allowed_ids=allowed_ids)
+        scores = scored[2]
+        remaining = np.arange(len(scores))
+        while len(remaining) > 0:
+            page = remaining[self._top_k_order(scores[remaining], max(page_size, 1))]
+            yield from zip(self._passage_ids(snapshot, scored, page), scores[page].tolist())
+            remaining = np.setdiff1d(remaining, page, assume_unique=True)
+
+    def search_batch(self, queries_tokens: List[Sequence[int]], top_k: int,
+                     method: str = 'exhaustive') -> tuple[List[List[Union[str, UUID]]], List[List[float]], List[int]]:
+        """
+        Get top_k passage ids and scores for several queries at once.
+        With 'exhaustive' method, postings and term frequency weights of each distinct query term are
+        read once per segment and shared by every query that contains the term,
+        and only the top_k passage ids per segment are materialized.
+        'maxscore' prunes per query, so it runs search for each query.
+        :param queries_tokens: token ids of each query.
+        :param top_k: passages count to retrieve for each query.
+        :param method: 'exhaustive' or 'maxscore'. Both methods return the same scores.
+        :return: passage ids and scores of each query, sorted by score in descending order,
+        and the number of passages scored for each query.
+        """
+        if method == 'maxscore':
+            results = [self.search(query_tokens, top_k, method=method) for query_tokens in queries_tokens]
+            return [ids for ids, _, _ in results], [scores for _, scores, _ in results], \
+                [docs_scored for _, _, docs_scored in results]
+        if method != 'exhaustive':
+            raise ValueError("method should be either 'exhaustive' or 'maxscore'")
+        snapshot = self._snapshot
+        queries_weights = [self._term_weights(snapshot, query_tokens) for query_tokens in queries_tokens]
+        terms = sorted({term for term_weights in queries_weights for term, _ in term_weights})
+        candidates = [[] for _ in queries_tokens]
+        docs_scored = [0 for _ in queries_tokens]
+        for segment in snapshot.segments:
+            term_postings = {}
+            for term in terms:
+                term_doc_ids, term_freqs = segment.postings(term)
+                if len(term_doc_ids) > 0:
+                    term_postings[term] = (term_doc_ids,
+                                           self._tf_weight(term_freqs, segment.doc_lens[term_doc_ids],
+                                                           snapshot.avgdl))
+            for i, (query_candidates, term_weights) in enumerate(zip(candidates, queries_weights)):
+                postings = [(weight, term_postings[term]) for term, weight in term_weights if term in term_postings]
+                if len(postings) == 0:
+                    continue
+                doc_ids = np.concatenate([term_doc_ids for _, (term_doc_ids, _) in postings])
+                contributions = np.concatenate([weight * tf_weights for weight, (_, tf_weights) in postings])
+                rows, scores = self._accumulate(segment, doc_ids, contributions)
+                docs_scored[i] += len(rows)
+                order = self._top_k_order(scores, top_k)
+                query_candidates.append((segment, rows[order], scores[order]))
+
+        ids_result, scores_result = [], []
+        for query_candidates in candidates:
+            if len(query_candidates) == 0:
+                ids_result.append([])
+                scores_result.append([])
+                continue
+            passages = [(segment, row) for segment, rows, _ in query_candidates for row in rows]
+            scores = np.concatenate([segment_scores for _, _, segment_scores in query_candidates])
+            order = self._top_k_order(scores, top_k)
+            ids_result.append([passages[i][0].passage_ids[passages[i][1]] for i in order])
+            scores_result.append(scores[order].tolist())
+        return ids_result, scores_result, docs_scored
+
+    def _scored_rows(self, snapshot: BM25Snapshot, query_tokens: Sequence[int],
+                     allowed_ids: Optional[Set[str]] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Score passages which contain at least one query token, without making their passage ids.
+        :return: segment positions at the snapshot, rows in the segments, and scores of the scored passages.
+        """
+        masks = self._allowed_masks(allowed_ids) if allowed_ids is not None else None
+        results = []
+        for position, segment in enumerate(snapshot.segments):
+            mask = masks.get(id(segment)) if masks is not None else None
+            if masks is not None and mask is None:
+                continue
+            rows, segment_scores = self._score_segment(snapshot, segment, query_tokens, mask=mask)
+            results.append((position, rows, segment_scores))
+        return self._concat_scored(results)
+
+    @staticmethod
+    def _concat_scored(results: List[tuple[int, np.ndarray, np.ndarray]]) -> tuple[
+        np.ndarray, np.ndarray, np.ndarray]:
+        if len(results) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        return (np.concatenate([np.full(len(rows), position, dtype=np.int64) for position, rows, _ in results]),
+                np.concatenate([rows for _, rows, _ in results]),
+                np.concatenate([scores for _, _, scores in results]))
+
+    @staticmethod
+    def _passage_ids(snapshot: BM25Snapshot, scored: tuple[np.ndarray, np.ndarray, np.ndarray],
+                     indices: np.ndarray) -> List[Union[str, UUID]]:
+        """
+        Make passage ids of the given indices of _scored_rows results.
+        """
+        positions, rows, _ = scored
+        return [snapshot.segments[positions[i]].passage_ids[rows[i]] for i in indices]
+
+    def _allowed_masks(self, allowed_ids: Set[str]) -> dict[int, np.ndarray]:
+        """
+        Make row masks of allowed passages for each segment, keyed by id of the segment.
+        Segments without allowed passages have no mask.
+        """
+        masks = {}
+        id_lookup = self._get_id_lookup()
+        for str_id in allowed_ids:
+            found = id_lookup.get(str_id)
+            if found is None:
+                continue
+            segment, row = found
+            mask = masks.get(id(segment))
+            if mask is None:
+                mask = masks[id(segment)] = np.zeros(len(segment), dtype=bool)
+            mask[row] = True
+        return masks
+
+    @staticmethod
+    def _top_k_order(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """
+        Get indices of the top_k scores in descending order, without sorting all scores.
+        """
+        if top_k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        if top_k < len(scores):
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    @staticmethod
+    def _term_weights(snapshot: BM25Snapshot, query_tokens: Sequence[int]) -> list[tuple[int, float]]:
+        """
+        Get (term, query term count * idf) pairs for query terms in the index.
+        """
+        result = []
+        for term, count in Counter(query_tokens).items():
+            if 0 <= term < len(snapshot.doc_freqs) and snapshot.doc_freqs[term] > 0:
+                result.append((term, count * snapshot.idf[term]))
+        return result
+
+    def _score_segment(self, snapshot: BM25Snapshot, segment: BM25Segment, query_tokens: Sequence[int],
+                       mask: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :param mask: If given, only postings of the rows which are True at the mask are scored.
+        """
+        postings = []
+        for term, weight in self._term_weights(snapshot, query_tokens):
+            term_doc_ids, term_freqs = segment.postings(term)
+            if mask is not None:
+                keep = mask[term_doc_ids]
+                term_doc_ids, term_freqs = term_doc_ids[keep], term_freqs[keep]
+            if len(term_doc_ids) > 0:
+                postings.append((weight, term_doc_ids, term_freqs))
+        return self._score_postings(snapshot, segment, postings)
+
+    def _score_postings(self, snapshot: BM25Snapshot, segment: BM25Segment,
+                        postings: List[tuple[float, np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Score every live doc in the given (weight, doc_ids, term_freqs) postings.
+        :return: sorted rows of the scored docs and their scores.
+        """
+        if len(postings) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        doc_ids = np.concatenate([term_doc_ids for _, term_doc_ids, _ in postings])
+        contributions = np.concatenate([weight * self._tf_weight(term_freqs, segment.doc_lens[term_doc_ids],
+                                                                 snapshot.avgdl)
+                                        for weight, term_doc_ids, term_freqs in postings])
+        return self._accumulate(segment, doc_ids, contributions)
+
+    @staticmethod
+    def _accumulate(segment: BM25Segment, doc_ids: np.ndarray,
+                    contributions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Sum the term contributions per doc and drop deleted docs.
+        :return: sorted rows of the scored docs and their scores.
+        """
+        rows, inverse = np.unique(doc_ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions, minlength=len(rows))
+        if segment.num_deleted > 0:
+            live = ~segment.deleted[rows]
+            rows, scores = rows[live], scores[live]
+        return rows, scores
+
+    def _lookup_postings(self, snapshot: BM25Snapshot, segment: BM25Segment, weight: float, doc_ids: np.ndarray,
+                         term_freqs: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """
+        Score only the given rows with one term's postings. Rows which are not in the postings get 0.
+        """
+        result = np.zeros(len(rows), dtype=np.float64)
+        if len(rows) == 0:
+            return result
+        positions = np.minimum(np.searchsorted(doc_ids, rows), len(doc_ids) - 1)
+        found = doc_ids[positions] == rows
+        result[found] = weight * self._tf_weight(term_freqs[positions[found]], segment.doc_lens[rows[found]],
+                                                 snapshot.avgdl)
+        return result
+
+    def _maxscore(self, snapshot: BM25Snapshot, query_tokens: Sequence[int], top_k: int) -> tuple[
+        tuple[np.ndarray, np.ndarray, np.ndarray], int]:
+        """
+        :return: _scored_rows like results of the candidates, and the number of passages scored.
+        """
+        term_weights = self._term_weights(snapshot, query_tokens)
+        if any(weight < 0 for _, weight in term_weights):
+            # upper bounds are not valid with negative idf, which only happens at tiny corpora.
+            scored = self._scored_rows(snapshot, query_tokens)
+            return scored, len(scored[2])
+        results = []
+        best_scores = np.zeros(0, dtype=np.float64)
+        docs_scored = 0
+        for position, segment in enumerate(snapshot.segments):
+            threshold = best_scores.min() if len(best_scores) >= top_k > 0 else -np.inf
+            rows, segment_scores, segment_docs_scored = self._maxscore_segment(snapshot, segment, term_weights,
+                                                                               top_k, threshold)
+            docs_scored += segment_docs_scored
+            results.append((position, rows, segment_scores))
+            best_scores = np.concatenate([best_scores, segment_scores])
+            best_scores = best_scores[self._top_k_order(best_scores, top_k)]
+        return self._concat_scored(results), docs_scored
+
+    def _maxscore_segment(self, snapshot: BM25Snapshot, segment: BM25Segment, term_weights: List[tuple[int, float]],
+                          top_k: int, threshold: float) -> tuple[np.ndarray, np.ndarray, int]:
+        """
+        MaxScore dynamic pruning at one segment.
+        Terms are sorted by their score upper bound. The longest prefix of terms whose upper bounds sum below the
+        threshold is non-essential: a doc which only contains those terms can't enter the top_k.
+        Only the docs in essential postings become candidates, and non-essential terms are looked up just for
+        candidates which still can reach the threshold.
+        :param threshold: the k-th best score found so far. -inf when fewer than top_k passages are scored yet.
+        """
+        max_term_freqs, min_doc_lens = segment.term_bounds()
+        postings = []  # (upper bound, weight, doc_ids, term_freqs)
+        for term, weight in term_weights:
+            idx = segment.term_index(term)
+            if idx < 0:
+                continue
+            start, end = segment.offsets[idx], segment.offsets[idx + 1]
+            upper_bound = weight * self._tf_weight(max_term_freqs[idx], min_doc_lens[idx], snapshot.avgdl)
+            postings.append((upper_bound, weight, segment.doc_ids[start:end], segment.term_freqs[start:end]))
+        if len(postings) == 0 or top_k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64), 0
+        postings.sort(key=lambda x: x[0])
+
+        if threshold == -np.inf:
+            # Seed the threshold with the best docs of the term with the highest upper bound.
+            _, weight, doc_ids, term_freqs = postings[-1]
+            if segment.num_deleted > 0:
+                live = ~segment.deleted[doc_ids]
+                doc_ids, term_freqs = doc_ids[live], term_freqs[live]
+            contributions = weight * self._tf_weight(term_freqs, segment.doc_lens[doc_ids], snapshot.avgdl)
+            seeds = np.sort(doc_ids[self._top_k_order(contributions, top_k)])
+            if len(seeds) >= top_k:
+                seed_scores = sum(self._lookup_postings(snapshot, segment, weight, doc_ids, term_freqs, seeds)
+                                  for _, weight, doc_ids, term_freqs in postings)
+                threshold = np.partition(seed_scores, len(seed_scores) - top_k)[len(seed_scores) - top_k]
+
+        # Scores are summed in different orders at each phase, so leave a margin for floating point errors.
+        threshold = threshold - 1e-9 * (1.0 + abs(threshold))
+        cumulative_bounds = np.cumsum([upper_bound for upper_bound, _, _, _ in postings])
+        non_essential_count = int(np.searchsorted(cumulative_bounds, threshold, side='left'))
+        if non_essential_count >= len(postings):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64), 0
+        rows, scores = self._score_postings(snapshot, segment, [(weight, doc_ids, term_freqs)
+                                                                for _, weight, doc_ids, term_freqs
+                                                                in postings[non_essential_count:]])
+        docs_scored = len(rows)
+        for i in range(non_essential_count - 1, -1, -1):
+            keep = scores + cumulative_bounds[i] >= threshold
+            rows, scores = rows[keep], scores[keep]
+            _, weight, doc_ids, term_freqs = postings[i]
+            scores = scores + self._lookup_postings(snapshot, segment, weight, doc_ids, term_freqs, rows)
+        keep = scores >= threshold
+        return rows[keep], scores[keep], docs_scored
+
+    def _tf_weight(self, term_freqs: np.ndarray, doc_lens: np.ndarray, avgdl: float) -> np.ndarray:
+        return term_freqs * (self.k1 + 1) / (term_freqs + self.k1 * (1 - self.b + self.b * doc_lens / avgdl))
+
+    def _add_segment(self, segment: BM25Segment):
+        snapshot = self._snapshot
+        # doc_freqs is copied, because searches of the current snapshot still read it
+        self._snapshot = BM25Snapshot(snapshot.segments + (segment,),
+                                      self._add_doc_freqs(snapshot.doc_freqs.copy(), segment),
+                                      snapshot.num_docs + len(segment),
+                                      snapshot.total_len + int(segment.doc_lens.sum()), self.epsilon)
+
+    @staticmethod
+    def _add_doc_freqs(doc_freqs: np.ndarray, segment: BM25Segment) -> np.ndarray:
+        if len(segment.terms) > 0 and segment.terms[-1] >= len(doc_freqs):
+            doc_freqs = np.pad(doc_freqs, (0, int(segment.terms[-1]) + 1 - len(doc_freqs)))
+        doc_freqs[segment.terms] += segment.document_frequencies()
+        return doc_freqs
+
+    def _rebuild_stats(self, segments: List[BM25Segment]):
+        """
+        Recompute statistics from segments, and publish them as a new snapshot with the segments.
+        It only reads terms and offsets of each segment, not the postings.
+        """
+        doc_freqs = np.zeros(len(self.doc_freqs), dtype=np.int64)
+        for segment in segments:
+            doc_freqs = self._add_doc_freqs(doc_freqs, segment)
+        self._snapshot = BM25Snapshot(tuple(segments), doc_freqs, sum(len(segment) for segment in segments),
+                                      sum(int(segment.doc_lens.sum()) for segment in segments), self.epsilon)
+
+    def _get_id_lookup(self) -> dict[str, tuple[BM25Segment, int]]:
+        """
+        Get passage id to (segment, row) hash map of live passages. It is built at the first use.
+        """
+        if self._id_lookup is None:
+            self._id_lookup = {}
+            for segment in self.segments:
+                self._register_ids(segment)
+        return self._id_lookup
+
+    def _register_ids(self, segment: BM25Segment):
+        deleted = segment.deleted
+        for row, str_id in enumerate(segment.str_ids()):
+            if not deleted[row]:
+                self._id_lookup[str_id] = (segment, row)
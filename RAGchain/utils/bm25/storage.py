@@ -0,0 +1,97 @@
+import json
+import os
+from typing import List, Union, Optional
+from uuid import UUID
+
+import numpy as np
+
+MANIFEST_FILE_NAME = "manifest.json"
+SEGMENT_ARRAYS = ["terms", "offsets", "doc_ids", "term_freqs", "doc_lens", "max_term_freqs", "min_doc_lens"]
+
+
+class PassageIdArray:
+    """
+    Read-only sequence of passage ids, stored as a fixed-width unicode array and a mask of UUID ids.
+    Ids are converted to UUID or str only when they are accessed.
+    """
+
+    def __init__(self, str_ids: np.ndarray, uuid_mask: np.ndarray):
+        assert len(str_ids) == len(uuid_mask)
+        self.str_ids = str_ids
+        self.uuid_mask = uuid_mask
+
+    @classmethod
+    def from_ids(cls, ids: List[Union[str, UUID]]) -> 'PassageIdArray':
+        str_ids = np.array([str(_id) for _id in ids], dtype=str) if len(ids) > 0 else np.zeros(0, dtype='<U1')
+        uuid_mask = np.array([isinstance(_id, UUID) for _id in ids], dtype=bool)
+        return cls(str_ids, uuid_mask)
+
+    def __len__(self):
+        return len(self.str_ids)
+
+    def __getitem__(self, item: int) -> Union[str, UUID]:
+        str_id = str(self.str_ids[item])
+        return UUID(str_id) if self.uuid_mask[item] else str_id
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def save_arrays(dir_path: str, arrays: dict):
+    """
+    Save arrays as .npy files. Each file is written to a temporary file and renamed,
+    so readers never memory-map a partially written file.
+    """
+    os.makedirs(dir_path, exist_ok=True)
+    for name, array in arrays.items():
+        path = os.path.join(dir_path, f"{name}.npy")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp_path, path)
+
+
+def remove_versions(dir_path: str, name: str, keep: Optional[str]):
+    """
+    Remove versioned array files of the name (`{name}.{version}.npy`) except the file named keep,
+    and the unversioned file of previous versions.
+    """
+    for file_name in os.listdir(dir_path):
+        if file_name != f"{keep}.npy" and (file_name == f"{name}.npy" or
+                                           (file_name.startswith(f"{name}.") and file_name.endswith(".npy"))):
+            os.remove(os.path.join(dir_path, file_name))
+
+
+def load_array(dir_path: str, name: str, mmap: bool = True) -> np.ndarray:
+    """
+    Load .npy array. When mmap is True, the array is memory-mapped read-only,
+    so the pages are loaded lazily and shared between processes via page cache.
+    """
+    path = os.path.join(dir_path, f"{name}.npy")
+    if mmap:
+        try:
+            return np.load(path, mmap_mode='r')
+        except ValueError:
+            # empty arrays can't be memory-mapped
+            pass
+    return np.load(path)
+
+
+def read_manifest(dir_path: str) -> Optional[dict]:
+    path = os.path.join(dir_path, MANIFEST_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(dir_path: str, manifest: dict):
+    """
+    Write manifest atomically, so readers never see a manifest that points to partially written segments.
+    """
+    path = os.path.join(dir_path, MANIFEST_FILE_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
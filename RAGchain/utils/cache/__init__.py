@@ -0,0 +1,3 @@
+from .base import BaseCache, make_cache_key, normalize_query
+from .memory_cache import InMemoryCache
+from .sqlite_cache import SQLiteCache
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize query for cache keys. Unicode is NFKC normalized, case is folded,
+    and whitespaces are collapsed, so trivially different queries share the same cache entry.
+    """
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', str(query))).strip().casefold()
+
+
+def make_cache_key(*parts: Any) -> str:
+    """
+    Make a cache key from json serializable parts. Dict keys are sorted, so the order of options doesn't matter.
+    """
+    serialized = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+class BaseCache(ABC):
+    """
+    Base class for query result caches.
+    Cache keys are made with make_cache_key, and values are RetrievalResult or answer strings.
+    Each cache counts hits and misses, so you can check them with cache_info.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Get the cached value of the key. Returns default when the key is not cached or expired.
+        """
+        found, value = self._get(key)
+        with self._stats_lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return value if found else default
+
+    @abstractmethod
+    def _get(self, key: str) -> tuple[bool, Any]:
+        """
+        :return: whether the key is found, and the cached value.
+        """
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """
+        Cache the value of the key.
+        :param key: cache key.
+        :param value: value to cache.
+        :param ttl: seconds to keep this entry. Default is None, which uses the ttl of the cache.
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        """Delete every cached entry and reset statistics."""
+        pass
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    def cache_info(self) -> dict:
+        """Returns hits, misses and the number of cached entries."""
+        with self._stats_lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self)}
+
+    def _reset_stats(self):
+        with self._stats_lock:
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from RAGchain.utils.cache.base import BaseCache
+
+
+class InMemoryCache(BaseCache):
+    """
+    In-process LRU cache with expiration.
+    The cache is bounded by max_size with LRU eviction, and each entry expires after ttl seconds.
+    It is thread-safe, so it can be shared by pipelines which run in many threads.
+
+    :example:
+    >>> from RAGchain.utils.cache import InMemoryCache
+    >>> cache = InMemoryCache(max_size=1024, ttl=600)
+    >>> retrieval.result_cache = cache
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = 600.0):
+        """
+        :param max_size: max number of cached entries. The least recently used entry is evicted first.
+        Default is 1024.
+        :param ttl: seconds to keep each entry. None means no expiration. Default is 600.
+        """
+        super().__init__()
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (expire time, value)
+        self._cache: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> tuple[bool, Any]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                del self._cache[key]
+                return False, None
+            self._cache.move_to_end(key)
+            return True, entry[1]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expire = time.monotonic() + ttl if ttl is not None else float('inf')
+        with self._lock:
+            self._cache[key] = (expire, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+        self._reset_stats()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._cache)
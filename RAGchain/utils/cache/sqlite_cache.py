@@ -0,0 +1,94 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from RAGchain.utils.cache.base import BaseCache
+
+
+class SQLiteCache(BaseCache):
+    """
+    On-disk cache with a SQLite file, so cached results survive restarts and can be shared by processes.
+    Values are pickled. The cache is bounded by max_size, evicting the least recently used entry first,
+    and each entry expires after ttl seconds.
+    Results of BM25Retrieval and VectorDBRetrieval with NumpySlim are keyed by the id and generation saved with
+    their index, so they are shared by processes. Other retrievals count their generations in process,
+    so their results are only used by the same retrieval instance.
+
+    :example:
+    >>> from RAGchain.utils.cache import SQLiteCache
+    >>> cache = SQLiteCache('./query_cache.sqlite', max_size=100000, ttl=3600)
+    >>> pipeline = BasicRunPipeline(retrieval, llm, answer_cache=cache)
+    """
+
+    def __init__(self, path: str, max_size: Optional[int] = 100000, ttl: Optional[float] = 3600.0):
+        """
+        :param path: path of the SQLite file. It is created if it does not exist.
+        :param max_size: max number of cached entries. None means unbounded. Default is 100000.
+        :param ttl: seconds to keep each entry. None means no expiration. Default is 3600.
+        """
+        super().__init__()
+        if max_size is not None and max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        dir_name = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dir_name, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS cache ("
+                                     "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                                     "expire REAL, accessed REAL NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+
+    def _get(self, key: str) -> tuple[bool, Any]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT value, expire FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False, None
+            value, expire = row
+            if expire is not None and expire < now:
+                self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return False, None
+            self._connection.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+        return True, pickle.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expire = now + ttl if ttl is not None else None
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO cache (key, value, expire, accessed) "
+                                     "VALUES (?, ?, ?, ?)", (key, data, expire, now))
+            if self.max_size is not None:
+                self._connection.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                                         "ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_size,))
+
+    def delete(self, key: str):
+        with self._lock:
+            self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM cache")
+        self._reset_stats()
+
+    def expire(self):
+        """Delete expired entries from the file."""
+        with self._lock:
+            self._connection.execute("DELETE FROM cache WHERE expire IS NOT NULL AND expire < ?", (time.time(),))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
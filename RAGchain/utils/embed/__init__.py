@@ -1 +1,2 @@
+from .cached_embeddings import CachedEmbeddings
 from .embeddingfactory import EmbeddingFactory, EmbeddingType
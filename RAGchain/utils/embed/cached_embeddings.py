@@ -0,0 +1,154 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Dict
+
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embedding cache in front of any langchain Embeddings.
+    Embeddings are keyed by the model name and the hash of the text, so unchanged passages are not embedded
+    again when you re-ingest them, and identical queries are embedded once.
+    Recently used embeddings are kept in memory, and every embedding is stored at a SQLite file
+    when cache_path is given, so the cache survives restarts and can be shared by processes.
+    You can store vectors as float16 to halve the size of the cache file,
+    but cached vectors are slightly different from the vectors of the model.
+
+    :example:
+    >>> from RAGchain.utils.embed import EmbeddingFactory, CachedEmbeddings
+    >>> embeddings = CachedEmbeddings(EmbeddingFactory('openai').get(), model_name='openai',
+    >>>                               cache_path='./embedding_cache.sqlite')
+    >>> vectordb = ChromaSlim(client=chroma_client, collection_name='my_collection', embedding_function=embeddings)
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: Optional[str] = None,
+                 cache_path: Optional[str] = None, max_memory_size: int = 10000, dtype: str = 'float32'):
+        """
+        :param embeddings: embedding model to wrap.
+        :param model_name: name of the embedding model, which is a part of the cache key.
+        Default is model_name or model attribute of the embeddings, or its class name.
+        Set this when you share cache_path with another model of the same class.
+        :param cache_path: path of the SQLite file to store embeddings. Default is None, which caches in memory only.
+        :param max_memory_size: max number of embeddings in memory. The least recently used one is evicted first.
+        Default is 10000.
+        :param dtype: dtype of stored vectors. Choose between 'float32' and 'float16'. Default is 'float32'.
+        """
+        if dtype not in ['float32', 'float16']:
+            raise ValueError("dtype should be either 'float32' or 'float16'")
+        if max_memory_size <= 0:
+            raise ValueError("max_memory_size must be positive")
+        self.embeddings = embeddings
+        self.model_name = model_name if model_name is not None else self.__default_model_name(embeddings)
+        self.cache_path = cache_path
+        self.max_memory_size = max_memory_size
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        if cache_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            self._connection = sqlite3.connect(cache_path, check_same_thread=False, isolation_level=None)
+            with self._lock:
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                                         "key TEXT PRIMARY KEY, dtype TEXT NOT NULL, vector BLOB NOT NULL)")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts. Only the texts which are not cached are embedded with the wrapped embeddings, at one call.
+        """
+        keys = [self.make_key(text, 'document') for text in texts]
+        vectors = self.__lookup(keys)
+        missing = list({key: text for key, text in zip(keys, texts) if key not in vectors}.items())
+        if len(missing) > 0:
+            embedded = self.embeddings.embed_documents([text for _, text in missing])
+            vectors.update(self.__store([key for key, _ in missing], embedded))
+        return [vectors[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.make_key(text, 'query')
+        vectors = self.__lookup([key])
+        if key not in vectors:
+            vectors.update(self.__store([key], [self.embeddings.embed_query(text)]))
+        return vectors[key].tolist()
+
+    def make_key(self, text: str, kind: str) -> str:
+        """
+        Cache key of the text. Documents and queries are keyed separately,
+        because some models embed queries differently.
+        """
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode('utf-8')).hexdigest()
+
+    def cache_info(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'memory_size': len(self._memory)}
+
+    def clear_memory(self):
+        """Clear in-memory embeddings. Embeddings at cache_path are kept."""
+        with self._lock:
+            self._memory.clear()
+
+    def close(self):
+        if self._connection is not None:
+            with self._lock:
+                self._connection.close()
+                self._connection = None
+
+    def __lookup(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Find cached vectors of keys at memory, and then at the cache file."""
+        vectors = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    vectors[key] = vector
+            disk_keys = list({key for key in keys if key not in vectors})
+            if self._connection is not None and len(disk_keys) > 0:
+                # sqlite limits the number of parameters, so read in chunks
+                for start in range(0, len(disk_keys), 500):
+                    chunk = disk_keys[start:start + 500]
+                    rows = self._connection.execute(
+                        f"SELECT key, dtype, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk).fetchall()
+                    for key, dtype, blob in rows:
+                        vector = np.frombuffer(blob, dtype=dtype).astype(np.float32)
+                        vectors[key] = vector
+                        self.__remember(key, vector)
+            self.hits += sum(1 for key in keys if key in vectors)
+            self.misses += sum(1 for key in keys if key not in vectors)
+        return vectors
+
+    def __store(self, keys: List[str], embedded: List[List[float]]) -> Dict[str, np.ndarray]:
+        """Store embedded vectors at memory and the cache file. Returns vectors as stored precision."""
+        vectors = {key: np.asarray(vector, dtype=self.dtype) for key, vector in zip(keys, embedded)}
+        with self._lock:
+            if self._connection is not None:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, dtype, vector) VALUES (?, ?, ?)",
+                    [(key, self.dtype.name, vector.tobytes()) for key, vector in vectors.items()])
+            vectors = {key: vector.astype(np.float32) for key, vector in vectors.items()}
+            for key, vector in vectors.items():
+                self.__remember(key, vector)
+        return vectors
+
+    def __remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_size:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def __default_model_name(embeddings: Embeddings) -> str:
+        for attribute in ['model_name', 'model']:
+            value = getattr(embeddings, attribute, None)
+            if isinstance(value, str):
+                return value
+        return type(embeddings).__name__
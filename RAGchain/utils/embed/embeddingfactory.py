@@ -1,6 +1,8 @@
 import os
 from enum import Enum
+from typing import Optional
 
+from RAGchain.utils.embed.cached_embeddings import CachedEmbeddings
 from RAGchain.utils.util import text_modifier
 
 
@@ -17,7 +19,8 @@ class EmbeddingFactory:
     EmbeddingFactory is a factory class that returns the embedding class according to the embedding type.
     You can create embedding class easily by using this class.
     """
-    def __init__(self, embed_type: str, device_type: str = 'cuda'):
+    def __init__(self, embed_type: str, device_type: str = 'cuda', cache_path: Optional[str] = None,
+                 cache_dtype: str = 'float32'):
         """
         :param embed_type: Embedding type. You can choose one of the following types.
         - openai: OpenAI GPT-3
@@ -29,6 +32,9 @@ class EmbeddingFactory:
         - cuda: GPU
         - cpu: CPU
         - mps: MPS
+        :param cache_path: path of the SQLite file to cache embeddings. If it is given, get() returns
+        CachedEmbeddings, so the same text is not embedded again. Default is None, which doesn't cache.
+        :param cache_dtype: dtype of cached vectors. Choose between 'float32' and 'float16'. Default is 'float32'.
         """
         if embed_type in text_modifier('openai'):
             self.embed_type = EmbeddingType.OPENAI
@@ -51,11 +57,20 @@ class EmbeddingFactory:
             self.device_type = 'mps'
         else:
             self.device_type = 'cuda'
+        self.cache_path = cache_path
+        self.cache_dtype = cache_dtype
 
     def get(self):
         """
         Returns the embedding class according to the embedding type.
+        It is wrapped with CachedEmbeddings when cache_path is given.
         """
+        embeddings = self.__get_embeddings()
+        if self.cache_path is None:
+            return embeddings
+        return CachedEmbeddings(embeddings, cache_path=self.cache_path, dtype=self.cache_dtype)
+
+    def __get_embeddings(self):
         if self.embed_type == EmbeddingType.OPENAI:
             openai_token = os.getenv("OPENAI_API_KEY")
             if openai_token is None:
@@ -0,0 +1,127 @@
+import concurrent.futures
+import threading
+import time
+from typing import Callable, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class SharedExecutor:
+    """
+    Long-lived thread pool shared by retrieval components, for fanning out work to many DBs or retrievals.
+    Threads are created once and reused, instead of creating a ThreadPoolExecutor for every query.
+    A single task, and tasks submitted from a worker thread of this executor, run in the calling thread.
+    So nested fan-out (like HybridRetrieval of HybridRetrievals) can't deadlock the pool.
+
+    :example:
+    >>> from RAGchain.utils.executor import get_executor, set_executor, SharedExecutor
+    >>> set_executor(SharedExecutor(max_workers=16, max_queue_size=256))
+    >>> get_executor().add_timing_hook(lambda name, seconds: print(name, seconds))
+    >>> results = get_executor().run([lambda: 1, lambda: 2], name='my_tasks')
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, thread_name_prefix: str = 'RAGchain',
+                 max_queue_size: Optional[int] = None):
+        """
+        :param max_workers: max number of worker threads. Default is the default of ThreadPoolExecutor.
+        :param thread_name_prefix: name prefix of worker threads. Default is 'RAGchain'.
+        :param max_queue_size: max number of tasks that are submitted and not finished yet.
+        Submitting more tasks blocks until running tasks finish. Default is None, which is unbounded.
+        """
+        if max_queue_size is not None and max_queue_size <= 0:
+            raise ValueError("max_queue_size must be positive")
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self.max_queue_size = max_queue_size
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix=thread_name_prefix,
+                                                               initializer=self.__mark_worker)
+        self._slots = threading.BoundedSemaphore(max_queue_size) if max_queue_size is not None else None
+        self._timing_hooks: List[Callable[[str, float], None]] = []
+        self._local = threading.local()
+
+    def __mark_worker(self):
+        self._local.is_worker = True
+
+    def in_worker(self) -> bool:
+        """Whether the current thread is a worker thread of this executor."""
+        return getattr(self._local, 'is_worker', False)
+
+    def add_timing_hook(self, hook: Callable[[str, float], None]):
+        """
+        Add a hook that is called with the task name and the elapsed seconds after each task.
+        Hooks are called in the thread that ran the task, so they must be thread-safe.
+        """
+        self._timing_hooks.append(hook)
+
+    def remove_timing_hook(self, hook: Callable[[str, float], None]):
+        self._timing_hooks.remove(hook)
+
+    def submit(self, fn: Callable[[], T], name: str = 'task') -> concurrent.futures.Future:
+        """
+        Submit a task to the pool. It blocks when max_queue_size tasks are not finished yet.
+        """
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            future = self._executor.submit(self.__timed, fn, name)
+        except BaseException:
+            if self._slots is not None:
+                self._slots.release()
+            raise
+        if self._slots is not None:
+            future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, tasks: List[Callable[[], T]], name: str = 'task') -> List[T]:
+        """
+        Run tasks and return their results in the order of tasks.
+        The exception of a task is raised after every task is finished.
+        :param tasks: functions without arguments. Use functools.partial or lambda to pass arguments.
+        :param name: task name that is passed to timing hooks.
+        """
+        if len(tasks) <= 1 or self.in_worker():
+            return [self.__timed(task, name) for task in tasks]
+        futures = [self.submit(task, name) for task in tasks]
+        concurrent.futures.wait(futures)
+        return [future.result() for future in futures]
+
+    def __timed(self, fn: Callable[[], T], name: str) -> T:
+        if len(self._timing_hooks) == 0:
+            return fn()
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in list(self._timing_hooks):
+                hook(name, elapsed)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+_executor: Optional[SharedExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> SharedExecutor:
+    """Returns the process-wide SharedExecutor. It is created with default options at the first call."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = SharedExecutor()
+        return _executor
+
+
+def set_executor(executor: SharedExecutor, wait: bool = True):
+    """
+    Replace the process-wide SharedExecutor. The previous executor is shut down.
+    :param executor: new executor.
+    :param wait: wait for running tasks of the previous executor. Default is True.
+    """
+    global _executor
+    with _executor_lock:
+        previous, _executor = _executor, executor
+    if previous is not None and previous is not executor:
+        previous.shutdown(wait=wait)
@@ -1,6 +1,8 @@
 from .redis_linker import RedisLinker
 from .dynamo_linker import DynamoLinker
 from .json_linker import JsonLinker
+from .cached_linker import CachedLinker
+from .origin_table import DBOriginTable, db_origin_table
 from .base import SingletonCreationError
 from .base import NoIdWarning
 from .base import NoDataWarning
@@ -1,7 +1,10 @@
+import warnings
 from abc import abstractmethod
-from typing import Union, List
+from typing import Union, List, Optional
 from uuid import UUID
 
+from langchain_core.runnables.config import run_in_executor
+
 
 class Singleton(type):
     _instances = {"CHILD_CREATED": False}
@@ -24,6 +27,42 @@ class BaseLinker(metaclass=Singleton):
     def get_json(self, ids: List[Union[UUID, str]]):
         pass
 
+    async def aget_json(self, ids: List[Union[UUID, str]]):
+        """
+        Async version of get_json.
+        Default implementation runs get_json in the default executor. Override this with an async client.
+        """
+        return await run_in_executor(None, self.get_json, ids)
+
+    def get_json_with_status(self, ids: List[Union[UUID, str]]) -> tuple[list, List[Optional[type]]]:
+        """
+        Get json data without raising warnings, with the status of each id.
+        The status is NoIdWarning when the id is not in the linker, NoDataWarning when its data is None,
+        and None when the data is found.
+        Default implementation calls get_json, so its warnings are raised, and every None data is NoIdWarning.
+        Override this when the linker can tell them, and call warn_status at get_json.
+        """
+        json_data_list = self.get_json(ids)
+        return json_data_list, [NoIdWarning if json_data is None else None for json_data in json_data_list]
+
+    async def aget_json_with_status(self, ids: List[Union[UUID, str]]) -> tuple[list, List[Optional[type]]]:
+        """
+        Async version of get_json_with_status.
+        Default implementation runs get_json_with_status in the default executor.
+        """
+        return await run_in_executor(None, self.get_json_with_status, ids)
+
+    @staticmethod
+    def warn_status(ids: List[Union[UUID, str]], statuses: List[Optional[type]]):
+        """
+        Raise NoIdWarning and NoDataWarning of the statuses from get_json_with_status, in the order of ids.
+        """
+        for _id, status in zip(ids, statuses):
+            if status is NoIdWarning:
+                warnings.warn(f"ID {_id} not found in Linker", NoIdWarning)
+            elif status is NoDataWarning:
+                warnings.warn(f"Data {_id} not found in Linker", NoDataWarning)
+
     @abstractmethod
     def flush_db(self):
         pass
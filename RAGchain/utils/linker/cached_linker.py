@@ -0,0 +1,175 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Union, List, Optional
+from uuid import UUID
+
+from RAGchain.utils.linker.base import BaseLinker, Singleton
+
+
+class LinkerWrapper(Singleton):
+    """
+    Metaclass for linkers that wrap another linker.
+    The wrapped linker is the singleton, so the wrapper can be created freely.
+    """
+
+    def __call__(cls, *args, **kwargs):
+        return type.__call__(cls, *args, **kwargs)
+
+
+class CachedLinker(BaseLinker, metaclass=LinkerWrapper):
+    """
+    CachedLinker is a read-through cache in front of any linker.
+    DB origins of passage ids rarely change, so get_json returns cached DB origins in process,
+    and asks the wrapped linker only for the ids which are not cached.
+    Ids which are not found at the linker are cached too (negative caching).
+    They are found with get_json_with_status of the wrapped linker, which doesn't raise warnings,
+    so this linker raises NoIdWarning and NoDataWarning of every id, at cache hit and miss alike.
+    The cache is bounded by max_size with LRU eviction, and each entry expires after ttl seconds.
+    put_json, delete_json and flush_db of this linker invalidate the cache.
+    Changes made by other processes are visible after ttl, so set ttl according to your deployment.
+
+    :example:
+    >>> from RAGchain.utils.linker import CachedLinker, DynamoLinker
+    >>> linker = CachedLinker(DynamoLinker(), max_size=100000, ttl=300)
+    >>> linker.get_json(ids)
+    >>> linker.cache_info()
+    """
+
+    def __init__(self, linker: BaseLinker, max_size: int = 100000, ttl: Optional[float] = 300.0,
+                 negative_ttl: Optional[float] = 60.0):
+        """
+        :param linker: linker to wrap.
+        :param max_size: max number of cached ids. The least recently used id is evicted first. Default is 100000.
+        :param ttl: seconds to keep found DB origins. None means no expiration. Default is 300.
+        :param negative_ttl: seconds to keep ids which are not found. 0 disables negative caching.
+        None means no expiration. Default is 60.
+        """
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.linker = linker
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        # str id -> (expire time, json data, warning category or None)
+        self._cache: OrderedDict[str, tuple[float, Optional[dict], Optional[type]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_json(self, ids: List[Union[UUID, str]]):
+        if len(ids) == 0:
+            return self.linker.get_json(ids)
+        json_data_list, statuses = self.get_json_with_status(ids)
+        self.warn_status(ids, statuses)
+        return json_data_list
+
+    async def aget_json(self, ids: List[Union[UUID, str]]):
+        """
+        Async version of get_json. Cache misses are fetched with aget_json_with_status of the wrapped linker.
+        """
+        if len(ids) == 0:
+            return await self.linker.aget_json(ids)
+        json_data_list, statuses = await self.aget_json_with_status(ids)
+        self.warn_status(ids, statuses)
+        return json_data_list
+
+    def get_json_with_status(self, ids: List[Union[UUID, str]]) -> tuple[list, List[Optional[type]]]:
+        str_ids, entries = self.__lookup(ids)
+        missing_ids = list(dict.fromkeys(_id for _id in str_ids if _id not in entries))
+        if len(missing_ids) > 0:
+            entries.update(self.__store(missing_ids, *self.linker.get_json_with_status(missing_ids)))
+        return [entries[_id][1] for _id in str_ids], [entries[_id][2] for _id in str_ids]
+
+    async def aget_json_with_status(self, ids: List[Union[UUID, str]]) -> tuple[list, List[Optional[type]]]:
+        str_ids, entries = self.__lookup(ids)
+        missing_ids = list(dict.fromkeys(_id for _id in str_ids if _id not in entries))
+        if len(missing_ids) > 0:
+            entries.update(self.__store(missing_ids, *await self.linker.aget_json_with_status(missing_ids)))
+        return [entries[_id][1] for _id in str_ids], [entries[_id][2] for _id in str_ids]
+
+    def __lookup(self, ids: List[Union[UUID, str]]) -> tuple[
+        List[str], dict[str, tuple[float, Optional[dict], Optional[type]]]]:
+        """
+        Find cached entries of ids. Expired entries are removed.
+        :return: str ids, and cached entries of the str ids.
+        """
+        str_ids = [str(find_id) for find_id in ids]
+        now = time.monotonic()
+        entries = {}
+        with self._lock:
+            for _id in str_ids:
+                entry = self._cache.get(_id)
+                if entry is not None and entry[0] < now:
+                    del self._cache[_id]
+                    entry = None
+                if entry is not None:
+                    self._cache.move_to_end(_id)
+                    entries[_id] = entry
+            self.hits += sum(1 for _id in str_ids if _id in entries)
+            self.misses += sum(1 for _id in str_ids if _id not in entries)
+        return str_ids, entries
+
+    def __store(self, str_ids: List[str], json_data_list: list, statuses: List[Optional[type]]) -> dict[
+        str, tuple[float, Optional[dict], Optional[type]]]:
+        """
+        Cache json data and statuses of str ids. Ids which are not found are cached for negative_ttl.
+        """
+        now = time.monotonic()
+        entries = {}
+        with self._lock:
+            for _id, json_data, status in zip(str_ids, json_data_list, statuses):
+                ttl = self.ttl if json_data is not None else self.negative_ttl
+                entries[_id] = (float('inf') if ttl is None else now + ttl, json_data, status)
+                if ttl is None or ttl > 0:
+                    self._cache[_id] = entries[_id]
+                    self._cache.move_to_end(_id)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return entries
+
+    def put_json(self, ids: List[Union[UUID, str]], json_data_list: List[dict]):
+        self.linker.put_json(ids, json_data_list)
+        self.invalidate(ids)
+
+    def delete_json(self, ids: List[Union[UUID, str]]):
+        self.linker.delete_json(ids)
+        self.invalidate(ids)
+
+    def flush_db(self):
+        self.linker.flush_db()
+        self.clear_cache()
+
+    def invalidate(self, ids: List[Union[UUID, str]]):
+        """
+        Remove the given ids from the cache.
+        """
+        with self._lock:
+            for _id in ids:
+                self._cache.pop(str(_id), None)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def cache_info(self) -> dict:
+        """
+        :return: dict of hits, misses, hit_rate, size and max_size of the cache.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+                "size": len(self._cache),
+                "max_size": self.max_size,
+            }
+
+    def __getattr__(self, item):
+        # delegate linker specific methods like connection_check to the wrapped linker
+        if item == 'linker':
+            raise AttributeError(item)
+        return getattr(self.linker, item)
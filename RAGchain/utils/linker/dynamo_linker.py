@@ -1,7 +1,6 @@
 import logging
 import os
-import warnings
-from typing import Union, List
+from typing import Union, List, Optional
 from uuid import UUID
 
 import boto3
@@ -101,6 +100,11 @@ class DynamoLinker(BaseLinker):
         raise
 
     def get_json(self, ids: List[Union[UUID, str]]):
+        results, statuses = self.get_json_with_status(ids)
+        self.warn_status(ids, statuses)
+        return results
+
+    def get_json_with_status(self, ids: List[Union[UUID, str]]) -> tuple[list, List[Optional[type]]]:
         str_ids = [str(find_id) for find_id in ids]
         keys = [{'id': _id} for _id in str_ids]
         response = self.dynamodb.batch_get_item(
@@ -112,16 +116,15 @@ class DynamoLinker(BaseLinker):
         )
         final_response_list = response['Responses'][f'{self.table_name}']
         id_to_result = {result['id']: result for result in final_response_list}
-        results = []
+        results, statuses = [], []
         for _id in str_ids:
             if _id not in id_to_result:
-                warnings.warn(f"ID {_id} not found in Linker", NoIdWarning)
                 results.append(None)
+                statuses.append(NoIdWarning)
             else:
                 results.append(id_to_result[_id]['data'])
-                if id_to_result[_id]['data'] is None:
-                    warnings.warn(f"Data {_id} not found in Linker", NoDataWarning)
-        return results
+                statuses.append(NoDataWarning if id_to_result[_id]['data'] is None else None)
+        return results, statuses
 
     def flush_db(self):
         self.table.delete()
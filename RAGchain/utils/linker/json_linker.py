@@ -1,7 +1,6 @@
 import json
 import os
-import warnings
-from typing import Union, List
+from typing import Union, List, Optional
 from uuid import UUID
 
 from RAGchain.utils.linker.base import BaseLinker, NoIdWarning, NoDataWarning
@@ -50,18 +49,29 @@ class JsonLinker(BaseLinker):
             json.dump(self.data, f)
 
     def get_json(self, ids: List[Union[UUID, str]]):
+        results, statuses = self.get_json_with_status(ids)
+        self.warn_status(ids, statuses)
+        return results
+
+    def get_json_with_status(self, ids: List[Union[UUID, str]]) -> tuple[list, List[Optional[type]]]:
         assert len(ids) > 0, "ids must be a non-empty list"
         str_ids = [str(find_id) for find_id in ids]
-        results = []
+        results, statuses = [], []
         for _id in str_ids:
             if _id not in self.data:
-                warnings.warn(f"ID {_id} not found in Linker", NoIdWarning)
                 results.append(None)
+                statuses.append(NoIdWarning)
             else:
-                if self.data[_id] is None:
-                    warnings.warn(f"Data {_id} not found in Linker", NoDataWarning)
                 results.append(self.data[_id])
-        return results
+                statuses.append(NoDataWarning if self.data[_id] is None else None)
+        return results, statuses
+
+    async def aget_json(self, ids: List[Union[UUID, str]]):
+        # data is in memory, so there is nothing to wait
+        return self.get_json(ids)
+
+    async def aget_json_with_status(self, ids: List[Union[UUID, str]]) -> tuple[list, List[Optional[type]]]:
+        return self.get_json_with_status(ids)
 
     def flush_db(self):
         if os.path.exists(self.json_path):
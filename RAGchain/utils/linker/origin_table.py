@@ -0,0 +1,93 @@
+import hashlib
+import json
+import threading
+import warnings
+from typing import List, Optional, Union
+
+from RAGchain.utils.linker.base import BaseLinker, NoDataWarning
+
+
+class DBOriginTable:
+    """
+    DBOriginTable interns DB origins, so the linker stores a short origin key per passage instead of
+    a full DB origin dict.
+    The origin key is a hash of the DB origin, and the DB origin itself is stored once at the linker
+    with the id ORIGIN_ID_PREFIX + key. So every process gets the same key without coordination.
+    Resolved DB origins are cached in process, because the key never points to another DB origin.
+    Linker values which are already DB origin dicts (saved by previous versions) are used as it is.
+    """
+    ORIGIN_ID_PREFIX = "__db_origin__:"
+    KEY_LENGTH = 16
+
+    def __init__(self):
+        self._origins: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def make_key(cls, db_origin: dict) -> str:
+        serialized = json.dumps(db_origin, sort_keys=True, default=str)
+        return hashlib.sha1(serialized.encode('utf-8')).hexdigest()[:cls.KEY_LENGTH]
+
+    def register(self, db_origin: dict) -> tuple[str, str]:
+        """
+        Register DB origin to the in-process table.
+        You have to put the returned linker id and the DB origin to the linker,
+        which is done at the same put_json call with the passage ids at DB save.
+        :return: linker id of the DB origin, and the origin key to store as the value of each passage id.
+        """
+        key = self.make_key(db_origin)
+        with self._lock:
+            self._origins[key] = db_origin
+        return self.ORIGIN_ID_PREFIX + key, key
+
+    def resolve(self, linker: BaseLinker, values: List[Optional[Union[str, dict]]]) -> List[Optional[dict]]:
+        """
+        Resolve linker values to DB origin dicts. Unknown origin keys are fetched from the linker at once,
+        with get_json_with_status, so the linker doesn't warn about them.
+        The same DB origin dict object is returned for the same origin key.
+        :param linker: linker that stores DB origins.
+        :param values: linker values of passage ids. Each value is an origin key, DB origin dict or None.
+        :return: DB origin dicts. None if the value is None or the origin key is not found.
+        """
+        unknown_keys = self.__unknown_keys(values)
+        if len(unknown_keys) > 0:
+            db_origins, _ = linker.get_json_with_status([self.ORIGIN_ID_PREFIX + key for key in unknown_keys])
+            self.__store(unknown_keys, db_origins)
+        return self.__map(values)
+
+    async def aresolve(self, linker: BaseLinker, values: List[Optional[Union[str, dict]]]) -> List[Optional[dict]]:
+        """
+        Async version of resolve. Unknown origin keys are fetched with aget_json_with_status of the linker.
+        """
+        unknown_keys = self.__unknown_keys(values)
+        if len(unknown_keys) > 0:
+            db_origins, _ = await linker.aget_json_with_status(
+                [self.ORIGIN_ID_PREFIX + key for key in unknown_keys])
+            self.__store(unknown_keys, db_origins)
+        return self.__map(values)
+
+    def __unknown_keys(self, values: List[Optional[Union[str, dict]]]) -> List[str]:
+        with self._lock:
+            return list({value for value in values if isinstance(value, str) and value not in self._origins})
+
+    def __store(self, keys: List[str], db_origins: List[Optional[dict]]):
+        with self._lock:
+            for key, db_origin in zip(keys, db_origins):
+                if db_origin is not None:
+                    self._origins[key] = db_origin
+
+    def __map(self, values: List[Optional[Union[str, dict]]]) -> List[Optional[dict]]:
+        with self._lock:
+            origins = dict(self._origins)
+        result = []
+        for value in values:
+            if isinstance(value, str):
+                if value not in origins:
+                    warnings.warn(f"DB origin {value} not found in Linker", NoDataWarning)
+                result.append(origins.get(value))
+            else:
+                result.append(value)
+        return result
+
+
+db_origin_table = DBOriginTable()
@@ -1,9 +1,12 @@
+import asyncio
 import os
+import threading
 import warnings
-from typing import Union, List
+from typing import Union, List, Optional, Dict
 from uuid import UUID
 
 import redis
+import redis.asyncio
 
 from RAGchain.utils.linker.base import BaseLinker, NoIdWarning, NoDataWarning
 
@@ -29,30 +32,80 @@ class RedisLinker(BaseLinker):
         if password is None:
             warnings.warn("REDIS_PW is not set. You can set REDIS_PW to environment variable", UserWarning)
 
-        self.client = redis.Redis(
+        self._connection_options = dict(
             host=host,
             port=port,
             db=db_name,
             decode_responses=True,
             password=password
         )
+        self.client = redis.Redis(**self._connection_options)
+        # async clients share the connection options, and they are used by aget_json.
+        # redis.asyncio.Redis is bound to the event loop where it connects, so each event loop has its own client.
+        self._async_clients: Dict[asyncio.AbstractEventLoop, redis.asyncio.Redis] = {}
+        self._async_clients_lock = threading.Lock()
+
+    def get_async_client(self) -> redis.asyncio.Redis:
+        """
+        Returns the async client of the running event loop. It is created at the first call in the loop.
+        Clients of closed event loops are dropped, because their connections are gone with the loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._async_clients_lock:
+            for closed_loop in [each_loop for each_loop in self._async_clients if each_loop.is_closed()]:
+                del self._async_clients[closed_loop]
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = redis.asyncio.Redis(**self._connection_options)
+                self._async_clients[loop] = client
+            return client
+
+    async def aclose(self):
+        """
+        Closes the async client of the running event loop.
+        Call this before the event loop is closed, for example at the end of the coroutine of asyncio.run.
+        """
+        with self._async_clients_lock:
+            client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
 
     def get_json(self, ids: List[Union[UUID, str]]):
+        results, statuses = self.get_json_with_status(ids)
+        self.warn_status(ids, statuses)
+        return results
+
+    async def aget_json(self, ids: List[Union[UUID, str]]):
+        results, statuses = await self.aget_json_with_status(ids)
+        self.warn_status(ids, statuses)
+        return results
+
+    def get_json_with_status(self, ids: List[Union[UUID, str]]) -> tuple[list, List[Optional[type]]]:
         assert len(ids) > 0, "ids must be a non-empty list"
         # redis only accept str type key
         str_ids = [str(find_id) for find_id in ids]
 
         response = self.client.json().mget(str_ids, '$')
-        results = []
-        for i, sublist in enumerate(response):
+        return self.__parse_response(response)
+
+    async def aget_json_with_status(self, ids: List[Union[UUID, str]]) -> tuple[list, List[Optional[type]]]:
+        assert len(ids) > 0, "ids must be a non-empty list"
+        str_ids = [str(find_id) for find_id in ids]
+
+        response = await self.get_async_client().json().mget(str_ids, '$')
+        return self.__parse_response(response)
+
+    @staticmethod
+    def __parse_response(response: list) -> tuple[list, List[Optional[type]]]:
+        results, statuses = [], []
+        for sublist in response:
             if sublist is None:
-                warnings.warn(f"ID {str_ids[i]} not found in Linker", NoIdWarning)
                 results.append(None)
+                statuses.append(NoIdWarning)
             else:
                 results.append(sublist[0])
-                if sublist[0] is None:
-                    warnings.warn(f"Data {str_ids[i]} not found in Linker", NoDataWarning)
-        return results
+                statuses.append(NoDataWarning if sublist[0] is None else None)
+        return results, statuses
 
     def connection_check(self):
         return self.client.ping()
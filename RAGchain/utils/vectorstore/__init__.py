@@ -1,2 +1,3 @@
 from .chroma import ChromaSlim
 from .pinecone import PineconeSlim
+from .numpy_slim import NumpySlim
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
 from RAGchain.schema import Passage
 
@@ -22,3 +23,36 @@ class SlimVectorStore(ABC):
         Embed multiple passages
         """
         pass
+
+    @staticmethod
+    def filter_metadata(passage: Passage) -> dict:
+        """
+        Metadata of the passage which can be filtered at the vector store.
+        content_datetime is stored as timestamp, because vector stores can compare only numbers.
+        """
+        return {'filepath': passage.filepath,
+                'importance': passage.importance,
+                'content_datetime': passage.content_datetime.timestamp()}
+
+    @staticmethod
+    def where_filter(filepath: Optional[List[str]] = None,
+                     content_datetime_range: Optional[List[tuple[datetime, datetime]]] = None,
+                     importance: Optional[List[int]] = None) -> Optional[dict]:
+        """
+        Make a metadata filter of filter_metadata, which is valid for both Chroma `where` and Pinecone `filter`.
+        Conditions are AND operation, and content_datetime ranges are OR operation, same as BaseDB.search.
+        :return: metadata filter, or None if there is no condition.
+        """
+        conditions = []
+        if filepath is not None:
+            conditions.append({'filepath': {'$in': list(filepath)}})
+        if importance is not None:
+            conditions.append({'importance': {'$in': list(importance)}})
+        if content_datetime_range is not None:
+            ranges = [{'$and': [{'content_datetime': {'$gte': start.timestamp()}},
+                                {'content_datetime': {'$lte': end.timestamp()}}]}
+                      for start, end in content_datetime_range]
+            conditions.append(ranges[0] if len(ranges) == 1 else {'$or': ranges})
+        if len(conditions) == 0:
+            return None
+        return conditions[0] if len(conditions) == 1 else {'$and': conditions}
@@ -9,13 +9,14 @@ from RAGchain.utils.vectorstore.base import SlimVectorStore
 class ChromaSlim(Chroma, SlimVectorStore):
     """
     Chroma vector store stores only passage_id and vector.
+    filepath, importance and content_datetime are stored as metadata too, so they can be filtered with `where`.
     """
     def add_passages(self, passages: List[Passage]):
         embeddings = None
         if self._embedding_function is not None:
             contents = [passage.content for passage in passages]
             embeddings = self._embedding_function.embed_documents(contents)
-        metadatas = [{"passage_id": str(passage.id)} for passage in passages]
+        metadatas = [{"passage_id": str(passage.id), **self.filter_metadata(passage)} for passage in passages]
         self._collection.upsert(
             embeddings=embeddings,
             metadatas=metadatas,
@@ -0,0 +1,668 @@
+import json
+import os
+import threading
+import time
+import uuid
+from typing import List, Optional, Iterable, Any, Tuple, Callable, Dict, Iterator
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+from langchain.schema.vectorstore import VectorStore
+
+from RAGchain.schema import Passage
+from RAGchain.utils.vectorstore.base import SlimVectorStore
+
+
+
+_M1, _M2, _M4, _H01 = (np.uint64(0x5555555555555555), np.uint64(0x3333333333333333),
+                       np.uint64(0x0F0F0F0F0F0F0F0F), np.uint64(0x0101010101010101))
+
+
+def _popcount64(x: np.ndarray) -> np.ndarray:
+    """Number of set bits of each uint64, with the SWAR bit counting. x is overwritten."""
+    t = np.right_shift(x, np.uint64(1))
+    t &= _M1
+    x -= t
+    np.right_shift(x, np.uint64(2), out=t)
+    t &= _M2
+    x &= _M2
+    x += t
+    np.right_shift(x, np.uint64(4), out=t)
+    x += t
+    x &= _M4
+    x *= _H01
+    x >>= np.uint64(56)
+    return x
+
+
+def _pack_signs(vectors: np.ndarray) -> np.ndarray:
+    """Pack sign bits of vectors to uint64 words, padded with zero bits."""
+    bits = np.packbits(vectors > 0, axis=1)
+    padding = -bits.shape[1] % 8
+    if padding > 0:
+        bits = np.pad(bits, ((0, 0), (0, padding)))
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+
+class NumpySlim(VectorStore, SlimVectorStore):
+    """
+    In-process vector store stores only passage_id and vector, without any external service.
+    Vectors are kept at a contiguous float32 matrix, and exact search is one matmul and argpartition.
+    Set index_type to 'hnsw' to search with a HNSW graph of hnswlib, which is sub-linear for large collections.
+
+    With save_path, every add_passages and delete is appended to the files at save_path directory,
+    so you don't need to save whole vectors again. Set mmap to True to memory-map the vectors
+    instead of reading them to memory. Deleted rows are removed from the files at compaction.
+    The uid and version of the store are saved with it, so stores of other processes see the same values.
+
+    Vectors are normalized by default, so the score is cosine similarity. Higher score is more similar.
+
+    Set quantization to 'int8' or 'binary' to keep only compressed codes in memory.
+    int8 codes are 4x smaller than float32 vectors, and binary (sign bit) codes are 32x smaller.
+    Search finds candidates with the codes first, and rescores them with full precision vectors,
+    which are memory-mapped from the vector file, so only the candidate rows are read.
+    Use quantization_report to check the recall and latency of your data.
+
+    :example:
+    >>> from RAGchain.utils.vectorstore import NumpySlim
+    >>> from RAGchain.retrieval import VectorDBRetrieval
+    >>> vectordb = NumpySlim(EmbeddingFactory('openai').get(), save_path='./numpy_slim', mmap=True)
+    >>> retrieval = VectorDBRetrieval(vectordb=vectordb)
+    """
+    META_FILE = 'meta.json'
+    HNSW_META_FILE = 'hnsw.json'
+
+    def __init__(self, embedding_function: Embeddings, save_path: Optional[str] = None, mmap: bool = False,
+                 normalize: bool = True, index_type: str = 'exact', hnsw_m: int = 16,
+                 hnsw_ef_construction: int = 200, hnsw_ef_search: int = 64, compaction_threshold: float = 0.3,
+                 quantization: Optional[str] = None, rescore_factor: Optional[int] = None):
+        """
+        :param embedding_function: embedding model to embed passages and queries.
+        :param save_path: directory to persist vectors. Default is None, which keeps vectors in memory only.
+        :param mmap: If True, memory-map the vector file at save_path instead of reading it. Default is False.
+        :param normalize: If True, normalize vectors, so the score is cosine similarity.
+        Else, the score is inner product. Default is True.
+        :param index_type: 'exact' for exact search, or 'hnsw' for approximate search with hnswlib.
+        Default is 'exact'.
+        :param hnsw_m: max number of neighbors of each node at HNSW graph. Default is 16.
+        :param hnsw_ef_construction: search width at HNSW graph construction. Default is 200.
+        :param hnsw_ef_search: search width at HNSW search. Larger is more accurate and slower.
+        It is at least k. Default is 64.
+        :param compaction_threshold: ratio of deleted rows to trigger compaction at delete. Default is 0.3.
+        :param quantization: 'int8' or 'binary' to search with compressed codes first.
+        It requires save_path, and full precision vectors are always memory-mapped.
+        It can't be used with 'hnsw' index_type. Default is None, which searches full precision vectors only.
+        :param rescore_factor: number of candidates to rescore per result, so k * rescore_factor candidates
+        are rescored with full precision vectors. Larger is more accurate and slower.
+        Default is 4 for int8 and 16 for binary.
+        """
+        if index_type not in ['exact', 'hnsw']:
+            raise ValueError("index_type should be either 'exact' or 'hnsw'")
+        if mmap and save_path is None:
+            raise ValueError("save_path is required for mmap")
+        if not 0.0 < compaction_threshold <= 1.0:
+            raise ValueError("compaction_threshold must be in (0, 1]")
+        if quantization not in [None, 'int8', 'binary']:
+            raise ValueError("quantization should be one of None, 'int8' and 'binary'")
+        if quantization is not None:
+            if save_path is None:
+                raise ValueError("save_path is required for quantization")
+            if index_type == 'hnsw':
+                raise ValueError("quantization can't be used with hnsw index")
+            mmap = True
+        if rescore_factor is None:
+            rescore_factor = 16 if quantization == 'binary' else 4
+        if rescore_factor < 1:
+            raise ValueError("rescore_factor must be at least 1")
+        self._embedding_function = embedding_function
+        self.save_path = save_path
+        self.mmap = mmap
+        self.normalize = normalize
+        self.index_type = index_type
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        self.compaction_threshold = compaction_threshold
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self._lock = threading.RLock()
+        self._dim: Optional[int] = None
+        self._generation = 0
+        # random id of the store, and the number of row log entries of current generation.
+        # version is version_offset + log_rows, and version_offset is moved at compaction to keep it increasing.
+        self._uid = uuid.uuid4().hex
+        self._log_rows = 0
+        self._version_offset = 0
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        # quantized codes of rows, and the scale of each row for int8
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._hnsw = None
+        if save_path is not None:
+            os.makedirs(save_path, exist_ok=True)
+            self.__load()
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding_function
+
+    @property
+    def uid(self) -> str:
+        """Random id of the store, which is saved at meta file of save_path."""
+        return self._uid
+
+    @property
+    def version(self) -> int:
+        """
+        Version of the stored vectors, which increases at every add, delete and compaction.
+        It is derived from the files at save_path, so it is the same after the store is loaded again.
+        """
+        return self._version_offset + self._log_rows
+
+    def add_passages(self, passages: List[Passage]):
+        if len(passages) == 0:
+            return
+        vectors = self._embedding_function.embed_documents([passage.content for passage in passages])
+        self.add_vectors([str(passage.id) for passage in passages], vectors)
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        """
+        Add texts. Only ids are stored, and id is passage_id of metadata, ids, or a new uuid in order.
+        """
+        texts = list(texts)
+        if ids is None:
+            ids = [metadata.get('passage_id') if metadata is not None else None
+                   for metadata in (metadatas or [None] * len(texts))]
+            ids = [str(_id) if _id is not None else str(uuid.uuid4()) for _id in ids]
+        if len(texts) > 0:
+            self.add_vectors(ids, self._embedding_function.embed_documents(texts))
+        return ids
+
+    def add_vectors(self, ids: List[str], vectors: List[List[float]]):
+        """
+        Add vectors of ids. Vectors of existing ids are replaced.
+        """
+        if len(ids) != len(vectors):
+            raise ValueError("ids and vectors should have the same length")
+        if len(ids) == 0:
+            return
+        # the last vector wins when the same id is given twice
+        last_index = {str(_id): i for i, _id in enumerate(ids)}
+        ids = list(last_index.keys())
+        vectors = self.__prepare(np.asarray(vectors, dtype=np.float32)[list(last_index.values())])
+        with self._lock:
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                self._vectors = np.zeros((0, self._dim), dtype=np.float32)
+                self.__write_meta()
+            elif vectors.shape[1] != self._dim:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} is different from {self._dim}")
+            replaced_rows = [self._rows[_id] for _id in ids if _id in self._rows]
+            start = len(self._ids)
+            if self.save_path is not None:
+                with open(self.__vector_path(), 'ab') as f:
+                    f.write(vectors.tobytes())
+                self.__append_rows([['add', _id] for _id in ids])
+            self._log_rows += len(ids)
+            self.__append_vectors(vectors)
+            self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+            self._alive[replaced_rows] = False
+            self._ids.extend(ids)
+            for i, _id in enumerate(ids):
+                self._rows[_id] = start + i
+            if self.index_type == 'hnsw':
+                index = self.__hnsw_index()
+                for row in replaced_rows:
+                    index.mark_deleted(row)
+                self.__hnsw_add(index, vectors, np.arange(start, start + len(ids)))
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """
+        Delete vectors of ids. Ids which are not in the store are ignored.
+        Compaction runs when the ratio of deleted rows is at least compaction_threshold.
+        """
+        if ids is None:
+            return False
+        with self._lock:
+            rows = [self._rows.pop(str(_id)) for _id in ids if str(_id) in self._rows]
+            if len(rows) == 0:
+                return True
+            if self.save_path is not None:
+                self.__append_rows([['delete', self._ids[row]] for row in rows])
+            self._log_rows += len(rows)
+            self._alive[rows] = False
+            if self._hnsw is not None:
+                for row in rows:
+                    self._hnsw.mark_deleted(row)
+            if 1 - len(self._rows) / len(self._ids) >= self.compaction_threshold:
+                self.compact()
+        return True
+
+    def ids(self) -> List[str]:
+        """Get ids of every vector which is not deleted."""
+        with self._lock:
+            return list(self._rows.keys())
+
+    def search(self, query_vector: List[float], k: int = 4,
+               allowed_ids: Optional[Iterable[str]] = None) -> Tuple[List[str], List[float]]:
+        """
+        Search the most similar vectors.
+        :param allowed_ids: If given, only vectors of these ids are searched. Default is None.
+        :return: ids and scores, from the most similar one.
+        """
+        ids_list, scores_list = self.search_batch([query_vector], k, allowed_ids=allowed_ids)
+        return ids_list[0], scores_list[0]
+
+    def search_batch(self, query_vectors: List[List[float]], k: int = 4,
+                     allowed_ids: Optional[Iterable[str]] = None) -> Tuple[List[List[str]], List[List[float]]]:
+        """
+        Search the most similar vectors of each query vector.
+        Exact search scores every query with one matmul.
+        With quantization, candidates of every query are found with the codes, and rescored with full vectors.
+        :param allowed_ids: If given, only vectors of these ids are searched.
+        Other rows are masked out while scoring, so k allowed vectors are returned.
+        The HNSW graph is not used with allowed_ids, and allowed vectors are searched exactly. Default is None.
+        :return: ids and scores of each query, from the most similar one.
+        """
+        if len(query_vectors) == 0:
+            return [], []
+        queries = self.__prepare(np.asarray(query_vectors, dtype=np.float32))
+        with self._lock:
+            ids, vectors, alive, index = self._ids, self._vectors, self._alive, self._hnsw
+            codes, scales = self._codes, self._scales
+            k = min(k, len(self._rows))
+            if allowed_ids is not None:
+                rows = [self._rows[_id] for _id in allowed_ids if _id in self._rows]
+                alive = np.zeros(len(alive), dtype=bool)
+                alive[rows] = True
+                k, index = min(k, len(rows)), None
+            if k > 0 and index is not None:
+                index.set_ef(max(self.hnsw_ef_search, k))
+                labels, distances = index.knn_query(queries, k=k)
+                return [[ids[label] for label in row] for row in labels], (1.0 - distances).tolist()
+        if k <= 0:
+            return [[] for _ in queries], [[] for _ in queries]
+        if codes is not None:
+            return self.__search_quantized(queries, k, ids, vectors, alive, codes, scales)
+        return self.__search_exact(queries, k, ids, vectors, alive)
+
+    def iter_search(self, query_vector: List[float], page_size: int = 10) -> Iterator[Tuple[str, float]]:
+        """
+        Cursor of ids and scores, from the most similar one.
+        Every vector is scored exactly once at the first page, and each next page only selects the best remaining
+        scores. Vectors which are added or deleted after the first page don't change the cursor.
+        """
+        queries = self.__prepare(np.asarray([query_vector], dtype=np.float32))
+        with self._lock:
+            ids, vectors, alive = self._ids, self._vectors, self._alive
+        if len(alive) == 0:
+            return
+        scores = vectors[:len(alive)] @ queries[0]
+        remaining = np.flatnonzero(alive)
+        while len(remaining) > 0:
+            page = min(max(page_size, 1), len(remaining))
+            order = np.argpartition(-scores[remaining], page - 1)[:page]
+            order = order[np.argsort(-scores[remaining[order]], kind='stable')]
+            for row in remaining[order]:
+                yield ids[row], float(scores[row])
+            remaining = np.delete(remaining, order)
+
+    def quantization_report(self, query_vectors: List[List[float]], k: int = 10) -> dict:
+        """
+        Compare quantized search with exact search of full precision vectors.
+        :param query_vectors: sample query vectors, like embeddings of your real queries.
+        :param k: number of results to compare.
+        :return: recall@k of quantized search, mean latency of each search in milliseconds,
+        and memory bytes of full precision vectors and codes.
+        """
+        if self.quantization is None:
+            raise ValueError("quantization is not set")
+        if len(query_vectors) == 0:
+            raise ValueError("query_vectors is empty")
+        queries = self.__prepare(np.asarray(query_vectors, dtype=np.float32))
+        with self._lock:
+            ids, vectors, alive = self._ids, self._vectors, self._alive
+            codes, scales = self._codes, self._scales
+            k = min(k, len(self._rows))
+        start = time.perf_counter()
+        exact_ids = [self.__search_exact(query[None, :], k, ids, vectors, alive)[0][0] for query in queries]
+        exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        start = time.perf_counter()
+        quantized_ids = [self.__search_quantized(query[None, :], k, ids, vectors, alive, codes, scales)[0][0]
+                         for query in queries]
+        quantized_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = np.mean([len(set(exact) & set(quantized)) / max(len(exact), 1)
+                          for exact, quantized in zip(exact_ids, quantized_ids)])
+        vector_bytes = len(alive) * self._dim * np.dtype(np.float32).itemsize
+        code_bytes = codes[:len(alive)].nbytes + (scales[:len(alive)].nbytes if scales is not None else 0)
+        return {'recall': float(recall), 'exact_ms': exact_ms, 'quantized_ms': quantized_ms,
+                'vector_bytes': vector_bytes, 'code_bytes': code_bytes,
+                'compression': vector_bytes / code_bytes if code_bytes > 0 else None}
+
+    @staticmethod
+    def __search_exact(queries: np.ndarray, k: int, ids: List[str], vectors: np.ndarray, alive: np.ndarray):
+        scores = queries @ vectors[:len(alive)].T
+        scores[:, ~alive] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        # rows deleted during the search have -inf score
+        found = np.isfinite(top_scores)
+        return ([[ids[row] for row in rows[mask]] for rows, mask in zip(top, found)],
+                [scores[mask].tolist() for scores, mask in zip(top_scores, found)])
+
+    def __search_quantized(self, queries: np.ndarray, k: int, ids: List[str], vectors: np.ndarray,
+                           alive: np.ndarray, codes: np.ndarray, scales: Optional[np.ndarray]):
+        count = len(alive)
+        candidates = self.__candidates(queries, min(k * self.rescore_factor, count), codes[:count],
+                                       scales[:count] if scales is not None else None, alive)
+        ids_list, scores_list = [], []
+        for query, rows in zip(queries, candidates):
+            # sorted rows read the memory-mapped vectors sequentially
+            rows = np.sort(rows[alive[rows]])
+            scores = vectors[rows] @ query
+            top = np.argsort(-scores, kind='stable')[:k]
+            ids_list.append([ids[row] for row in rows[top]])
+            scores_list.append(scores[top].tolist())
+        return ids_list, scores_list
+
+    def __candidates(self, queries: np.ndarray, n_candidates: int, codes: np.ndarray,
+                     scales: Optional[np.ndarray], alive: np.ndarray) -> np.ndarray:
+        """
+        Find rows with the highest approximate scores of each query, scanning codes chunk by chunk.
+        int8 scores are the dot products with the codes times the row scales.
+        binary scores are negative hamming distances with the sign bits of queries.
+        """
+        if self.quantization == 'binary':
+            query_codes = _pack_signs(queries)
+            # bound the temporary xor array of (queries, rows, words)
+            chunk_size = max(1024, (1 << 17) // max(len(queries) * codes.shape[1], 1))
+        else:
+            # bound the temporary float32 codes, so they stay in cache
+            chunk_size = max(1024, (1 << 18) // codes.shape[1])
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(codes), chunk_size):
+            end = min(start + chunk_size, len(codes))
+            if self.quantization == 'binary':
+                distances = _popcount64(codes[None, start:end] ^ query_codes[:, None, :]).sum(axis=2)
+                scores = -distances.astype(np.float32)
+            else:
+                scores = (queries @ codes[start:end].astype(np.float32).T) * scales[start:end]
+            scores[:, ~alive[start:end]] = -np.inf
+            rows = np.broadcast_to(np.arange(start, end), scores.shape)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            if best_scores.shape[1] > n_candidates:
+                top = np.argpartition(-best_scores, n_candidates - 1, axis=1)[:, :n_candidates]
+                best_rows = np.take_along_axis(best_rows, top, axis=1)
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+        return best_rows
+
+    def __encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Quantize vectors to codes. int8 codes are scaled by the max absolute value of each row."""
+        if self.quantization == 'binary':
+            return _pack_signs(vectors), None
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales
+
+    def __append_codes(self, start: int, vectors: np.ndarray):
+        """Write codes of vectors from the start row. It grows the capacity of codes by doubling."""
+        codes, scales = self.__encode(vectors)
+        end = start + len(vectors)
+        if self._codes is None or end > len(self._codes):
+            capacity = max(end, 2 * (len(self._codes) if self._codes is not None else 0), 16)
+            grown = np.zeros((capacity, codes.shape[1]), dtype=codes.dtype)
+            if self._codes is not None:
+                grown[:start] = self._codes[:start]
+            self._codes = grown
+            if scales is not None:
+                grown_scales = np.ones(capacity, dtype=np.float32)
+                if self._scales is not None:
+                    grown_scales[:start] = self._scales[:start]
+                self._scales = grown_scales
+        self._codes[start:end] = codes
+        if scales is not None:
+            self._scales[start:end] = scales
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding_function.embed_query(query), k=k)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k)]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4) -> List[
+        Tuple[Document, float]]:
+        ids, scores = self.search(embedding, k)
+        return [(Document(page_content="", metadata={'passage_id': _id}), score) for _id, score in zip(ids, scores)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, **kwargs: Any) -> 'NumpySlim':
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def compact(self):
+        """
+        Remove deleted rows from the vectors, codes and files, and rebuild the HNSW graph.
+        Files of the new generation are written first, so the store can be loaded even if it is interrupted.
+        """
+        with self._lock:
+            rows = np.flatnonzero(self._alive)
+            ids = [self._ids[row] for row in rows]
+            previous_generation = self._generation
+            self._generation += 1
+            self._version_offset += self._log_rows + 1 - len(ids)
+            self._log_rows = len(ids)
+            if self.save_path is not None:
+                # copy in chunks, so memory-mapped vectors are not read to memory at once
+                with open(self.__vector_path(), 'wb') as f:
+                    for start in range(0, len(rows), 1 << 16):
+                        f.write(np.ascontiguousarray(self._vectors[rows[start:start + (1 << 16)]]).tobytes())
+                with open(self.__row_path(), 'w', encoding='utf-8') as f:
+                    f.writelines(json.dumps(['add', _id]) + '\n' for _id in ids)
+                self.__write_meta()
+            if self.mmap:
+                self._vectors = self.__map_vectors(len(ids))
+            else:
+                self._vectors = np.array(self._vectors[rows], dtype=np.float32)
+            if self._codes is not None:
+                self._codes = self._codes[rows]
+                self._scales = self._scales[rows] if self._scales is not None else None
+            if self.save_path is not None:
+                self.__remove_generation(previous_generation)
+            self._ids = ids
+            self._rows = {_id: row for row, _id in enumerate(ids)}
+            self._alive = np.ones(len(ids), dtype=bool)
+            if self.index_type == 'hnsw':
+                self._hnsw = None
+                if len(ids) > 0:
+                    self.__hnsw_add(self.__hnsw_index(), np.asarray(self._vectors[:len(ids)]), np.arange(len(ids)))
+                self.save_index()
+
+    def save_index(self):
+        """
+        Save the HNSW graph to save_path. Rows which are added after saving are added to the graph at load,
+        so you don't need to save it after every add_passages.
+        """
+        if self.save_path is None or self.index_type != 'hnsw':
+            return
+        with self._lock:
+            if self._hnsw is None:
+                return
+            self._hnsw.save_index(self.__hnsw_path())
+            with open(os.path.join(self.save_path, self.HNSW_META_FILE), 'w') as f:
+                json.dump({'generation': self._generation, 'rows': len(self._ids)}, f)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._rows)
+
+    def __prepare(self, vectors: np.ndarray) -> np.ndarray:
+        if vectors.ndim != 2:
+            raise ValueError("vectors should be 2D")
+        if self.normalize:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms > 0, norms, 1.0)
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def __append_vectors(self, vectors: np.ndarray):
+        """Append vectors to the matrix. It grows the capacity by doubling, or remaps the vector file."""
+        count = len(self._ids) + len(vectors)
+        if self.quantization is not None:
+            self.__append_codes(len(self._ids), vectors)
+        if self.mmap:
+            self._vectors = self.__map_vectors(count)
+            return
+        if count > self._vectors.shape[0]:
+            grown = np.zeros((max(count, 2 * self._vectors.shape[0], 16), self._dim), dtype=np.float32)
+            grown[:len(self._ids)] = self._vectors[:len(self._ids)]
+            self._vectors = grown
+        self._vectors[len(self._ids):count] = vectors
+
+    def __map_vectors(self, count: int) -> np.ndarray:
+        if count == 0:
+            return np.zeros((0, self._dim), dtype=np.float32)
+        return np.memmap(self.__vector_path(), dtype=np.float32, mode='r', shape=(count, self._dim))
+
+    def __load(self):
+        meta_path = os.path.join(self.save_path, self.META_FILE)
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self._dim = meta['dim']
+        self._generation = meta['generation']
+        self._version_offset = meta.get('version_offset', 0)
+        if 'uid' in meta:
+            self._uid = meta['uid']
+        else:
+            # meta of previous versions has no uid
+            self.__write_meta()
+        ids, alive, rows, log_rows = [], [], {}, 0
+        if os.path.exists(self.__row_path()):
+            valid_size = 0
+            with open(self.__row_path(), 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # the last line of an interrupted write
+                        break
+                    valid_size += len(line)
+                    log_rows += 1
+                    op, _id = json.loads(line)
+                    if op == 'add':
+                        if _id in rows:
+                            alive[rows[_id]] = False
+                        rows[_id] = len(ids)
+                        ids.append(_id)
+                        alive.append(True)
+                    elif _id in rows:
+                        alive[rows.pop(_id)] = False
+            # drop the parts of an interrupted write, so next appends are aligned with rows
+            os.truncate(self.__row_path(), valid_size)
+        vector_size = len(ids) * self._dim * np.dtype(np.float32).itemsize
+        if os.path.exists(self.__vector_path()) and os.path.getsize(self.__vector_path()) > vector_size:
+            os.truncate(self.__vector_path(), vector_size)
+        if self.mmap or len(ids) == 0:
+            self._vectors = self.__map_vectors(len(ids))
+        else:
+            vectors = np.fromfile(self.__vector_path(), dtype=np.float32, count=len(ids) * self._dim)
+            self._vectors = vectors.reshape(len(ids), self._dim)
+        if self.quantization is not None:
+            # codes are made from the vector file in chunks, so the whole vectors are not read to memory at once
+            for start in range(0, len(ids), 1 << 16):
+                self.__append_codes(start, np.asarray(self._vectors[start:start + (1 << 16)]))
+        self._ids, self._rows, self._alive = ids, rows, np.array(alive, dtype=bool)
+        self._log_rows = log_rows
+        if self.index_type == 'hnsw' and len(ids) > 0:
+            self.__load_hnsw()
+
+    def __load_hnsw(self):
+        covered = 0
+        hnsw_meta_path = os.path.join(self.save_path, self.HNSW_META_FILE)
+        if os.path.exists(hnsw_meta_path) and os.path.exists(self.__hnsw_path()):
+            with open(hnsw_meta_path) as f:
+                hnsw_meta = json.load(f)
+            if hnsw_meta['generation'] == self._generation and hnsw_meta['rows'] <= len(self._ids):
+                index = self.__new_hnsw()
+                index.load_index(self.__hnsw_path(), max_elements=max(len(self._ids), 16))
+                self._hnsw, covered = index, hnsw_meta['rows']
+        index = self.__hnsw_index()
+        for row in np.flatnonzero(~self._alive[:covered]):
+            try:
+                index.mark_deleted(int(row))
+            except RuntimeError:
+                # already deleted at the saved graph
+                pass
+        if covered < len(self._ids):
+            rows = np.arange(covered, len(self._ids))
+            self.__hnsw_add(index, np.asarray(self._vectors[covered:]), rows)
+            for row in rows[~self._alive[covered:]]:
+                index.mark_deleted(int(row))
+
+    def __new_hnsw(self):
+        try:
+            import hnswlib
+        except ImportError:
+            raise ModuleNotFoundError("Could not import hnswlib library. Please install hnswlib library."
+                                      "pip install hnswlib")
+        return hnswlib.Index(space='ip', dim=self._dim)
+
+    def __hnsw_index(self):
+        if self._hnsw is None:
+            self._hnsw = self.__new_hnsw()
+            self._hnsw.init_index(max_elements=max(len(self._ids), 16), ef_construction=self.hnsw_ef_construction,
+                                  M=self.hnsw_m)
+        return self._hnsw
+
+    @staticmethod
+    def __hnsw_add(index, vectors: np.ndarray, rows: np.ndarray):
+        required = int(rows[-1]) + 1
+        if required > index.get_max_elements():
+            index.resize_index(max(required, 2 * index.get_max_elements()))
+        index.add_items(vectors, rows)
+
+    def __append_rows(self, rows: List[list]):
+        with open(self.__row_path(), 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(row) + '\n' for row in rows)
+
+    def __write_meta(self):
+        if self.save_path is None:
+            return
+        temp_path = os.path.join(self.save_path, self.META_FILE + '.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump({'dim': self._dim, 'generation': self._generation, 'uid': self._uid,
+                       'version_offset': self._version_offset}, f)
+        os.replace(temp_path, os.path.join(self.save_path, self.META_FILE))
+
+    def __remove_generation(self, generation: int):
+        for path in [self.__vector_path(generation), self.__row_path(generation), self.__hnsw_path(generation)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __vector_path(self, generation: Optional[int] = None) -> str:
+        generation = self._generation if generation is None else generation
+        return os.path.join(self.save_path, f'vectors.{generation}.f32')
+
+    def __row_path(self, generation: Optional[int] = None) -> str:
+        generation = self._generation if generation is None else generation
+        return os.path.join(self.save_path, f'rows.{generation}.jsonl')
+
+    def __hnsw_path(self, generation: Optional[int] = None) -> str:
+        generation = self._generation if generation is None else generation
+        return os.path.join(self.save_path, f'hnsw.{generation}.bin')
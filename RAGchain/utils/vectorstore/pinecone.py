@@ -9,6 +9,7 @@ from RAGchain.utils.vectorstore.base import SlimVectorStore
 class PineconeSlim(Pinecone, SlimVectorStore):
     """
     Pinecone vector store stores only passage_id and vector.
+    filepath, importance and content_datetime are stored as metadata too, so they can be filtered with `filter`.
     """
     def add_passages(self, passages: List[Passage],
                      namespace: Optional[str] = None,
@@ -16,15 +17,16 @@ class PineconeSlim(Pinecone, SlimVectorStore):
                      **kwargs: Any):
         if namespace is None:
             namespace = self._namespace
-        # Embed and make metadatas
+        # Embed at once, so embedding caches and batch embedding apis work, and make metadatas
+        embeddings = self._embed_documents([passage.content for passage in passages])
         vectors = []
-        for passage in passages:
-            embedding = self._embedding.embed_query(passage.content)
+        for passage, embedding in zip(passages, embeddings):
             vectors.append({
                 'id': str(passage.id),
                 'values': embedding,
                 'metadata': {'passage_id': str(passage.id),
-                             self._text_key: ""}
+                             self._text_key: "",
+                             **self.filter_metadata(passage)}
             })
 
         self._index.upsert(
@@ -1,3 +1,4 @@
+import asyncio
 import os
 
 import pytest
@@ -39,3 +40,27 @@ def test_search(mongo_db):
 
 def test_duplicate_id(mongo_db):
     duplicate_id_test_base(mongo_db, BulkWriteError)
+
+
+def test_close_async_clients():
+    mongo_url = os.getenv('MONGO_URL')
+
+    async def use_and_close():
+        client = MongoDB.get_async_client(mongo_url)
+        await client.admin.command('ping')
+        await MongoDB.aclose_clients()
+        return client
+
+    async def use():
+        await MongoDB.get_async_client(mongo_url).admin.command('ping')
+
+    asyncio.run(use_and_close())
+    assert len(MongoDB._async_clients) == 0
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(use())
+        MongoDB.close_clients()
+        assert len(MongoDB._async_clients) == 0
+    finally:
+        loop.close()
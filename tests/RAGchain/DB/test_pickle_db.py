@@ -1,10 +1,15 @@
+import asyncio
 import os
 import pathlib
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 import pytest
 
 from RAGchain.DB import PickleDB
-from test_base_db import fetch_test_base, TEST_PASSAGES, search_test_base, duplicate_id_test_base
+from test_base_db import fetch_test_base, TEST_PASSAGES, search_test_base, duplicate_id_test_base, \
+    DUPLICATE_PASSAGE
 
 
 @pytest.fixture(scope='module')
@@ -37,5 +42,117 @@ def test_search(pickle_db):
     search_test_base(pickle_db)
 
 
+def test_async(pickle_db):
+    ids = [passage.id for passage in TEST_PASSAGES]
+    assert asyncio.run(pickle_db.afetch(ids)) == pickle_db.fetch(ids)
+    assert asyncio.run(pickle_db.asearch(filepath=['./test/second_file.txt'], test=['test3'])) == \
+           pickle_db.search(filepath=['./test/second_file.txt'], test=['test3'])
+
+
 def test_duplicate_id(pickle_db):
     duplicate_id_test_base(pickle_db, ValueError)
+
+
+@pytest.fixture
+def log_pickle_db_path():
+    root_dir = pathlib.PurePath(os.path.dirname(os.path.realpath(__file__))).parent.parent
+    pickle_db_path = os.path.join(root_dir, "resources", "pickle", "log_pickle_db.pkl")
+    yield pickle_db_path
+    for path in [pickle_db_path, f'{pickle_db_path}.log']:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def test_log_persistence(log_pickle_db_path):
+    pickle_db = PickleDB(save_path=log_pickle_db_path, snapshot_ratio=1.0)
+    pickle_db.create_or_load()
+    pickle_db.save(TEST_PASSAGES[:2])
+    assert not os.path.exists(pickle_db.log_path)
+    # small saves are appended to the log, without rewriting the pickle file
+    snapshot_mtime = os.path.getmtime(log_pickle_db_path)
+    pickle_db.save(TEST_PASSAGES[2:3])
+    pickle_db.save(DUPLICATE_PASSAGE, upsert=True)
+    assert os.path.exists(pickle_db.log_path)
+    assert os.path.getmtime(log_pickle_db_path) == snapshot_mtime
+    with open(log_pickle_db_path, 'rb') as f:
+        assert len(pickle.load(f)) == 2
+
+    # interrupted save leaves a broken record at the end of the log
+    with open(pickle_db.log_path, 'ab') as f:
+        f.write(pickle.dumps(TEST_PASSAGES[3:])[:-10])
+    loaded_db = PickleDB(save_path=log_pickle_db_path)
+    with pytest.warns(UserWarning):
+        loaded_db.load()
+    assert len(loaded_db.db) == 3
+    assert loaded_db.fetch([DUPLICATE_PASSAGE[0].id])[0].is_exactly_same(DUPLICATE_PASSAGE[0])
+    loaded_db.save(TEST_PASSAGES[3:])
+    assert not os.path.exists(loaded_db.log_path)
+
+    loaded_db = PickleDB(save_path=log_pickle_db_path)
+    loaded_db.load()
+    assert loaded_db.fetch([passage.id for passage in reversed(TEST_PASSAGES)]) == list(reversed(TEST_PASSAGES))
+    assert [passage.id for passage in loaded_db.search(filepath=['./test/duplicate_file.txt'])] == ['test_id_3']
+    assert loaded_db.search(filepath=['./test/second_file.txt']) == [TEST_PASSAGES[1]]
+    assert len(loaded_db.search(no_key=[None])) == len(TEST_PASSAGES)
+
+
+def test_search_indexes(log_pickle_db_path):
+    pickle_db = PickleDB(save_path=log_pickle_db_path, index_metadata_keys=['test'])
+    pickle_db.create_or_load()
+    pickle_db.save(TEST_PASSAGES)
+    search_test_base(pickle_db)
+    assert pickle_db.search(content_datetime_range=[(datetime(2022, 2, 4), datetime(2022, 2, 5))],
+                            test=['test1', 'test3']) == [TEST_PASSAGES[2]]
+    assert pickle_db.search(content_datetime_range=[(datetime(2021, 1, 1), datetime(2021, 12, 31))]) == []
+
+    # indexes are updated at upsert
+    pickle_db.save(DUPLICATE_PASSAGE, upsert=True)
+    assert pickle_db.search(content_datetime_range=[(datetime(2022, 2, 5), datetime(2022, 2, 5))]) == []
+    result = pickle_db.search(content_datetime_range=[(datetime(2022, 3, 6), datetime(2022, 3, 6))],
+                              importance=[-1])
+    assert sorted(passage.id for passage in result) == ['test_id_3', 'test_id_4']
+    assert pickle_db.search(test=['test3'], filepath=['./test/duplicate_file.txt']) == DUPLICATE_PASSAGE
+    assert pickle_db.search(test=['test3'], filepath=['./test/second_file.txt']) == []
+
+
+def test_search_concurrent_first_use(log_pickle_db_path):
+    writer_db = PickleDB(save_path=log_pickle_db_path)
+    writer_db.create_or_load()
+    writer_db.save(TEST_PASSAGES)
+    pickle_db = PickleDB(save_path=log_pickle_db_path)
+    pickle_db.load()
+
+    def search(_):
+        return pickle_db.search(filepath=['./test/second_file.txt'],
+                                content_datetime_range=[(datetime(2022, 2, 1), datetime(2022, 12, 31))])
+
+    # every thread builds or waits for the indexes at the first search
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(search, range(32)))
+    expected = [passage for passage in TEST_PASSAGES if passage.filepath == './test/second_file.txt'
+                and datetime(2022, 2, 1) <= passage.content_datetime <= datetime(2022, 12, 31)]
+    assert len(expected) > 0
+    assert all(sorted(result, key=lambda passage: passage.id) == expected for result in results)
+
+def test_load_if_stale(log_pickle_db_path):
+    writer_db = PickleDB(save_path=log_pickle_db_path, snapshot_ratio=1.0)
+    writer_db.create_or_load()
+    assert writer_db.is_stale()
+    writer_db.save(TEST_PASSAGES[:2])
+    assert not writer_db.is_stale()
+
+    reader_db = PickleDB(save_path=log_pickle_db_path)
+    reader_db.load_if_stale()
+    assert len(reader_db.db) == 2
+    assert not reader_db.is_stale()
+
+    # saves of another instance make the reader stale, and the writer stays up to date
+    writer_db.save(TEST_PASSAGES[2:3])
+    assert not writer_db.is_stale()
+    assert reader_db.is_stale()
+    reader_db.load_if_stale()
+    assert len(reader_db.db) == 3
+    reader_db.save(TEST_PASSAGES[3:])
+    assert writer_db.is_stale()
+    writer_db.load_if_stale()
+    assert writer_db.fetch([passage.id for passage in TEST_PASSAGES]) == TEST_PASSAGES
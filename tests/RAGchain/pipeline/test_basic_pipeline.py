@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 import pathlib
@@ -13,6 +14,7 @@ from RAGchain.pipeline.basic import BasicIngestPipeline, BasicRunPipeline
 from RAGchain.preprocess.loader import FileLoader
 from RAGchain.retrieval import BM25Retrieval
 from RAGchain.schema.prompt import RAGchainChatPromptTemplate
+from RAGchain.utils.cache import InMemoryCache
 
 log = logging.getLogger(__name__)
 
@@ -96,6 +98,42 @@ def test_basic_pipeline(basic_run_pipeline):
         log.info(f"score: {score}")
 
 
+def test_basic_pipeline_stream(basic_run_pipeline):
+    query = "What is the purpose of KoPrivateGPT project?"
+    events = list(basic_run_pipeline.stream_passages_and_run(query, top_k=4))
+    assert events[0].stage == 'retrieval'
+    assert len(events[0].data.passages) == 4
+    assert all(event.stage == 'answer' for event in events[1:-1])
+    assert events[-1].stage == 'end'
+    assert events[-1].data == ''.join(event.data for event in events[1:-1])
+    assert bool(events[-1].data)
+    elapsed = [event.elapsed for event in events]
+    assert elapsed == sorted(elapsed)
+
+    async def astream():
+        return [event async for event in basic_run_pipeline.astream_passages_and_run(query, top_k=4)]
+
+    async_events = asyncio.run(astream())
+    assert async_events[0].stage == 'retrieval'
+    assert [passage.id for passage in async_events[0].data.passages] == \
+           [passage.id for passage in events[0].data.passages]
+    assert async_events[-1].stage == 'end'
+
+
+def test_basic_pipeline_answer_cache(basic_run_pipeline):
+    pipeline = BasicRunPipeline(retrieval=basic_run_pipeline.retrieval, llm=basic_run_pipeline.llm,
+                                answer_cache=InMemoryCache())
+    query = "What is the purpose of KoPrivateGPT project?"
+    config = {"configurable": {"retrieval_options": {"top_k": 4}}}
+    answer = pipeline.run.invoke(query, config=config)
+    assert pipeline.run.invoke(query.lower(), config=config) == answer
+    assert asyncio.run(pipeline.run.ainvoke(query, config=config)) == answer
+    assert pipeline.answer_cache.cache_info()['hits'] == 2
+    pipeline.retrieval.bump_index_generation()
+    pipeline.run.invoke(query, config=config)
+    assert pipeline.answer_cache.cache_info()['misses'] == 2
+
+
 def test_chat_history(basic_run_pipeline_chat_history):
     chat_history = ChatMessageHistory()
     chain_with_history = RunnableWithMessageHistory(
@@ -53,3 +53,13 @@ def test_rerank_run_pipeline(rerank_run_pipeline):
     logger.info(f"Answer: {result}")
     assert bool(result)
     assert isinstance(result, str)
+
+
+def test_rerank_run_pipeline_stream(rerank_run_pipeline):
+    events = list(rerank_run_pipeline.stream_passages_and_run("What is reranker role?", top_k=6))
+    assert [event.stage for event in events[:2]] == ['retrieval', 'rerank']
+    assert len(events[0].data.passages) == 6
+    assert len(events[1].data.passages) == 4
+    assert set(events[1].data.passages) <= set(events[0].data.passages)
+    assert events[-1].stage == 'end'
+    assert events[-1].data == ''.join(event.data for event in events[2:-1])
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import pathlib
+import pickle
+import re
+import zlib
+from typing import List
+
+import pytest
+from langchain.llms.fake import FakeListLLM
+from langchain.schema.embeddings import Embeddings
+
+from RAGchain.DB import PickleDB
+from RAGchain.pipeline import BasicRunPipeline, SemanticCache
+from RAGchain.retrieval import BM25Retrieval
+
+root_dir = pathlib.PurePath(os.path.dirname(os.path.realpath(__file__))).parent.parent
+bm25_path = os.path.join(root_dir, "resources", "bm25", "bm25_semantic_cache.pkl")
+pickle_path = os.path.join(root_dir, "resources", "pickle", "pickle_semantic_cache.pkl")
+with open(os.path.join(root_dir, "resources", "sample_passages.pkl"), 'rb') as r:
+    TEST_PASSAGES = pickle.load(r)
+
+
+class BagOfWordsEmbeddings(Embeddings):
+    """Deterministic embedding for tests. Similar questions share words, so they get similar vectors."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = [0.0] * 256
+        for word in re.findall(r'\w+', text.lower()):
+            vector[zlib.crc32(word.encode('utf-8')) % 256] += 1.0
+        return vector
+
+
+@pytest.fixture
+def semantic_cache():
+    db = PickleDB(save_path=pickle_path)
+    db.create_or_load()
+    db.save(TEST_PASSAGES)
+    retrieval = BM25Retrieval(save_path=bm25_path)
+    retrieval.ingest(TEST_PASSAGES)
+    llm = FakeListLLM(responses=[f"answer {i}" for i in range(10)])
+    pipeline = BasicRunPipeline(retrieval, llm)
+    yield SemanticCache(pipeline, BagOfWordsEmbeddings(), threshold=0.85, max_size=2)
+    if os.path.exists(bm25_path):
+        os.remove(bm25_path)
+    if os.path.exists(pickle_path):
+        os.remove(pickle_path)
+
+
+def test_semantic_cache(semantic_cache):
+    config = {"configurable": {"retrieval_options": {"top_k": 3}}}
+    result = semantic_cache.invoke("What is reranker role?", config=config)
+    assert result['answer'] == "answer 0"
+    assert len(result['passages']) == len(result['scores']) == 3
+    assert result['similarity'] is None
+
+    # paraphrased question gets the cached answer
+    cached = semantic_cache.invoke("What is the reranker role?", config=config)
+    assert cached['answer'] == "answer 0"
+    assert cached['passages'] == result['passages']
+    assert cached['similarity'] >= 0.85
+    cached = asyncio.run(semantic_cache.ainvoke("what is reranker role", config=config))
+    assert cached['answer'] == "answer 0"
+    # different question or different top_k is not cached
+    assert semantic_cache.invoke("How can I install this project?", config=config)['answer'] == "answer 1"
+    assert semantic_cache.invoke("What is reranker role?")['answer'] == "answer 2"
+    assert semantic_cache.cache_info() == {'hits': 2, 'misses': 3, 'size': 2}
+    # the least recently used question is evicted
+    assert semantic_cache.invoke("What is reranker role?", config=config)['answer'] == "answer 3"
+
+    # ingest invalidates cached answers
+    semantic_cache.pipeline.retrieval.ingest(TEST_PASSAGES[:1])
+    assert semantic_cache.cache_info()['size'] == 2
+    assert semantic_cache.invoke("What is reranker role?", config=config)['answer'] == "answer 4"
+    assert semantic_cache.cache_info()['size'] == 1
@@ -1,3 +1,4 @@
+import concurrent.futures
 import os
 import pathlib
 import pickle
@@ -7,7 +8,7 @@ from uuid import UUID
 
 import pytest
 
-from RAGchain.DB import PickleDB, MongoDB
+from RAGchain.DB import PickleDB, MongoDB, db_registry
 from RAGchain.retrieval import BM25Retrieval
 from RAGchain.schema import Passage
 
@@ -153,30 +154,62 @@ def just_bm25_retrieval():
 
 def test_duplicate_check(just_bm25_retrieval):
     assert just_bm25_retrieval.duplicate_check(TEST_DB_ORIGIN) == TEST_DB_ORIGIN_RESULT
+    result_with_none = just_bm25_retrieval.duplicate_check([None] + TEST_DB_ORIGIN)
+    assert result_with_none == {key: [index + 1 for index in value] for key, value in TEST_DB_ORIGIN_RESULT.items()}
 
 
 def test_is_created(just_bm25_retrieval):
     """
     For 'is_created'
-    1. when db_instance_list is empty, does the list fit a db instance well, and does it return that db well?
-    2. if db_instance_list is not empty and db_origin already exists, does it return that db well?
-    3. if db_instance_list is not empty and db_origin does not exist, does the list fit the db instance well? Does it return the corresponding db well?
+    1. when the db origin is not registered, does it create a db instance and register it?
+    2. if the db origin is already registered, does it return that db well, even from other retrieval?
+    3. if the db origin is not registered, does it create another db instance?
+    4. when it is called from many threads at once, does it create only one db instance?
     """
-    # 0. reset db_instance_list for test
-    just_bm25_retrieval.db_instance_list = []
-    # 1. If 'db_instance_list' is empty
+    # 0. reset db registry for test
+    db_registry.close()
+    # 1. If the db origin is not registered
     first_instance = just_bm25_retrieval.is_created(db_type=TEST_DB_ORIGIN[0]['db_type'],
                                                     db_path=TEST_DB_ORIGIN[0]['db_path'])
-    assert first_instance == just_bm25_retrieval.db_instance_list[0]
-    # 2. db_instance_list is not empty, db_origin already exists
-    second_instance = just_bm25_retrieval.is_created(db_type=TEST_DB_ORIGIN[0]['db_type'],
-                                                     db_path=TEST_DB_ORIGIN[0]['db_path'])
-    assert second_instance == just_bm25_retrieval.db_instance_list[0]
-    assert second_instance == first_instance
-    # 3. db_instance_list is not empty, db_origin does not already exist
+    assert first_instance.get_db_origin() in db_registry
+    assert len(db_registry) == 1
+    # 2. db origin already exists
+    second_instance = just_bm25_retrieval.is_created(db_type=TEST_DB_ORIGIN[3]['db_type'],
+                                                     db_path=TEST_DB_ORIGIN[3]['db_path'])
+    assert second_instance is first_instance
+    other_retrieval = BM25Retrieval(save_path=os.path.join(root_dir, "resources", "bm25", "other_retrieval.pkl"))
+    assert other_retrieval.is_created(db_type=TEST_DB_ORIGIN[0]['db_type'],
+                                      db_path=TEST_DB_ORIGIN[0]['db_path']) is first_instance
+    # 3. db origin does not already exist
     third_instance = just_bm25_retrieval.is_created(db_type=TEST_DB_ORIGIN[1]['db_type'],
                                                     db_path=TEST_DB_ORIGIN[1]['db_path'])
-    assert third_instance == just_bm25_retrieval.db_instance_list[1]
+    assert third_instance is not first_instance
+    assert len(db_registry) == 2
+    # 4. concurrent first use
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        instances = list(executor.map(lambda _: just_bm25_retrieval.is_created(
+            db_type=TEST_DB_ORIGIN[2]['db_type'], db_path=TEST_DB_ORIGIN[2]['db_path']), range(32)))
+    assert all(instance is instances[0] for instance in instances)
+    assert len(db_registry) == 3
+    db_registry.close()
+    assert len(db_registry) == 0
+
+
+def test_db_registry_register():
+    db_registry.close()
+    save_path = os.path.join(root_dir, "resources", "pickle", "test_db_registry_register.pkl")
+    first_db, second_db = PickleDB(save_path=save_path), PickleDB(save_path=save_path)
+    closed = []
+    first_db.close = lambda: closed.append(first_db)
+    db_registry.register(first_db)
+    db_registry.register(first_db)
+    assert closed == []
+    # the replaced instance is closed
+    db_registry.register(second_db)
+    assert closed == [first_db]
+    assert db_registry.get(second_db.get_db_origin(), lambda db_type, db_path: None) is second_db
+    db_registry.close()
+    assert len(db_registry) == 0
 
 
 TEST_DB_ORIGIN_RESULT_2 = {(('db_type', 'mongo_db'),
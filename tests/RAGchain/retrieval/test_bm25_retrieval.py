@@ -1,10 +1,14 @@
+import asyncio
+import itertools
 import os
+import shutil
 from datetime import datetime
 
 import pytest
 
 import test_base_retrieval
 from RAGchain.retrieval import BM25Retrieval
+from RAGchain.utils.cache import InMemoryCache
 
 
 @pytest.fixture
@@ -23,6 +27,20 @@ def bm25_retrieval():
         os.remove(pickle_path)
 
 
+@pytest.fixture
+def bm25_dir_retrieval():
+    bm25_path = os.path.join(test_base_retrieval.root_dir, "resources", "bm25", "test_bm25_dir_retrieval")
+    pickle_path = os.path.join(test_base_retrieval.root_dir, "resources", "pickle", "test_bm25_dir_retrieval.pkl")
+    bm25_retrieval = BM25Retrieval(save_path=bm25_path)
+    test_base_retrieval.ready_pickle_db(pickle_path)
+    yield bm25_retrieval
+    # teardown
+    if os.path.exists(bm25_path):
+        shutil.rmtree(bm25_path)
+    if os.path.exists(pickle_path):
+        os.remove(pickle_path)
+
+
 def test_bm25_retrieval(bm25_retrieval):
     bm25_retrieval.ingest(test_base_retrieval.TEST_PASSAGES)
     top_k = 6
@@ -49,6 +67,54 @@ def test_bm25_retrieval(bm25_retrieval):
     assert 'test_id_3_search' == retrieved_passages[0].id
 
 
+def test_bm25_retrieval_filter_pushdown(bm25_retrieval):
+    bm25_retrieval.ingest(test_base_retrieval.TEST_PASSAGES + test_base_retrieval.SEARCH_TEST_PASSAGES)
+    bm25_retrieval.allow_list_cache = InMemoryCache()
+    ids, scores = bm25_retrieval.retrieve_id_with_scores_allowed('This is test number 3',
+                                                                 {'test_id_1_search', 'test_id_4_search'}, top_k=5)
+    assert ids == ['test_id_4_search', 'test_id_1_search']
+    assert scores == sorted(scores, reverse=True)
+
+    # only matching passages are scored, so exactly top_k passages are retrieved at one pass
+    retrieved_passages = bm25_retrieval.retrieve_with_filter(query='This is test number 3', top_k=1,
+                                                             filepath=['./test/second_file.txt'], max_trial=1)
+    assert [passage.id for passage in retrieved_passages] == ['test_id_3_search']
+    retrieved_passages = bm25_retrieval.retrieve_with_filter(query='This is test number 1', top_k=2,
+                                                             filepath=['./test/second_file.txt'])
+    assert {passage.id for passage in retrieved_passages} == {'test_id_2_search', 'test_id_3_search'}
+    assert bm25_retrieval.allow_list_cache.cache_info()['hits'] == 1
+
+    bm25_retrieval.delete(['test_id_3_search'])
+    retrieved_passages = bm25_retrieval.retrieve_with_filter(query='This is test number 3', top_k=2,
+                                                             filepath=['./test/second_file.txt'])
+    assert [passage.id for passage in retrieved_passages] == ['test_id_2_search']
+
+    # without allow_list_cache, or with too many passages, candidates are filtered without listing every passage
+    for allow_list_cache, allow_list_max_size in [(None, 10000), (InMemoryCache(), 1)]:
+        bm25_retrieval.allow_list_cache = allow_list_cache
+        bm25_retrieval.allow_list_max_size = allow_list_max_size
+        retrieved_passages = bm25_retrieval.retrieve_with_filter(query='This is test number 1', top_k=2,
+                                                                 filepath=['./test/second_file.txt'])
+        assert [passage.id for passage in retrieved_passages] == ['test_id_2_search']
+    # the retrieval with too many passages is not listed again for the same filters
+    bm25_retrieval.indexed_ids = None
+    assert bm25_retrieval.retrieve_with_filter(query='This is test number 1', top_k=2,
+                                               filepath=['./test/second_file.txt']) == retrieved_passages
+
+
+def test_bm25_retrieval_cursor(bm25_retrieval):
+    bm25_retrieval.ingest(test_base_retrieval.TEST_PASSAGES)
+    query = 'What is visconde structure?'
+    cursor = bm25_retrieval.iter_ids_with_scores(query, page_size=4)
+    first_page = list(itertools.islice(cursor, 4))
+    second_page = list(itertools.islice(cursor, 4))
+    ids, scores = bm25_retrieval.retrieve_id_with_scores(query, top_k=8)
+    assert [score for _, score in first_page + second_page] == pytest.approx(scores)
+    assert set(_id for _id, _ in first_page + second_page) == set(ids)
+    rest = list(cursor)
+    assert len(set(_id for _id, _ in first_page + second_page + rest)) == len(first_page + second_page + rest)
+
+
 def test_bm25_retrieval_delete(bm25_retrieval):
     bm25_retrieval.ingest(test_base_retrieval.SEARCH_TEST_PASSAGES)
     bm25_retrieval.delete(['test_id_4_search', 'test_id_3_search'])
@@ -56,3 +122,146 @@ def test_bm25_retrieval_delete(bm25_retrieval):
     assert len(retrieved_passages) == 2
     assert 'test_id_1_search' in [passage.id for passage in retrieved_passages]
     assert 'test_id_2_search' in [passage.id for passage in retrieved_passages]
+
+
+def test_bm25_retrieval_maxscore(bm25_retrieval):
+    bm25_retrieval.ingest(test_base_retrieval.TEST_PASSAGES)
+    top_k = 6
+    ids, scores = bm25_retrieval.retrieve_id_with_scores(query='What is visconde structure?', top_k=top_k)
+    bm25_retrieval.search_method = 'maxscore'
+    maxscore_ids, maxscore_scores = bm25_retrieval.retrieve_id_with_scores(query='What is visconde structure?',
+                                                                           top_k=top_k)
+    assert maxscore_scores == pytest.approx(scores)
+    test_base_retrieval.validate_ids(maxscore_ids, top_k)
+
+    result = bm25_retrieval.invoke('What is visconde structure?',
+                                   config={"configurable": {"retrieval_options": {"top_k": top_k}}})
+    test_base_retrieval.validate_passages(result.passages, top_k)
+    assert 0 < result.metadata['docs_scored'] <= len(test_base_retrieval.TEST_PASSAGES)
+
+
+def test_bm25_dir_retrieval(bm25_dir_retrieval):
+    bm25_dir_retrieval.ingest(test_base_retrieval.TEST_PASSAGES)
+    bm25_dir_retrieval.ingest(test_base_retrieval.SEARCH_TEST_PASSAGES)
+    top_k = 6
+    ids, scores = bm25_dir_retrieval.retrieve_id_with_scores(query='What is visconde structure?', top_k=top_k)
+    test_base_retrieval.validate_ids(ids, top_k)
+
+    loaded_retrieval = BM25Retrieval(save_path=bm25_dir_retrieval.save_path)
+    assert len(loaded_retrieval.index) == len(test_base_retrieval.TEST_PASSAGES) + len(
+        test_base_retrieval.SEARCH_TEST_PASSAGES)
+    loaded_ids, loaded_scores = loaded_retrieval.retrieve_id_with_scores(query='What is visconde structure?',
+                                                                         top_k=top_k)
+    assert loaded_ids == ids
+    assert loaded_scores == pytest.approx(scores)
+
+
+def test_bm25_dir_retrieval_delete(bm25_dir_retrieval):
+    bm25_dir_retrieval.background_compaction = True
+    bm25_dir_retrieval.ingest(test_base_retrieval.SEARCH_TEST_PASSAGES)
+    bm25_dir_retrieval.delete(['test_id_4_search', 'test_id_3_search'])
+    bm25_dir_retrieval.wait_compaction()
+    assert bm25_dir_retrieval.index.deleted_ratio == 0.0
+
+    loaded_retrieval = BM25Retrieval(save_path=bm25_dir_retrieval.save_path)
+    retrieved_passages = loaded_retrieval.retrieve(query='What is visconde structure?', top_k=4)
+    assert len(retrieved_passages) == 2
+    assert 'test_id_1_search' in [passage.id for passage in retrieved_passages]
+    assert 'test_id_2_search' in [passage.id for passage in retrieved_passages]
+
+
+def test_bm25_retrieval_batch_ingest(bm25_retrieval, bm25_dir_retrieval):
+    bm25_retrieval.ingest(test_base_retrieval.TEST_PASSAGES)
+    bm25_dir_retrieval.batch_size = 7
+    bm25_dir_retrieval.ingest(iter(test_base_retrieval.TEST_PASSAGES))
+    assert len(bm25_dir_retrieval.index) == len(test_base_retrieval.TEST_PASSAGES)
+    assert len(bm25_dir_retrieval.index.segments) <= bm25_dir_retrieval.index.max_segments
+    top_k = 6
+    ids, scores = bm25_retrieval.retrieve_id_with_scores(query='What is visconde structure?', top_k=top_k)
+    batch_ids, batch_scores = bm25_dir_retrieval.retrieve_id_with_scores(query='What is visconde structure?',
+                                                                         top_k=top_k)
+    assert batch_scores == pytest.approx(scores)
+
+
+def test_bm25_retrieval_batch(bm25_retrieval):
+    bm25_retrieval.ingest(test_base_retrieval.TEST_PASSAGES)
+    top_k = 4
+    queries = ['What is visconde structure?', 'What is the purpose of this framework?']
+    batch_ids, batch_scores = bm25_retrieval.retrieve_id_with_scores_batch(queries, top_k=top_k)
+    assert len(batch_ids) == len(batch_scores) == len(queries)
+    for query, ids, scores in zip(queries, batch_ids, batch_scores):
+        expected_ids, expected_scores = bm25_retrieval.retrieve_id_with_scores(query, top_k=top_k)
+        assert scores == pytest.approx(expected_scores)
+        test_base_retrieval.validate_ids(ids, top_k)
+
+    results = bm25_retrieval.batch(queries, config={"configurable": {"retrieval_options": {"top_k": top_k}}})
+    for query, result, ids, scores in zip(queries, results, batch_ids, batch_scores):
+        test_base_retrieval.validate_passages(result.passages, top_k)
+        assert [passage.id for passage in result.passages] == ids
+        assert result.scores == pytest.approx(scores)
+        _, _, metadata = bm25_retrieval.retrieve_id_with_scores_and_metadata(query, top_k=top_k)
+        assert result.metadata == metadata
+
+
+def test_bm25_retrieval_async(bm25_retrieval):
+    bm25_retrieval.ingest(test_base_retrieval.TEST_PASSAGES)
+    top_k = 4
+    query = 'What is visconde structure?'
+    ids, scores = asyncio.run(bm25_retrieval.aretrieve_id_with_scores(query, top_k=top_k))
+    assert (ids, scores) == bm25_retrieval.retrieve_id_with_scores(query, top_k=top_k)
+    passages = asyncio.run(bm25_retrieval.afetch_data(ids))
+    assert [passage.id for passage in passages] == ids
+
+    config = {"configurable": {"retrieval_options": {"top_k": top_k}}}
+    result = asyncio.run(bm25_retrieval.ainvoke(query, config=config))
+    assert result == bm25_retrieval.invoke(query, config=config)
+    results = asyncio.run(bm25_retrieval.abatch([query, 'What is the purpose of this framework?'], config=config))
+    for result in results:
+        test_base_retrieval.validate_passages(result.passages, top_k)
+
+
+def test_bm25_retrieval_result_cache(bm25_retrieval):
+    bm25_retrieval.ingest(test_base_retrieval.TEST_PASSAGES[:4])
+    bm25_retrieval.result_cache = InMemoryCache()
+    config = {"configurable": {"retrieval_options": {"top_k": 4}}}
+    result = bm25_retrieval.invoke('What is visconde structure?', config=config)
+    cached = bm25_retrieval.invoke('  what is Visconde structure? ', config=config)
+    assert cached.passages == result.passages
+    assert cached.scores == result.scores
+    assert bm25_retrieval.result_cache.cache_info()['hits'] == 1
+    # different retrieval options are not shared
+    bm25_retrieval.invoke('What is visconde structure?', config={"configurable": {"retrieval_options": {"top_k": 2}}})
+    assert bm25_retrieval.result_cache.cache_info()['misses'] == 2
+    # modifying the returned result does not change the cached result
+    cached.passages.clear()
+    assert bm25_retrieval.invoke('What is visconde structure?', config=config).passages == result.passages
+
+    # ingest invalidates cached results
+    generation = bm25_retrieval.index_generation
+    bm25_retrieval.ingest(test_base_retrieval.TEST_PASSAGES[4:])
+    assert bm25_retrieval.index_generation > generation
+    hits = bm25_retrieval.result_cache.cache_info()['hits']
+    new_result = bm25_retrieval.invoke('What is visconde structure?', config=config)
+    assert bm25_retrieval.result_cache.cache_info()['hits'] == hits
+    assert new_result.passages == bm25_retrieval.invoke('What is visconde structure?', config=config).passages
+
+    results = bm25_retrieval.batch(['What is visconde structure?', 'What is the purpose of this framework?'],
+                                   config=config)
+    assert results[0].passages == new_result.passages
+    test_base_retrieval.validate_passages(results[1].passages, 4)
+    bm25_retrieval.result_cache = None
+
+
+def test_bm25_retrieval_cache_key_persisted(bm25_retrieval, bm25_dir_retrieval):
+    query = 'What is visconde structure?'
+    options = {"top_k": 4}
+    for retrieval in [bm25_retrieval, bm25_dir_retrieval]:
+        retrieval.ingest(test_base_retrieval.TEST_PASSAGES[:4])
+        # a retrieval loaded from the same save_path, like after restart, uses the same cache key
+        reloaded = BM25Retrieval(save_path=retrieval.save_path)
+        assert reloaded.index_generation == retrieval.index_generation
+        assert reloaded.result_cache_key(query, options) == retrieval.result_cache_key(query, options)
+        reloaded.ingest(test_base_retrieval.TEST_PASSAGES[4:])
+        assert BM25Retrieval(save_path=retrieval.save_path).index_generation > retrieval.index_generation
+    # retrievals of different indexes are not shared
+    assert bm25_retrieval.result_cache_key(query, options) != bm25_dir_retrieval.result_cache_key(query, options)
@@ -1,6 +1,8 @@
+import asyncio
 import logging
 import os
 import shutil
+from uuid import UUID, uuid4
 
 import chromadb
 import pytest
@@ -13,6 +15,8 @@ from RAGchain.utils.embed import EmbeddingFactory
 
 logger = logging.getLogger(__file__)
 
+TEST_UUIDS = [uuid4() for _ in range(4)]
+
 
 @pytest.fixture(scope='module')
 def hybrid_retrieval():
@@ -104,3 +108,64 @@ def test_hybrid_retrieval_delete(hybrid_retrieval_for_delete):
     assert len(retrieved_passages) == 2
     assert 'test_id_1_search' in [passage.id for passage in retrieved_passages]
     assert 'test_id_2_search' in [passage.id for passage in retrieved_passages]
+
+
+def test_hybrid_retrieval_combmnz(hybrid_retrieval):
+    # a fresh instance, so the module-scoped fixture keeps its method and normalization
+    combmnz_retrieval = HybridRetrieval(retrievals=hybrid_retrieval.retrievals, weights=hybrid_retrieval.weights,
+                                       p=hybrid_retrieval.p, method='combmnz', normalization='z')
+    test_hybrid_retrieval(combmnz_retrieval)
+
+
+def test_hybrid_fusion(hybrid_retrieval):
+    results = [([TEST_UUIDS[0], TEST_UUIDS[1], TEST_UUIDS[2]], [3.0, 2.0, 1.0]),
+               ([TEST_UUIDS[1], TEST_UUIDS[3], TEST_UUIDS[0]], [0.9, 0.5, 0.1])]
+    fusion = HybridRetrieval(retrievals=hybrid_retrieval.retrievals, weights=[0.3, 0.7], method='cc')
+    ids, scores = fusion.fuse(results, top_k=5)
+    assert ids == [TEST_UUIDS[1], TEST_UUIDS[0]]
+    assert scores == pytest.approx([0.7, 0.3])
+
+    fusion.method = 'rrf'
+    ids, scores = fusion.fuse(results, top_k=2)
+    assert ids == [TEST_UUIDS[1], TEST_UUIDS[0]]
+    assert scores == pytest.approx([1 / 62 + 1 / 61, 1 / 61 + 1 / 63])
+
+    fusion.method = 'combsum'
+    ids, scores = fusion.fuse(results, top_k=5)
+    assert ids == [TEST_UUIDS[1], TEST_UUIDS[3], TEST_UUIDS[0], TEST_UUIDS[2]]
+    assert scores == pytest.approx([0.85, 0.35, 0.3, 0.0])
+
+    fusion.method = 'combmnz'
+    ids, scores = fusion.fuse(results, top_k=3)
+    assert ids == [TEST_UUIDS[1], TEST_UUIDS[0], TEST_UUIDS[3]]
+    assert scores == pytest.approx([1.7, 0.6, 0.35])
+    assert all(isinstance(_id, UUID) for _id in ids)
+
+    mixed_results = [results[0], ([str(_id) for _id in results[1][0]], results[1][1])]
+    fusion.method = 'cc'
+    ids, scores = fusion.fuse(mixed_results, top_k=5)
+    assert ids == [TEST_UUIDS[1], TEST_UUIDS[0]]
+    assert scores == pytest.approx([0.7, 0.3])
+
+
+def test_hybrid_retrieval_adaptive(hybrid_retrieval):
+    hybrid_retrieval.method = 'rrf'
+    top_k = 4
+    ids, scores = hybrid_retrieval.retrieve_id_with_scores(query='What is visconde structure?', top_k=top_k)
+    hybrid_retrieval.adaptive = True
+    config = {"configurable": {"retrieval_options": {"top_k": top_k}}}
+    result = hybrid_retrieval.invoke('What is visconde structure?', config=config)
+    batch_results = hybrid_retrieval.batch(['What is visconde structure?'], config=config)
+    hybrid_retrieval.adaptive = False
+    assert set(passage.id for passage in result.passages) == set(ids)
+    assert result.scores == pytest.approx(scores)
+    assert top_k <= result.metadata['p'] <= hybrid_retrieval.p
+    assert batch_results[0].metadata == result.metadata
+
+
+def test_hybrid_retrieval_async(hybrid_retrieval):
+    hybrid_retrieval.method = 'rrf'
+    config = {"configurable": {"retrieval_options": {"top_k": 4}}}
+    result = asyncio.run(hybrid_retrieval.ainvoke('What is visconde structure?', config=config))
+    assert result == hybrid_retrieval.invoke('What is visconde structure?', config=config)
+    test_base_retrieval.validate_passages(result.passages, 4)
@@ -1,10 +1,15 @@
+import asyncio
+import itertools
 import os
+import time
 
 import pytest
 from langchain.llms.openai import OpenAI
+from langchain_core.language_models import FakeListLLM
 
 import test_base_retrieval
-from RAGchain.retrieval import HyDERetrieval, BM25Retrieval
+from RAGchain.retrieval import HyDERetrieval, BM25Retrieval, HybridRetrieval
+from RAGchain.utils.cache import InMemoryCache
 
 
 @pytest.fixture
@@ -48,3 +53,118 @@ def test_hyde_retrieval_delete(hyde_retrieval):
     assert len(retrieved_passages) == 2
     assert 'test_id_1_search' in [passage.id for passage in retrieved_passages]
     assert 'test_id_2_search' in [passage.id for passage in retrieved_passages]
+
+
+class SlowFakeListLLM(FakeListLLM):
+    def _call(self, *args, **kwargs) -> str:
+        time.sleep(self.sleep or 0)
+        return super()._call(*args, **kwargs)
+
+
+@pytest.fixture
+def fake_hyde_retrieval():
+    bm25_path = os.path.join(test_base_retrieval.root_dir, "resources", "bm25", "test_fake_hyde_retrieval.pkl")
+    pickle_path = os.path.join(test_base_retrieval.root_dir, "resources", "pickle", "test_fake_hyde_retrieval.pkl")
+    if not os.path.exists(os.path.dirname(bm25_path)):
+        os.makedirs(os.path.dirname(bm25_path))
+    if not os.path.exists(os.path.dirname(pickle_path)):
+        os.makedirs(os.path.dirname(pickle_path))
+
+    test_base_retrieval.ready_pickle_db(pickle_path)
+    bm25_retrieval = BM25Retrieval(save_path=bm25_path)
+    bm25_retrieval.ingest(test_base_retrieval.TEST_PASSAGES)
+    yield bm25_retrieval
+    if os.path.exists(pickle_path):
+        os.remove(pickle_path)
+    if os.path.exists(bm25_path):
+        os.remove(bm25_path)
+
+
+def test_hyde_retrieval_hypothesis_cache(fake_hyde_retrieval):
+    llm = FakeListLLM(responses=['Visconde is a framework with three steps: decompose, retrieve and aggregate.'])
+    cache = InMemoryCache()
+    hyde_retrieval = HyDERetrieval(fake_hyde_retrieval, llm, hypothesis_cache=cache)
+    ids, scores, metadata = hyde_retrieval.retrieve_id_with_scores_and_metadata('What is visconde structure?', top_k=4)
+    test_base_retrieval.validate_ids(ids, 4)
+    assert metadata['hypothesis_cache_hit'] is False
+    assert metadata['hypotheses'] == [llm.responses[0]]
+    cached_ids, _, metadata = hyde_retrieval.retrieve_id_with_scores_and_metadata('what is  Visconde structure?',
+                                                                                  top_k=4)
+    assert metadata['hypothesis_cache_hit'] is True
+    assert cached_ids == ids
+    assert cache.cache_info()['hits'] == 1
+    other_prompt = HyDERetrieval(fake_hyde_retrieval, llm, system_prompt='Write a short passage',
+                                 hypothesis_cache=cache)
+    assert other_prompt.hypothesis_cache_key('What is visconde structure?') != \
+           hyde_retrieval.hypothesis_cache_key('What is visconde structure?')
+
+
+def test_hyde_retrieval_multi_sample(fake_hyde_retrieval):
+    responses = ['Visconde decomposes the question.', 'Visconde retrieves passages with the decomposed questions.',
+                 'Visconde aggregates the answers.']
+    hyde_retrieval = HyDERetrieval(fake_hyde_retrieval, FakeListLLM(responses=responses), num_samples=3)
+    ids, scores, metadata = hyde_retrieval.retrieve_id_with_scores_and_metadata('What is visconde structure?', top_k=4)
+    test_base_retrieval.validate_ids(ids, 4)
+    assert sorted(metadata['hypotheses']) == sorted(responses)
+    assert scores == sorted(scores, reverse=True)
+    batch_ids, batch_scores = hyde_retrieval.retrieve_id_with_scores_batch(['What is visconde structure?'] * 2,
+                                                                           top_k=4)
+    assert len(batch_ids) == 2
+    assert all(len(query_ids) == 4 for query_ids in batch_ids)
+    _, _, metadata_list = hyde_retrieval.retrieve_id_with_scores_and_metadata_batch(['What is visconde structure?'],
+                                                                                    top_k=4)
+    assert sorted(metadata_list[0]['hypotheses']) == sorted(responses)
+    assert metadata_list[0]['hyde_fallback'] is False
+    cursor_ids = [_id for _id, _ in itertools.islice(hyde_retrieval.iter_ids_with_scores(
+        'What is visconde structure?', page_size=4), 6)]
+    assert cursor_ids[:4] == ids
+    assert len(set(cursor_ids)) == len(cursor_ids)
+    with pytest.raises(ValueError):
+        HyDERetrieval(fake_hyde_retrieval, FakeListLLM(responses=responses), num_samples=0)
+    with pytest.raises(ValueError):
+        HyDERetrieval(fake_hyde_retrieval, FakeListLLM(responses=responses), deadline=1.0)
+
+
+def test_hyde_retrieval_speculative(fake_hyde_retrieval):
+    query = 'What is visconde structure?'
+    llm = FakeListLLM(responses=['Visconde is a framework with three steps: decompose, retrieve and aggregate.'])
+    hyde_retrieval = HyDERetrieval(fake_hyde_retrieval, llm, speculative=True)
+    ids, scores, metadata = hyde_retrieval.retrieve_id_with_scores_and_metadata(query, top_k=4)
+    test_base_retrieval.validate_ids(ids, 4)
+    assert metadata['hyde_fallback'] is False
+    raw_ids, _ = fake_hyde_retrieval.retrieve_id_with_scores(query, top_k=4)
+    hyde_ids, _ = fake_hyde_retrieval.retrieve_id_with_scores(llm.responses[0], top_k=4)
+    assert set(ids) <= set(raw_ids) | set(hyde_ids)
+    async_ids, _, _ = asyncio.run(hyde_retrieval.aretrieve_id_with_scores_and_metadata(query, top_k=4))
+    assert async_ids == ids
+
+    cache = InMemoryCache()
+    slow_llm = SlowFakeListLLM(responses=llm.responses, sleep=0.5)
+    slow_retrieval = HyDERetrieval(fake_hyde_retrieval, slow_llm, speculative=True, deadline=0.1,
+                                   hypothesis_cache=cache)
+    fallback_ids, _, metadata = slow_retrieval.retrieve_id_with_scores_and_metadata(query, top_k=4)
+    assert metadata['hyde_fallback'] is True
+    assert fallback_ids == raw_ids
+    # the generation finishes in background and fills the cache
+    time.sleep(1.0)
+    cached_ids, _, metadata = slow_retrieval.retrieve_id_with_scores_and_metadata(query, top_k=4)
+    assert metadata['hyde_fallback'] is False
+    assert metadata['hypothesis_cache_hit'] is True
+    assert cached_ids == ids
+
+
+def test_hyde_retrieval_speculative_in_hybrid(fake_hyde_retrieval):
+    query = 'What is visconde structure?'
+    cache = InMemoryCache()
+    slow_llm = SlowFakeListLLM(responses=['Visconde is a framework with three steps.'], sleep=1.0)
+    hyde_retrieval = HyDERetrieval(fake_hyde_retrieval, slow_llm, speculative=True, deadline=0.1,
+                                   hypothesis_cache=cache)
+    # retrievals of HybridRetrieval run at worker threads of the shared executor
+    hybrid_retrieval = HybridRetrieval([fake_hyde_retrieval, hyde_retrieval], method='rrf')
+    start = time.perf_counter()
+    ids, _ = hybrid_retrieval.retrieve_id_with_scores(query, top_k=4)
+    # the deadline is kept, so raw query results are used without waiting for the generation
+    assert time.perf_counter() - start < slow_llm.sleep
+    assert ids == fake_hyde_retrieval.retrieve_id(query, top_k=4)
+    time.sleep(1.5)
+    assert cache.get(hyde_retrieval.hypothesis_cache_key(query)) == slow_llm.responses
@@ -10,7 +10,7 @@ import test_base_retrieval
 from RAGchain.DB import PickleDB
 from RAGchain.retrieval import VectorDBRetrieval
 from RAGchain.utils.embed import EmbeddingFactory
-from RAGchain.utils.vectorstore import ChromaSlim
+from RAGchain.utils.vectorstore import ChromaSlim, NumpySlim
 
 
 @pytest.fixture(scope='module')
@@ -84,6 +84,23 @@ def slim_vectordb_retrieval():
         shutil.rmtree(chroma_path)
 
 
+@pytest.fixture(scope='module')
+def numpy_slim_vectordb_retrieval():
+    pickle_path = os.path.join(test_base_retrieval.root_dir, "resources", "pickle",
+                               "test_numpy_slim_vectordb_retrieval.pkl")
+    if not os.path.exists(os.path.dirname(pickle_path)):
+        os.makedirs(os.path.dirname(pickle_path))
+    test_base_retrieval.ready_pickle_db(pickle_path)
+    numpy_slim_path = os.path.join(test_base_retrieval.root_dir, "resources", "test_numpy_slim_vectordb_retrieval")
+    retrieval = VectorDBRetrieval(vectordb=NumpySlim(EmbeddingFactory('openai').get(), save_path=numpy_slim_path))
+    yield retrieval
+    # teardown
+    if os.path.exists(pickle_path):
+        os.remove(pickle_path)
+    if os.path.exists(numpy_slim_path):
+        shutil.rmtree(numpy_slim_path)
+
+
 def test_vectordb_retrieval(vectordb_retrieval):
     vectordb_retrieval_test(vectordb_retrieval)
 
@@ -92,6 +109,10 @@ def test_vectordb_retrieval_slim(slim_vectordb_retrieval):
     vectordb_retrieval_test(slim_vectordb_retrieval)
 
 
+def test_vectordb_retrieval_numpy_slim(numpy_slim_vectordb_retrieval):
+    vectordb_retrieval_test(numpy_slim_vectordb_retrieval)
+
+
 def vectordb_retrieval_test(retrieval: VectorDBRetrieval):
     retrieval.ingest(test_base_retrieval.TEST_PASSAGES)
     top_k = 6
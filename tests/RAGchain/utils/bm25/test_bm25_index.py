@@ -0,0 +1,176 @@
+import os
+import pathlib
+import random
+import shutil
+
+import numpy as np
+import pytest
+from rank_bm25 import BM25Okapi
+
+from RAGchain.utils.bm25 import BM25Index
+
+rng = random.Random(42)
+TEST_TOKENS = [[rng.randrange(0, 50) for _ in range(rng.randrange(1, 30))] for _ in range(100)]
+TEST_IDS = [f'test_id_{i}' for i in range(len(TEST_TOKENS))]
+TEST_QUERIES = [[rng.randrange(0, 60) for _ in range(rng.randrange(1, 6))] for _ in range(10)]
+
+
+@pytest.fixture
+def bm25_index_dir():
+    root_dir = pathlib.PurePath(os.path.dirname(os.path.realpath(__file__))).parent.parent.parent
+    index_dir = os.path.join(root_dir, "resources", "bm25", "test_bm25_index")
+    yield index_dir
+    if os.path.exists(index_dir):
+        shutil.rmtree(index_dir)
+
+
+@pytest.fixture
+def bm25_index():
+    index = BM25Index(max_segments=2)
+    for start in range(0, len(TEST_TOKENS), 30):
+        index.add(TEST_IDS[start:start + 30], TEST_TOKENS[start:start + 30])
+    yield index
+
+
+def assert_same_scores(index: BM25Index, ids, tokens, query):
+    expected = BM25Okapi(tokens).get_scores(query)
+    passage_ids, scores = index.get_scores(query)
+    result = dict(zip(passage_ids, scores))
+    for _id, token, score in zip(ids, tokens, expected):
+        if set(token) & set(query):
+            assert result[_id] == pytest.approx(score)
+        else:
+            assert _id not in result
+
+
+def test_bm25_index_scores(bm25_index):
+    assert len(bm25_index) == len(TEST_TOKENS)
+    assert len(bm25_index.segments) <= 2
+    for query in TEST_QUERIES:
+        assert_same_scores(bm25_index, TEST_IDS, TEST_TOKENS, query)
+
+
+def test_bm25_index_top_k(bm25_index):
+    for query in TEST_QUERIES:
+        ids, scores = bm25_index.top_k(query, 5)
+        assert len(ids) == len(scores) <= 5
+        assert scores == sorted(scores, reverse=True)
+
+
+def test_bm25_index_allowed_ids(bm25_index):
+    allowed_ids = set(TEST_IDS[::3])
+    for query in TEST_QUERIES:
+        passage_ids, scores = bm25_index.get_scores(query)
+        expected = {_id: score for _id, score in zip(passage_ids, scores) if _id in allowed_ids}
+        ids, allowed_scores, docs_scored = bm25_index.search(query, 5, allowed_ids=allowed_ids)
+        assert set(ids) <= allowed_ids
+        assert docs_scored == len(expected)
+        assert allowed_scores == pytest.approx(sorted(expected.values(), reverse=True)[:5])
+        cursor_ids = [_id for _id, _ in bm25_index.iter_search(query, page_size=2, allowed_ids=allowed_ids)]
+        assert sorted(cursor_ids) == sorted(expected.keys())
+
+
+def test_bm25_index_delete(bm25_index):
+    delete_ids = TEST_IDS[10:40]
+    assert bm25_index.delete(delete_ids + ['not_exist_id']) == ['not_exist_id']
+    assert len(bm25_index) == len(TEST_TOKENS) - len(delete_ids)
+    for query in TEST_QUERIES:
+        passage_ids, _ = bm25_index.get_scores(query)
+        assert not set(passage_ids) & set(delete_ids)
+        ids, _, _ = bm25_index.search(query, 10, method='maxscore')
+        assert not set(ids) & set(delete_ids)
+
+    # statistics are updated after compaction
+    assert bm25_index.needs_compaction(0.2)
+    bm25_index.compact()
+    assert bm25_index.deleted_ratio == 0.0
+    left_ids = TEST_IDS[:10] + TEST_IDS[40:]
+    left_tokens = TEST_TOKENS[:10] + TEST_TOKENS[40:]
+    for query in TEST_QUERIES:
+        assert_same_scores(bm25_index, left_ids, left_tokens, query)
+
+
+def test_bm25_index_delete_while_compaction(bm25_index):
+    bm25_index.delete(TEST_IDS[:20])
+    plan = bm25_index.prepare_compaction()
+    bm25_index.delete(TEST_IDS[20:25])
+    bm25_index.apply_compaction(plan)
+    assert len(bm25_index) == len(TEST_TOKENS) - 25
+    assert bm25_index.delete(TEST_IDS[20:25]) == TEST_IDS[20:25]
+    bm25_index.compact()
+    for query in TEST_QUERIES:
+        assert_same_scores(bm25_index, TEST_IDS[25:], TEST_TOKENS[25:], query)
+
+
+def test_bm25_index_snapshot(bm25_index):
+    snapshot = bm25_index.snapshot
+    segments, doc_freqs, idf = snapshot.segments, snapshot.doc_freqs.copy(), snapshot.idf.copy()
+    bm25_index.add(['new_id'], [[1, 2, 3]])
+    bm25_index.delete(TEST_IDS[:20])
+    bm25_index.compact()
+    # searches which read the previous snapshot see its segments and statistics together
+    assert bm25_index.snapshot is not snapshot
+    assert snapshot.segments == segments
+    assert np.array_equal(snapshot.doc_freqs, doc_freqs)
+    assert np.array_equal(snapshot.idf, idf)
+
+
+def test_bm25_index_maxscore(bm25_index):
+    for query in TEST_QUERIES:
+        for top_k in [1, 3, 10]:
+            ids, scores, docs_scored = bm25_index.search(query, top_k, method='exhaustive')
+            maxscore_ids, maxscore_scores, maxscore_docs_scored = bm25_index.search(query, top_k, method='maxscore')
+            assert maxscore_scores == pytest.approx(scores)
+            assert maxscore_docs_scored <= docs_scored
+
+
+def test_bm25_index_search_batch(bm25_index):
+    bm25_index.delete(TEST_IDS[:10])
+    for method in ['exhaustive', 'maxscore']:
+        batch_ids, batch_scores, batch_docs_scored = bm25_index.search_batch(TEST_QUERIES + [[]], 5, method=method)
+        assert len(batch_ids) == len(batch_scores) == len(batch_docs_scored) == len(TEST_QUERIES) + 1
+        assert batch_ids[-1] == []
+        assert batch_docs_scored[-1] == 0
+        for query, ids, scores, docs_scored in zip(TEST_QUERIES, batch_ids, batch_scores, batch_docs_scored):
+            expected_ids, expected_scores = bm25_index.top_k(query, 5)
+            assert scores == pytest.approx(expected_scores)
+            assert not set(ids) & set(TEST_IDS[:10])
+            assert docs_scored == bm25_index.search(query, 5, method=method)[2]
+
+
+def test_bm25_index_save_load(bm25_index, bm25_index_dir):
+    bm25_index.save(bm25_index_dir)
+    segment_names = [segment.name for segment in bm25_index.segments]
+    loaded = BM25Index.load(bm25_index_dir)
+    assert len(loaded) == len(bm25_index)
+    assert isinstance(loaded.segments[0].doc_ids, np.memmap)
+    for query in TEST_QUERIES:
+        assert_same_scores(loaded, TEST_IDS, TEST_TOKENS, query)
+
+    # append a new segment without rewriting the old ones
+    loaded.max_segments = 10
+    loaded.add(['new_id'], [[1, 2, 3]])
+    loaded.save(bm25_index_dir)
+    assert [segment.name for segment in loaded.segments][:-1] == segment_names
+    reloaded = BM25Index.load(bm25_index_dir)
+    assert len(reloaded) == len(TEST_TOKENS) + 1
+    for query in TEST_QUERIES:
+        assert_same_scores(reloaded, TEST_IDS + ['new_id'], TEST_TOKENS + [[1, 2, 3]], query)
+    # doc_freqs is written to a new file for each generation, and the previous file is removed
+    assert [name for name in os.listdir(bm25_index_dir) if name.startswith('doc_freqs')] == \
+           [f'doc_freqs.{loaded.generation}.npy']
+
+
+def test_bm25_index_save_load_deleted(bm25_index, bm25_index_dir):
+    bm25_index.save(bm25_index_dir)
+    bm25_index.delete(TEST_IDS[:5])
+    bm25_index.save(bm25_index_dir)
+    loaded = BM25Index.load(bm25_index_dir)
+    assert len(loaded) == len(TEST_TOKENS) - 5
+    assert loaded.delete(TEST_IDS[:6]) == TEST_IDS[:5]
+    # tombstones are written to a new file of the generation, and the previous file is removed
+    loaded.save(bm25_index_dir)
+    assert len(BM25Index.load(bm25_index_dir)) == len(TEST_TOKENS) - 6
+    for segment in loaded.segments:
+        assert [name for name in os.listdir(os.path.join(bm25_index_dir, segment.name))
+                if name.startswith('deleted')] == [f'{segment.deleted_file}.npy']
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import pathlib
+from typing import List
+
+import pytest
+from langchain.schema.embeddings import Embeddings
+
+from RAGchain.utils.embed import CachedEmbeddings
+
+root_dir = pathlib.PurePath(os.path.dirname(os.path.realpath(__file__))).parent.parent.parent
+cache_path = os.path.join(root_dir, "resources", "cache", "test_embedding_cache.sqlite")
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.embedded_texts = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded_texts.extend(texts)
+        return [[float(len(text)), 0.5, 1 / 3] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def counting_embeddings():
+    yield CountingEmbeddings()
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(cache_path + suffix):
+            os.remove(cache_path + suffix)
+
+
+def test_cached_embeddings(counting_embeddings):
+    embeddings = CachedEmbeddings(counting_embeddings, cache_path=cache_path, max_memory_size=2)
+    assert embeddings.model_name == 'CountingEmbeddings'
+    vectors = embeddings.embed_documents(['a', 'bb', 'a'])
+    assert vectors[0] == vectors[2]
+    assert vectors[1][0] == 2.0
+    assert counting_embeddings.embedded_texts == ['a', 'bb']
+    assert embeddings.embed_documents(['bb', 'ccc', 'a']) == [vectors[1], [3.0, 0.5, pytest.approx(1 / 3)], vectors[0]]
+    assert counting_embeddings.embedded_texts == ['a', 'bb', 'ccc']
+    # queries are cached separately
+    assert embeddings.embed_query('a') == vectors[0]
+    assert asyncio.run(embeddings.aembed_query('a')) == vectors[0]
+    assert counting_embeddings.embedded_texts == ['a', 'bb', 'ccc', 'a']
+    embeddings.close()
+
+    # embeddings are persisted, and another model name doesn't share them
+    reopened = CachedEmbeddings(counting_embeddings, cache_path=cache_path)
+    assert reopened.embed_documents(['a', 'ccc']) == [vectors[0], [3.0, 0.5, pytest.approx(1 / 3)]]
+    assert counting_embeddings.embedded_texts == ['a', 'bb', 'ccc', 'a']
+    assert reopened.cache_info()['hits'] == 2
+    reopened.close()
+    other_model = CachedEmbeddings(counting_embeddings, model_name='other', cache_path=cache_path)
+    other_model.embed_documents(['a'])
+    assert counting_embeddings.embedded_texts == ['a', 'bb', 'ccc', 'a', 'a']
+    other_model.close()
+
+
+def test_cached_embeddings_float16(counting_embeddings):
+    embeddings = CachedEmbeddings(counting_embeddings, dtype='float16')
+    vector = embeddings.embed_query('a')
+    assert vector == embeddings.embed_query('a')
+    assert vector[2] == pytest.approx(1 / 3, rel=1e-3)
+    with pytest.raises(ValueError):
+        CachedEmbeddings(counting_embeddings, dtype='int8')
@@ -1,3 +1,4 @@
+import asyncio
 import warnings
 from uuid import uuid4
 
@@ -170,3 +171,17 @@ def long_26_test(linker):
     linker.delete_json(LONG_26_TEST_IDS)
     with pytest.warns(NoIdWarning) as record:
         assert linker.get_json(LONG_26_TEST_IDS) == [None for _ in range(26)]
+
+
+def aget_json_test(linker):
+    async def run():
+        linker.put_json(LONG_TEST_IDS, LONG_DB_ORIGIN)
+        with pytest.warns(NoDataWarning):
+            assert await linker.aget_json(LONG_TEST_IDS) == LONG_DB_ORIGIN
+        assert await linker.aget_json(LONG_TEST_IDS[:3]) == LONG_DB_ORIGIN[:3]
+        linker.delete_json([LONG_TEST_IDS[1]])
+        with pytest.warns(NoIdWarning) as record:
+            assert await linker.aget_json(LONG_TEST_IDS[:2]) == [LONG_DB_ORIGIN[0], None]
+        assert f"ID {LONG_TEST_IDS[1]} not found in Linker" in str(record[0].message)
+
+    asyncio.run(run())
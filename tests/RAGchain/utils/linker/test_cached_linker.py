@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+import test_base_linker
+from RAGchain.utils.linker import JsonLinker, CachedLinker, NoIdWarning, NoDataWarning
+
+TEST_UUID_IDS = test_base_linker.TEST_UUID_IDS
+TEST_UUID_STR_IDS = test_base_linker.TEST_UUID_STR_IDS
+TEST_STR_IDS = test_base_linker.TEST_STR_IDS
+TEST_DB_ORIGIN = test_base_linker.TEST_DB_ORIGIN
+
+
+@pytest.fixture
+def cached_linker():
+    json_linker = JsonLinker(allow_multiple_instances=True)
+    cached_linker = CachedLinker(json_linker, max_size=4, ttl=None)
+    yield cached_linker
+    cached_linker.flush_db()
+
+
+def test_get_json(cached_linker):
+    test_base_linker.get_json_test(cached_linker, TEST_UUID_IDS, TEST_UUID_STR_IDS, TEST_STR_IDS)
+
+
+def test_no_id_warning(cached_linker):
+    test_base_linker.no_id_warning_test(cached_linker)
+
+
+def test_no_data_warning(cached_linker):
+    test_base_linker.no_data_warning_test(cached_linker)
+
+
+def test_no_data_warning2(cached_linker):
+    test_base_linker.no_data_warning_test2(cached_linker)
+
+
+def test_delete(cached_linker):
+    test_base_linker.delete_test(cached_linker)
+
+
+def test_long(cached_linker):
+    test_base_linker.long_test(cached_linker)
+
+
+def test_long_26(cached_linker):
+    test_base_linker.long_26_test(cached_linker)
+
+
+def test_aget_json(cached_linker):
+    test_base_linker.aget_json_test(cached_linker)
+
+
+def test_cache_hit(cached_linker):
+    cached_linker.put_json(TEST_STR_IDS, [TEST_DB_ORIGIN[0]])
+    assert cached_linker.get_json(TEST_STR_IDS) == [TEST_DB_ORIGIN[0]]
+    # changes in the wrapped linker are not visible until invalidation
+    cached_linker.linker.put_json(TEST_STR_IDS, [TEST_DB_ORIGIN[1]])
+    assert cached_linker.get_json(TEST_STR_IDS) == [TEST_DB_ORIGIN[0]]
+    assert cached_linker.cache_info()['hits'] == 1
+    assert cached_linker.cache_info()['misses'] == 1
+    cached_linker.invalidate(TEST_STR_IDS)
+    assert cached_linker.get_json(TEST_STR_IDS) == [TEST_DB_ORIGIN[1]]
+
+    # negative cache
+    with pytest.warns(NoIdWarning):
+        assert cached_linker.get_json(['fake_id']) == [None]
+    cached_linker.linker.put_json(['fake_id'], [TEST_DB_ORIGIN[0]])
+    with pytest.warns(NoIdWarning):
+        assert cached_linker.get_json(['fake_id']) == [None]
+    cached_linker.put_json(['fake_id'], [None])
+    with pytest.warns(NoDataWarning):
+        assert cached_linker.get_json(['fake_id']) == [None]
+    with pytest.warns(NoDataWarning):
+        assert cached_linker.get_json(['fake_id']) == [None]
+
+
+def test_cache_eviction(cached_linker):
+    ids = [f'test_id_{i}' for i in range(6)]
+    cached_linker.put_json(ids, [TEST_DB_ORIGIN[i % 3] for i in range(6)])
+    assert cached_linker.get_json(ids) == [TEST_DB_ORIGIN[i % 3] for i in range(6)]
+    assert cached_linker.cache_info()['size'] == 4
+    cached_linker.get_json(ids[2:])
+    assert cached_linker.cache_info()['hits'] == 4
+
+    cached_linker.ttl = 0.01
+    cached_linker.clear_cache()
+    cached_linker.get_json(ids[:2])
+    time.sleep(0.02)
+    cached_linker.get_json(ids[:2])
+    assert cached_linker.cache_info()['hits'] == 0
+    assert cached_linker.cache_info()['misses'] == 4
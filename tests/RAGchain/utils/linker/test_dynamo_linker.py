@@ -44,3 +44,7 @@ def test_long(dynamo_db):
 
 def test_long_26(dynamo_db):
     test_base_linker.long_26_test(dynamo_db)
+
+
+def test_aget_json(dynamo_db):
+    test_base_linker.aget_json_test(dynamo_db)
@@ -42,3 +42,7 @@ def test_long(json_linker):
 
 def test_long_26(json_linker):
     test_base_linker.long_26_test(json_linker)
+
+
+def test_aget_json(json_linker):
+    test_base_linker.aget_json_test(json_linker)
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+import test_base_linker
+from RAGchain.utils.linker import JsonLinker, DBOriginTable, NoDataWarning
+
+TEST_DB_ORIGIN = test_base_linker.TEST_DB_ORIGIN
+
+
+@pytest.fixture
+def json_linker():
+    json_linker = JsonLinker(allow_multiple_instances=True)
+    yield json_linker
+    json_linker.flush_db()
+
+
+def test_make_key():
+    key = DBOriginTable.make_key(TEST_DB_ORIGIN[0])
+    assert len(key) == DBOriginTable.KEY_LENGTH
+    assert key == DBOriginTable.make_key(dict(reversed(list(TEST_DB_ORIGIN[0].items()))))
+    assert key != DBOriginTable.make_key(TEST_DB_ORIGIN[1])
+
+
+def test_resolve(json_linker):
+    writer_table = DBOriginTable()
+    origin_ids, origin_keys = zip(*[writer_table.register(db_origin) for db_origin in TEST_DB_ORIGIN[:2]])
+    json_linker.put_json(list(origin_ids) + ['test_id_1', 'test_id_2', 'test_id_3'],
+                         TEST_DB_ORIGIN[:2] + [origin_keys[0], origin_keys[1], origin_keys[0]])
+
+    # other process resolves origin keys from linker
+    reader_table = DBOriginTable()
+    values = json_linker.get_json(['test_id_1', 'test_id_2', 'test_id_3'])
+    assert values == [origin_keys[0], origin_keys[1], origin_keys[0]]
+    resolved = reader_table.resolve(json_linker, values + [TEST_DB_ORIGIN[2], None])
+    assert resolved == [TEST_DB_ORIGIN[0], TEST_DB_ORIGIN[1], TEST_DB_ORIGIN[0], TEST_DB_ORIGIN[2], None]
+    assert resolved[0] is resolved[2]
+
+    with pytest.warns(NoDataWarning):
+        assert reader_table.resolve(json_linker, ['unknown_key']) == [None]
+
+
+def test_aresolve(json_linker):
+    writer_table = DBOriginTable()
+    origin_id, origin_key = writer_table.register(TEST_DB_ORIGIN[0])
+    json_linker.put_json([origin_id, 'test_id_1'], [TEST_DB_ORIGIN[0], origin_key])
+
+    reader_table = DBOriginTable()
+    values = asyncio.run(json_linker.aget_json(['test_id_1']))
+    assert asyncio.run(reader_table.aresolve(json_linker, values + [None])) == [TEST_DB_ORIGIN[0], None]
+    with pytest.warns(NoDataWarning):
+        assert asyncio.run(reader_table.aresolve(json_linker, ['unknown_key'])) == [None]
@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 
 import test_base_linker
@@ -43,3 +45,22 @@ def test_long(redis_db):
 
 def test_long_26(redis_db):
     test_base_linker.long_26_test(redis_db)
+
+
+def test_aget_json(redis_db):
+    test_base_linker.aget_json_test(redis_db)
+
+
+def test_aget_json_event_loops(redis_db):
+    # each asyncio.run has a new event loop, so the async client of the closed loop must not be reused
+    test_base_linker.aget_json_test(redis_db)
+    test_base_linker.aget_json_test(redis_db)
+
+    async def run():
+        client = redis_db.get_async_client()
+        assert redis_db.get_async_client() is client
+        await redis_db.aclose()
+        assert redis_db.get_async_client() is not client
+        await redis_db.aclose()
+
+    asyncio.run(run())
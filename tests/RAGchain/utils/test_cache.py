@@ -0,0 +1,64 @@
+import os
+import pathlib
+import time
+
+import pytest
+
+from RAGchain.utils.cache import InMemoryCache, SQLiteCache, make_cache_key, normalize_query
+
+root_dir = pathlib.PurePath(os.path.dirname(os.path.realpath(__file__))).parent.parent
+sqlite_path = os.path.join(root_dir, "resources", "cache", "test_query_cache.sqlite")
+
+
+@pytest.fixture
+def memory_cache():
+    yield InMemoryCache(max_size=2, ttl=None)
+
+
+@pytest.fixture
+def sqlite_cache():
+    cache = SQLiteCache(sqlite_path, max_size=2, ttl=None)
+    yield cache
+    cache.close()
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(sqlite_path + suffix):
+            os.remove(sqlite_path + suffix)
+
+
+def test_cache_key():
+    assert normalize_query('  What is\tRAGchain?\n') == normalize_query('what is ragchain?')
+    assert make_cache_key('q', {'top_k': 5, 'p': 1}, 0) == make_cache_key('q', {'p': 1, 'top_k': 5}, 0)
+    assert make_cache_key('q', {'top_k': 5}, 0) != make_cache_key('q', {'top_k': 5}, 1)
+
+
+def cache_test(cache):
+    assert cache.get('a') is None
+    cache.set('a', 'answer a')
+    cache.set('b', ['answer', 'b'])
+    assert cache.get('a') == 'answer a'
+    # b is the least recently used
+    cache.set('c', 'answer c')
+    assert cache.get('b') is None
+    assert cache.get('c') == 'answer c'
+    assert cache.cache_info() == {'hits': 2, 'misses': 2, 'size': 2}
+
+    cache.delete('a')
+    assert cache.get('a', 'default') == 'default'
+    cache.set('d', 'answer d', ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('d') is None
+    cache.clear()
+    assert cache.cache_info() == {'hits': 0, 'misses': 0, 'size': 0}
+
+
+def test_memory_cache(memory_cache):
+    cache_test(memory_cache)
+
+
+def test_sqlite_cache(sqlite_cache):
+    cache_test(sqlite_cache)
+    sqlite_cache.set('a', {'answer': 'a'})
+    # cached entries are persisted to the file
+    reopened = SQLiteCache(sqlite_path)
+    assert reopened.get('a') == {'answer': 'a'}
+    reopened.close()
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+from RAGchain.utils.executor import SharedExecutor, get_executor, set_executor
+
+
+@pytest.fixture
+def executor():
+    executor = SharedExecutor(max_workers=2, thread_name_prefix='test_executor', max_queue_size=2)
+    yield executor
+    executor.shutdown()
+
+
+def test_run(executor):
+    timings = []
+    executor.add_timing_hook(lambda name, seconds: timings.append((name, seconds)))
+    assert executor.run([lambda i=i: i * 2 for i in range(10)], name='double') == [i * 2 for i in range(10)]
+    assert len(timings) == 10
+    assert all(name == 'double' and seconds >= 0 for name, seconds in timings)
+    # a single task runs in the calling thread
+    assert executor.run([lambda: threading.current_thread().name]) == [threading.current_thread().name]
+    assert executor.run([]) == []
+
+
+def test_run_in_worker(executor):
+    thread_names = executor.run([lambda: threading.current_thread().name] * 2)
+    assert all(name.startswith('test_executor') for name in thread_names)
+
+    # nested fan-out from every worker runs inline instead of waiting for the busy pool
+    def nested():
+        return executor.run([lambda: threading.current_thread().name] * 3)
+
+    results = executor.run([nested, nested])
+    for nested_names in results:
+        assert len(set(nested_names)) == 1
+
+
+def test_run_exception(executor):
+    def fail():
+        time.sleep(0.01)
+        raise ValueError("task failed")
+
+    with pytest.raises(ValueError):
+        executor.run([fail, lambda: 1])
+    # queue slots are released after failure
+    assert executor.run([lambda: 1] * 4) == [1] * 4
+
+
+def test_set_executor():
+    previous = get_executor()
+    assert get_executor() is previous
+    new_executor = SharedExecutor(max_workers=1)
+    set_executor(new_executor)
+    assert get_executor() is new_executor
+    with pytest.raises(RuntimeError):
+        previous.submit(lambda: 1)
@@ -31,3 +31,10 @@ def test_chroma_slim(chroma_slim):
     retrieved_docs = chroma_slim.similarity_search(query='I want to surf on the ocean.', k=top_k)
     assert len(retrieved_docs) == top_k
     assert retrieved_docs[0].metadata['passage_id'] == 'id-2'
+
+
+def test_chroma_slim_where_filter(chroma_slim):
+    chroma_slim.add_passages(PASSAGES)
+    where = chroma_slim.where_filter(filepath=['filepath-1', 'filepath-3'], importance=[0])
+    retrieved_docs = chroma_slim.similarity_search(query='I want to surf on the ocean.', k=3, filter=where)
+    assert {doc.metadata['passage_id'] for doc in retrieved_docs} == {'id-1', 'id-3'}
@@ -0,0 +1,177 @@
+import os
+import re
+import shutil
+import zlib
+from typing import List
+
+import numpy as np
+import pytest
+from langchain.schema.embeddings import Embeddings
+
+from RAGchain.schema import Passage
+from RAGchain.utils.vectorstore import NumpySlim
+from base import PASSAGES, root_dir
+
+save_path = os.path.join(root_dir, "resources", "test_numpy_slim")
+
+
+class BagOfWordsEmbeddings(Embeddings):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = [0.0] * 64
+        for word in re.findall(r'\w+', text.lower()):
+            vector[zlib.crc32(word.encode('utf-8')) % 64] += 1.0
+        return vector
+
+
+@pytest.fixture
+def numpy_slim():
+    yield NumpySlim(BagOfWordsEmbeddings(), save_path=save_path)
+    if os.path.exists(save_path):
+        shutil.rmtree(save_path)
+
+
+def test_numpy_slim(numpy_slim):
+    numpy_slim.add_passages(PASSAGES)
+    top_k = 2
+    retrieved_docs = numpy_slim.similarity_search(query='I want to surf on the ocean.', k=top_k)
+    assert len(retrieved_docs) == top_k
+    assert retrieved_docs[0].metadata['passage_id'] == 'id-2'
+    ids, scores = numpy_slim.search(numpy_slim.embeddings.embed_query('This is about my dog.'), k=5)
+    assert ids[0] == 'id-1'
+    assert len(ids) == len(scores) == 3
+    assert scores == sorted(scores, reverse=True)
+
+    ids_list, scores_list = numpy_slim.search_batch(
+        numpy_slim.embeddings.embed_documents(['surf on the beach', 'go to church']), k=1)
+    assert ids_list == [['id-2'], ['id-3']]
+
+    # replace and delete are persisted
+    numpy_slim.add_passages([Passage(id='id-1', content='Do you want to go to the beach?', filepath='filepath-1')])
+    numpy_slim.delete(['id-3', 'not-exist'])
+    reloaded = NumpySlim(BagOfWordsEmbeddings(), save_path=save_path, mmap=True)
+    assert len(reloaded) == 2
+    ids, _ = reloaded.search(reloaded.embeddings.embed_query('go to church'), k=5)
+    assert ids[0] == 'id-1'
+    assert 'id-3' not in ids
+
+
+def test_numpy_slim_allowed_ids(numpy_slim):
+    numpy_slim.add_passages(PASSAGES)
+    query = numpy_slim.embeddings.embed_query('I want to surf on the ocean.')
+    ids, scores = numpy_slim.search(query, k=5, allowed_ids={'id-1', 'id-3', 'not-exist'})
+    assert sorted(ids) == ['id-1', 'id-3']
+    all_ids, all_scores = numpy_slim.search(query, k=5)
+    assert scores == [score for _id, score in zip(all_ids, all_scores) if _id in ids]
+    assert numpy_slim.search(query, k=5, allowed_ids=set()) == ([], [])
+    assert sorted(numpy_slim.ids()) == ['id-1', 'id-2', 'id-3']
+
+
+def test_numpy_slim_iter_search(numpy_slim):
+    passages = [Passage(id=f'id-{i}', content=f'passage number {i} ' * (i + 1), filepath='filepath')
+                for i in range(10)]
+    numpy_slim.add_passages(passages)
+    numpy_slim.delete(['id-3'])
+    query = numpy_slim.embeddings.embed_query('passage number 7')
+    cursor = numpy_slim.iter_search(query, page_size=3)
+    results = list(cursor)
+    assert len(results) == 9
+    ids, scores = numpy_slim.search(query, k=9)
+    assert [score for _, score in results] == pytest.approx(scores)
+    assert 'id-3' not in [_id for _id, _ in results]
+
+
+def test_numpy_slim_compaction(numpy_slim):
+    passages = [Passage(id=f'id-{i}', content=f'passage number {i} ' * (i + 1), filepath='filepath')
+                for i in range(10)]
+    numpy_slim.add_passages(passages)
+    query = numpy_slim.embeddings.embed_query('passage number 7')
+    all_ids, all_scores = numpy_slim.search(query, k=10)
+    version = numpy_slim.version
+    numpy_slim.delete(['id-0', 'id-1', 'id-2'])
+    assert numpy_slim.version > version
+    # compaction rewrote the files without deleted rows
+    assert len(numpy_slim._ids) == 7
+    ids, scores = numpy_slim.search(query, k=3)
+    expected = [(_id, score) for _id, score in zip(all_ids, all_scores) if _id not in ['id-0', 'id-1', 'id-2']]
+    assert scores == pytest.approx([score for _, score in expected[:3]])
+    reloaded = NumpySlim(BagOfWordsEmbeddings(), save_path=save_path)
+    assert reloaded.search(query, k=3) == (ids, scores)
+    assert len([name for name in os.listdir(save_path) if name.startswith('vectors')]) == 1
+    # uid and version are loaded from save_path
+    assert (reloaded.uid, reloaded.version) == (numpy_slim.uid, numpy_slim.version)
+    reloaded.delete(['id-3'])
+    assert NumpySlim(BagOfWordsEmbeddings(), save_path=save_path).version > numpy_slim.version
+
+
+def test_numpy_slim_interrupted_write(numpy_slim):
+    numpy_slim.add_passages(PASSAGES)
+    # simulate a write interrupted after the vectors were written
+    with open(os.path.join(save_path, 'vectors.0.f32'), 'ab') as f:
+        f.write(np.ones(64, dtype=np.float32).tobytes())
+    with open(os.path.join(save_path, 'rows.0.jsonl'), 'a') as f:
+        f.write('["add", "id-4')
+    reloaded = NumpySlim(BagOfWordsEmbeddings(), save_path=save_path)
+    assert len(reloaded) == 3
+    reloaded.add_passages([Passage(id='id-5', content='I like surfing.', filepath='filepath-5')])
+    reloaded = NumpySlim(BagOfWordsEmbeddings(), save_path=save_path)
+    assert reloaded.search(reloaded.embeddings.embed_query('I like surfing.'), k=1)[0] == ['id-5']
+
+
+def test_numpy_slim_hnsw(numpy_slim):
+    pytest.importorskip("hnswlib")
+    hnsw_slim = NumpySlim(BagOfWordsEmbeddings(), save_path=os.path.join(save_path, 'hnsw'), index_type='hnsw')
+    hnsw_slim.add_passages(PASSAGES)
+    ids, scores = hnsw_slim.search(hnsw_slim.embeddings.embed_query('I want to surf on the ocean.'), k=5)
+    assert ids[0] == 'id-2'
+    assert len(ids) == 3
+    hnsw_slim.save_index()
+    hnsw_slim.delete(['id-2'])
+    reloaded = NumpySlim(BagOfWordsEmbeddings(), save_path=os.path.join(save_path, 'hnsw'), index_type='hnsw')
+    ids, _ = reloaded.search(reloaded.embeddings.embed_query('I want to surf on the ocean.'), k=5)
+    assert 'id-2' not in ids
+
+
+@pytest.mark.parametrize('quantization', ['int8', 'binary'])
+def test_numpy_slim_quantization(numpy_slim, quantization):
+    path = os.path.join(save_path, quantization)
+    quantized_slim = NumpySlim(BagOfWordsEmbeddings(), save_path=path, quantization=quantization)
+    assert quantized_slim.mmap is True
+    rng = np.random.default_rng(42)
+    # clustered vectors, like embeddings of similar passages
+    centers = rng.standard_normal((40, 256)).astype(np.float32)
+    vectors = (centers[rng.integers(0, 40, 2000)] + 0.6 * rng.standard_normal((2000, 256))).astype(np.float32)
+    quantized_slim.add_vectors([f'id-{i}' for i in range(len(vectors))], vectors.tolist())
+    queries = vectors[:20] + 0.3 * rng.standard_normal((20, 256)).astype(np.float32)
+
+    # rescored scores are exact cosine similarity
+    ids, scores = quantized_slim.search(queries[0].tolist(), k=5)
+    assert ids[0] == 'id-0'
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = normalized[[int(_id.split('-')[1]) for _id in ids]] @ (queries[0] / np.linalg.norm(queries[0]))
+    assert scores == pytest.approx(expected.tolist(), abs=1e-5)
+
+    report = quantized_slim.quantization_report(queries.tolist(), k=10)
+    assert report['recall'] >= 0.9
+    assert report['compression'] >= (3.0 if quantization == 'int8' else 30.0)
+
+    quantized_slim.delete([f'id-{i}' for i in range(1000)])
+    assert len(quantized_slim._ids) == 1000
+    ids_list, _ = quantized_slim.search_batch(queries[:2].tolist(), k=3)
+    assert all(int(_id.split('-')[1]) >= 1000 for ids in ids_list for _id in ids)
+    reloaded = NumpySlim(BagOfWordsEmbeddings(), save_path=path, quantization=quantization)
+    assert reloaded.search_batch(queries[:2].tolist(), k=3)[0] == ids_list
+    assert np.array_equal(reloaded._codes[:1000], quantized_slim._codes[:1000])
+
+
+def test_numpy_slim_quantization_options():
+    with pytest.raises(ValueError):
+        NumpySlim(BagOfWordsEmbeddings(), quantization='int8')
+    with pytest.raises(ValueError):
+        NumpySlim(BagOfWordsEmbeddings(), save_path=save_path, quantization='int4')
+    with pytest.raises(ValueError):
+        NumpySlim(BagOfWordsEmbeddings(), save_path=save_path, quantization='binary', index_type='hnsw')
+    with pytest.raises(ValueError):
+        NumpySlim(BagOfWordsEmbeddings(), save_path=save_path, quantization='int8', rescore_factor=0)